@@ -0,0 +1,493 @@
+"""
+adb_client.py
+
+talks to the adb server directly over its smart socket protocol instead of
+spawning a new adb process for every command
+
+a request is a 4 digit hex length followed by the service string. The server
+replies with OKAY or FAIL (followed by a hex length prefixed error message).
+host services are answered by the server itself, anything else needs the
+connection switched to a device first with host:transport:<serial>
+"""
+import asyncio
+import shlex
+import struct
+import subprocess
+from dataclasses import dataclass, field
+from typing import AsyncGenerator, Dict, List, Tuple
+
+from adblib.errors import AdbServerUnavailableError, RemoteDeviceError
+
+ADB_DEFAULT_HOST = "127.0.0.1"
+ADB_DEFAULT_PORT = 5037
+
+# bytes read at a time from the socket when draining a stream
+READ_CHUNK_SIZE = 64 * 1024
+
+# shell protocol v2 packet ids. Each packet is [id: 1 byte][length: uint32 le][data]
+SHELL_ID_STDIN = 0
+SHELL_ID_STDOUT = 1
+SHELL_ID_STDERR = 2
+SHELL_ID_EXIT = 3
+SHELL_ID_CLOSE_STDIN = 4
+
+# appended to legacy shell commands so the exit code can be recovered from stdout
+_LEGACY_EXIT_MARKER = b"\x1f__ADB_EXIT__:"
+
+
+def quote_args(args: List[str]) -> str:
+    """joins the arguments into a single command line the device shell understands
+
+    Args:
+        args (List[str]): the command and its arguments
+
+    Returns:
+        str: the quoted command line
+    """
+    return " ".join(shlex.quote(arg) for arg in args)
+
+
+@dataclass
+class AdbDevice:
+    """a device from the long format device list (host:devices-l)"""
+
+    serial: str
+    state: str
+    product: str = ""
+    model: str = ""
+    device: str = ""
+    usb: str = ""
+    transport_id: str = ""
+    extra: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def display_model(self) -> str:
+        """the model with the underscores adb puts in place of spaces removed ie. Quest 2"""
+        return self.model.replace("_", " ")
+
+
+def parse_device_list(output: str) -> List[AdbDevice]:
+    """parses the long format device list
+
+    each line looks like:
+    1WMHH000X00000         device usb:1-1 product:hollywood model:Quest_2 device:hollywood transport_id:1
+
+    Args:
+        output (str): the reply from host:devices-l or host:track-devices-l
+
+    Returns:
+        List[AdbDevice]: one per line
+    """
+    devices: List[AdbDevice] = []
+    known_fields = ("product", "model", "device", "usb", "transport_id")
+    for line in output.splitlines():
+        words = line.split()
+        if len(words) < 2 or line.startswith(("List of devices", "*")):
+            continue
+        device = AdbDevice(serial=words[0], state="")
+        state_words: List[str] = []
+        for word in words[1:]:
+            key, sep, value = word.partition(":")
+            if not sep:
+                # states such as "no permissions" can be more than one word
+                state_words.append(word)
+            elif key in known_fields:
+                setattr(device, key, value)
+            else:
+                device.extra[key] = value
+        device.state = " ".join(state_words)
+        devices.append(device)
+    return devices
+
+
+def _failed_result(service: str, message: str) -> subprocess.CompletedProcess:
+    """builds a CompletedProcess from a FAIL response so it can be raised as a RemoteDeviceError
+
+    Args:
+        service (str): the service that was requested
+        message (str): the message the server sent back
+
+    Returns:
+        subprocess.CompletedProcess:
+    """
+    return subprocess.CompletedProcess(
+        args=[service], returncode=1, stdout=b"", stderr=message.encode()
+    )
+
+
+class AdbConnection:
+    """a single socket connection to the adb server"""
+
+    def __init__(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self.reader = reader
+        self.writer = writer
+
+    @staticmethod
+    async def open(host: str, port: int) -> "AdbConnection":
+        """opens a new connection to the adb server
+
+        Args:
+            host (str): the address of the adb server
+            port (int): the port the adb server is listening on
+
+        Raises:
+            AdbServerUnavailableError: if nothing is listening on host:port
+
+        Returns:
+            AdbConnection:
+        """
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+        except OSError as err:
+            raise AdbServerUnavailableError(host, port, err.__str__())
+        return AdbConnection(reader, writer)
+
+    async def send_request(self, service: str) -> None:
+        """sends the service request and waits for the OKAY status
+
+        Args:
+            service (str): the service string ie. host:version
+
+        Raises:
+            RemoteDeviceError: if the server responded with FAIL
+        """
+        payload = service.encode()
+        self.writer.write(b"%04x" % len(payload) + payload)
+        await self.writer.drain()
+        await self.read_status(service)
+
+    async def read_status(self, service: str) -> None:
+        """reads the OKAY/FAIL status that follows a request
+
+        Args:
+            service (str): the service that was requested. Used in the error
+
+        Raises:
+            RemoteDeviceError: if the server responded with FAIL
+        """
+        status = await self.read_exactly(4)
+        if status == b"OKAY":
+            return
+        if status == b"FAIL":
+            message = (await self.read_hex_prefixed()).decode(errors="replace")
+        else:
+            message = f"unexpected response {status!r}"
+        raise RemoteDeviceError(_failed_result(service, message))
+
+    async def read_exactly(self, size: int) -> bytes:
+        """reads exactly size bytes from the connection
+
+        Raises:
+            asyncio.IncompleteReadError: if the connection closed early
+        """
+        return await self.reader.readexactly(size)
+
+    async def read_hex_prefixed(self) -> bytes:
+        """reads a 4 digit hex length followed by that many bytes"""
+        length = int(await self.read_exactly(4), 16)
+        return await self.read_exactly(length)
+
+    async def read_all(self) -> bytes:
+        """reads from the connection until the other end closes it"""
+        chunks: List[bytes] = []
+        while True:
+            chunk = await self.reader.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def write(self, data: bytes | memoryview) -> None:
+        self.writer.write(data)
+
+    async def drain(self) -> None:
+        await self.writer.drain()
+
+    async def close(self) -> None:
+        """closes the socket. errors from an already broken connection are ignored"""
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+    async def __aenter__(self) -> "AdbConnection":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+
+class AdbClient:
+    def __init__(self, host: str = ADB_DEFAULT_HOST, port: int = ADB_DEFAULT_PORT):
+        """asyncio client for the adb server. Each request opens its own connection
+        so a client instance can be shared between tasks
+
+        Args:
+            host (str, optional): address of the adb server. Defaults to ADB_DEFAULT_HOST.
+            port (int, optional): port of the adb server. Defaults to ADB_DEFAULT_PORT.
+        """
+        self.host = host
+        self.port = port
+
+    async def connect(self) -> AdbConnection:
+        """opens a new connection to the adb server
+
+        Raises:
+            AdbServerUnavailableError: if the server is not running
+
+        Returns:
+            AdbConnection:
+        """
+        return await AdbConnection.open(self.host, self.port)
+
+    async def host_query(self, service: str) -> str:
+        """sends a host service and reads back its hex length prefixed reply
+
+        Args:
+            service (str): ie. host:devices
+
+        Returns:
+            str: the decoded reply
+        """
+        async with await self.connect() as conn:
+            await conn.send_request(service)
+            reply = await conn.read_hex_prefixed()
+        return reply.decode()
+
+    async def version(self) -> int:
+        """gets the internal version of the adb server
+
+        Returns:
+            int: the server version
+        """
+        return int(await self.host_query("host:version"), 16)
+
+    async def features(self, serial: str) -> List[str]:
+        """gets the features both the device and the adb server support
+
+        Args:
+            serial (str): the device to ask about
+
+        Returns:
+            List[str]: ie. shell_v2, cmd, sendrecv_v2
+        """
+        reply = await self.host_query(f"host-serial:{serial}:features")
+        return [feature for feature in reply.strip().split(",") if feature]
+
+    async def devices(self) -> List[Tuple[str, str]]:
+        """lists the devices the adb server knows about
+
+        Returns:
+            List[Tuple[str, str]]: (serial, state) for each device. state is device, offline, unauthorized etc.
+        """
+        output = await self.host_query("host:devices")
+        devices: List[Tuple[str, str]] = []
+        for line in output.splitlines():
+            if "\t" not in line:
+                continue
+            serial, state = line.split("\t", 1)
+            devices.append((serial, state.strip()))
+        return devices
+
+    async def track_devices(self) -> AsyncGenerator[List[AdbDevice], None]:
+        """keeps a host:track-devices-l connection open and yields the full device list
+        every time the server reports a change. The first list is sent straight away
+
+        the generator finishes when the server closes the connection
+
+        Yields:
+            List[AdbDevice]: the devices currently attached
+        """
+        async with await self.connect() as conn:
+            await conn.send_request("host:track-devices-l")
+            while True:
+                try:
+                    reply = await conn.read_hex_prefixed()
+                except asyncio.IncompleteReadError:
+                    return
+                yield parse_device_list(reply.decode())
+
+    async def transport(self, serial: str) -> AdbConnection:
+        """opens a connection that has been switched over to the device
+
+        Args:
+            serial (str): the serial of the device
+
+        Raises:
+            RemoteDeviceError: if the device could not be found
+
+        Returns:
+            AdbConnection: ready for a device service to be requested on it
+        """
+        conn = await self.connect()
+        try:
+            await conn.send_request(f"host:transport:{serial}")
+        except BaseException:
+            await conn.close()
+            raise
+        return conn
+
+    async def open_service(self, serial: str, service: str) -> AdbConnection:
+        """opens a device service ie. exec:cat and returns the raw stream
+
+        Args:
+            serial (str): the serial of the device
+            service (str): the device service to open
+
+        Returns:
+            AdbConnection: the connection to read and write the raw stream with
+        """
+        conn = await self.transport(serial)
+        try:
+            await conn.send_request(service)
+        except BaseException:
+            await conn.close()
+            raise
+        return conn
+
+    async def exec_out(self, serial: str, command: str, stdin: bytes = b"") -> bytes:
+        """runs the command with exec: which gives a raw binary safe stream with
+        no pty and no exit code
+
+        Args:
+            serial (str): the serial of the device
+            command (str): the command line to run
+            stdin (bytes, optional): data written to the command before reading. Defaults to b"".
+
+        Returns:
+            bytes: everything the command wrote to stdout
+        """
+        async with await self.open_service(serial, f"exec:{command}") as conn:
+            if stdin:
+                conn.write(stdin)
+                await conn.drain()
+            return await conn.read_all()
+
+    async def shell(self, serial: str, command: str) -> subprocess.CompletedProcess:
+        """runs the command in the device shell and waits for it to exit
+
+        uses the v2 shell protocol so stdout, stderr and the exit code are kept apart.
+        falls back to the legacy shell: service on devices that do not support it
+
+        Args:
+            serial (str): the serial of the device
+            command (str): the command line to run
+
+        Returns:
+            subprocess.CompletedProcess: returncode, stdout and stderr from the device
+        """
+        try:
+            conn = await self.open_service(serial, f"shell,v2,raw:{command}")
+        except RemoteDeviceError as err:
+            # adbd closes the stream straight away on services it doesnt know about
+            if "closed" not in err.message:
+                raise err
+            return await self._legacy_shell(serial, command)
+        async with conn:
+            stdout, stderr, returncode = await _read_shell_v2(conn)
+        return subprocess.CompletedProcess(
+            args=[command], returncode=returncode, stdout=stdout, stderr=stderr
+        )
+
+    async def _legacy_shell(
+        self, serial: str, command: str
+    ) -> subprocess.CompletedProcess:
+        """runs the command over shell: and recovers the exit code from a marker
+        echoed after the command. stderr is merged into stdout by the device
+        """
+        marker = _LEGACY_EXIT_MARKER.decode()
+        wrapped = f"{command}; printf '{marker}%d' $?"
+        async with await self.open_service(serial, f"shell:{wrapped}") as conn:
+            output = await conn.read_all()
+        output, _, code = output.rpartition(_LEGACY_EXIT_MARKER)
+        try:
+            returncode = int(code)
+        except ValueError:
+            returncode = -1
+        return subprocess.CompletedProcess(
+            args=[command], returncode=returncode, stdout=output, stderr=b""
+        )
+
+    async def shell_lines(
+        self, serial: str, command: str
+    ) -> AsyncGenerator[bytes, None]:
+        """runs the command in the device shell and yields stdout a line at a time
+
+        Args:
+            serial (str): the serial of the device
+            command (str): the command line to run
+
+        Raises:
+            RemoteDeviceError: if the command exited with a non zero code
+
+        Yields:
+            bytes: each line of stdout including the line ending
+        """
+        stderr: List[bytes] = []
+        returncode = -1
+        pending = b""
+        async with await self.open_service(serial, f"shell,v2,raw:{command}") as conn:
+            async for packet_id, data in _iter_shell_v2_packets(conn):
+                if packet_id == SHELL_ID_STDOUT:
+                    pending += data
+                    *lines, pending = pending.split(b"\n")
+                    for line in lines:
+                        yield line + b"\n"
+                elif packet_id == SHELL_ID_STDERR:
+                    stderr.append(data)
+                elif packet_id == SHELL_ID_EXIT:
+                    returncode = data[0] if data else -1
+                    break
+        if pending:
+            yield pending
+        if returncode != 0:
+            raise RemoteDeviceError(
+                subprocess.CompletedProcess(
+                    args=[command],
+                    returncode=returncode,
+                    stdout=b"",
+                    stderr=b"".join(stderr),
+                )
+            )
+
+    async def kill_server(self) -> None:
+        """asks the adb server to shut down"""
+        async with await self.connect() as conn:
+            await conn.send_request("host:kill")
+
+
+async def _iter_shell_v2_packets(
+    conn: AdbConnection,
+) -> AsyncGenerator[Tuple[int, bytes], None]:
+    """yields (packet id, data) from a v2 shell stream until the connection closes"""
+    while True:
+        try:
+            header = await conn.read_exactly(5)
+        except asyncio.IncompleteReadError:
+            return
+        packet_id, length = struct.unpack("<BI", header)
+        data = await conn.read_exactly(length) if length else b""
+        yield packet_id, data
+
+
+async def _read_shell_v2(conn: AdbConnection) -> Tuple[bytes, bytes, int]:
+    """drains a v2 shell stream
+
+    Returns:
+        Tuple[bytes, bytes, int]: stdout, stderr and the exit code (-1 if the stream ended without one)
+    """
+    stdout: List[bytes] = []
+    stderr: List[bytes] = []
+    returncode = -1
+    async for packet_id, data in _iter_shell_v2_packets(conn):
+        if packet_id == SHELL_ID_STDOUT:
+            stdout.append(data)
+        elif packet_id == SHELL_ID_STDERR:
+            stderr.append(data)
+        elif packet_id == SHELL_ID_EXIT:
+            returncode = data[0] if data else -1
+            break
+    return b"".join(stdout), b"".join(stderr), returncode
@@ -2,18 +2,114 @@
 adb_interface.py
 
 interfaces with the Android Debugging Bridge
+
+every operation is a coroutine so it can be awaited from the event loop without holding
+up the UI. The plain functions are a blocking facade over them for code that runs on
+its own thread such as MonitorQuestDevices. Calling the facade from the event loop
+thread freezes the UI for the length of the call, set WARN_BLOCKING_CALLS to log when
+that happens
 """
+import os
+import re
 import subprocess
 import asyncio
-from typing import AsyncGenerator, List
-
-from adblib.errors import RemoteDeviceError, UnInstallError
+import contextlib
+import contextvars
+import logging
+import threading
+import time
+import uuid
+import weakref
+import concurrent.futures
+from typing import (
+    Any,
+    AsyncGenerator,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Coroutine,
+    Dict,
+    Generator,
+    List,
+    Tuple,
+    TypeVar,
+)
+
+from adblib import (
+    adb_client,
+    adb_sync,
+    fan_out,
+    flight_recorder,
+    retry,
+    shell_pool,
+    subprocess_runner,
+    tar_stream,
+)
+from adblib.adb_client import AdbDevice
+from adblib.errors import (
+    AdbServerUnavailableError,
+    RemoteDeviceError,
+    UnInstallError,
+)
 
 # global adb path to use
 ADB_DEFAULT_PATH: str = ""
 
 ADB_DEFAULT_PORT: int = 5037
 
+# talk to the adb server over its socket instead of spawning adb for every command
+# the adb executable is still used to start the server and as a fallback if it isnt running
+USE_NATIVE_CLIENT: bool = True
+
+# run shell commands over shells that are kept open on each device instead of opening
+# a new shell for every command
+USE_SHELL_POOL: bool = True
+
+# log every blocking call made from a thread that is running an event loop. Set in debug mode
+WARN_BLOCKING_CALLS: bool = False
+
+# seconds adb has to start or stop the server or list the devices before it is killed.
+# Installs and pushes can take as long as they need
+ADB_SERVER_TIMEOUT: float = 30.0
+
+# how the operations that are safe to run twice retry after a transient device error
+RETRY_POLICY: retry.RetryPolicy = retry.RetryPolicy()
+
+# seconds between device list polls while waiting for a device without the device stream
+DEVICE_WAIT_POLL_INTERVAL: float = 1.0
+
+# writes every command sent to a device or the adb server to a trace
+RECORDER: flight_recorder.FlightRecorder | None = None
+
+# serves every command from a recorded trace instead. Nothing is sent to adb
+REPLAYER: flight_recorder.Replayer | None = None
+
+_T = TypeVar("_T")
+
+# set while a command is being recorded so the commands it runs arent recorded again
+_recording: contextvars.ContextVar[bool] = contextvars.ContextVar(
+    "_recording", default=False
+)
+
+_Log = logging.getLogger()
+
+# each thread that calls the sync functions gets its own event loop
+_thread_loops = threading.local()
+
+
+def _mark_sync_worker() -> None:
+    _thread_loops.sync_worker = True
+
+
+# sync functions called from inside a running event loop are run on this worker
+_sync_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix="adb-sync", initializer=_mark_sync_worker
+)
+# pooled shells belong to the event loop that opened them so each loop has its own pool
+_shell_pools: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, shell_pool.ShellPool
+] = weakref.WeakKeyDictionary()
+
 
 class Code:
     """status code errors"""
@@ -39,6 +135,416 @@ async def _get_bytes_from_stream(stream_reader: asyncio.StreamReader | None) ->
     return bstr
 
 
+def get_client() -> adb_client.AdbClient:
+    """gets a client for the adb server on the global port
+
+    Returns:
+        adb_client.AdbClient:
+    """
+    return adb_client.AdbClient(port=ADB_DEFAULT_PORT)
+
+
+def get_shell_pool() -> shell_pool.ShellPool:
+    """gets the shell pool for the running event loop
+
+    Returns:
+        shell_pool.ShellPool:
+    """
+    loop = asyncio.get_running_loop()
+    pool = _shell_pools.get(loop)
+    if pool is None:
+        pool = shell_pool.ShellPool(get_client)
+        _shell_pools[loop] = pool
+    return pool
+
+
+async def _traced(
+    kind: str,
+    serial: str,
+    command: flight_recorder.Command,
+    func: Callable[[], Awaitable[subprocess.CompletedProcess]],
+) -> subprocess.CompletedProcess:
+    """runs func through the RECORDER or replays the command from REPLAYER if either is set
+
+    Args:
+        kind (str): one of the flight_recorder.KIND_ constants
+        serial (str): the device the command is for. Empty for the adb server
+        command (Command): what the command is recorded as
+        func (Callable[[], Awaitable[subprocess.CompletedProcess]]): runs the command
+    """
+    if REPLAYER is not None:
+        return await REPLAYER.replay(kind, serial, command)
+    if RECORDER is None or _recording.get():
+        # a command run by another one being recorded ie. the adb install fallback
+        # is part of it
+        return await func()
+    token = _recording.set(True)
+    try:
+        return await RECORDER.record(kind, serial, command, func)
+    finally:
+        _recording.reset(token)
+
+
+async def _traced_lines(
+    kind: str,
+    serial: str,
+    command: flight_recorder.Command,
+    lines: Callable[[], AsyncIterator[bytes]],
+) -> AsyncGenerator[bytes, None]:
+    """same as _traced for commands read a line at a time"""
+    if REPLAYER is not None:
+        result = await REPLAYER.replay(kind, serial, command)
+        for line in result.stdout.splitlines(keepends=True):
+            yield line
+        return
+    if RECORDER is None:
+        async for line in lines():
+            yield line
+        return
+    async for line in RECORDER.record_lines(kind, serial, command, lines()):
+        yield line
+
+
+def _local_names(paths: List[str]) -> List[str]:
+    """the file names of local paths so a trace doesnt depend on where the files were"""
+    return [os.path.basename(os.path.normpath(path)) for path in paths]
+
+
+async def _native_shell(device_name: str, command: str) -> subprocess.CompletedProcess:
+    """runs the command line over the adb server. Recorded by the RECORDER
+
+    Raises:
+        AdbServerUnavailableError: if the adb server isnt running
+        RemoteDeviceError: if the device cant be found or the pooled shell was lost
+        while the command was running
+    """
+    return await _traced(
+        flight_recorder.KIND_SHELL,
+        device_name,
+        command,
+        lambda: _pooled_shell(device_name, command),
+    )
+
+
+async def _pooled_shell(device_name: str, command: str) -> subprocess.CompletedProcess:
+    """runs the command line over a pooled shell if there is one. Falls back to a new
+    shell for the command if the pooled shell cant be opened
+
+    Raises:
+        AdbServerUnavailableError: if the adb server isnt running
+        RemoteDeviceError: if the device cant be found or the pooled shell was lost
+        while the command was running
+    """
+    if USE_SHELL_POOL:
+        try:
+            session = await get_shell_pool().session(device_name)
+        except RemoteDeviceError:
+            # older devices without shell v2 or a device that has gone. The one off
+            # shell handles both
+            pass
+        else:
+            try:
+                return await session.run(command)
+            except ConnectionError as err:
+                # the command may have run already so it isnt sent again
+                raise RemoteDeviceError(
+                    adb_client._failed_result(command, err.__str__())
+                ) from err
+    return await get_client().shell(device_name, command)
+
+
+@contextlib.contextmanager
+def _blocking_call(name: str) -> Generator[None, None, None]:
+    """logs how long the block held up the event loop if it was entered from the thread
+    running the loop and WARN_BLOCKING_CALLS is set
+
+    Args:
+        name (str): the call to name in the log
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        on_event_loop = False
+    else:
+        on_event_loop = True
+    if not (WARN_BLOCKING_CALLS and on_event_loop):
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        _Log.warning(
+            f"Blocking adb call {name} held up the event loop for {elapsed:.1f}ms. Await the async version instead"
+        )
+
+
+def run_sync(coro: Coroutine[Any, Any, _T]) -> _T:
+    """runs the coroutine to completion from synchronous code
+
+    if the calling thread already has a running event loop the coroutine is run on a
+    worker thread instead. This blocks the caller the same way subprocess.run does. The
+    worker runs one call at a time so a sync function cant be called from a coroutine
+    that is itself running on the worker
+
+    Args:
+        coro (Coroutine): the coroutine to run
+
+    Raises:
+        RuntimeError: if called from inside a coroutine running on the worker. It would
+        wait for itself forever
+
+    Returns:
+        the result of the coroutine
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        if getattr(_thread_loops, "sync_worker", False):
+            coro.close()
+            raise RuntimeError(
+                "A blocking adb call was made from inside another blocking adb call. Await the async version instead"
+            )
+        name = getattr(coro, "__qualname__", repr(coro))
+        with _blocking_call(name):
+            future: concurrent.futures.Future[_T] = _sync_executor.submit(
+                run_sync, coro
+            )
+            return future.result()
+    loop: asyncio.AbstractEventLoop | None = getattr(_thread_loops, "loop", None)
+    if loop is None or loop.is_closed():
+        loop = asyncio.new_event_loop()
+        _thread_loops.loop = loop
+    return loop.run_until_complete(coro)
+
+
+async def _run_subprocess(
+    commands: List[str], timeout: float | None = None
+) -> subprocess.CompletedProcess:
+    """runs the commands and returns the result without checking the return code
+
+    Args:
+        commands (List[str]): list of commands to send
+        timeout (float, optional): seconds the command has to finish. Defaults to None.
+
+    Raises:
+        SubprocessTimeoutError: if the command didnt finish in time
+
+    Returns:
+        subprocess.CompletedProcess:
+    """
+    return await _traced(
+        flight_recorder.KIND_SUBPROCESS,
+        _subprocess_serial(commands),
+        [os.path.basename(commands[0]), *commands[1:]],
+        lambda: subprocess_runner.run(
+            commands, timeout=timeout, startupinfo=_remove_showwindow_flag()
+        ),
+    )
+
+
+def _subprocess_serial(commands: List[str]) -> str:
+    """the device an adb command line is for ie. the serial after -s"""
+    try:
+        return commands[commands.index("-s") + 1]
+    except (ValueError, IndexError):
+        return ""
+
+
+async def _shell(device_name: str, args: List[str]) -> subprocess.CompletedProcess:
+    """runs a shell command on the device over the adb server socket. Falls back to
+    spawning adb shell if the server isnt running
+
+    Args:
+        device_name (str): name of the android device
+        args (List[str]): the shell command and its arguments
+
+    Returns:
+        subprocess.CompletedProcess: the return code is the exit code of the shell command
+    """
+    if USE_NATIVE_CLIENT:
+        try:
+            return await _native_shell(device_name, adb_client.quote_args(args))
+        except AdbServerUnavailableError:
+            pass
+    return await _run_subprocess([ADB_DEFAULT_PATH, "-s", device_name, "shell", *args])
+
+
+async def async_shell(device_name: str, command: str) -> subprocess.CompletedProcess:
+    """runs a command line in the device shell as is. Use this when the command needs
+    the shell itself ie. to chain commands with ; or &&. Nothing is quoted
+
+    Args:
+        device_name (str): name of the android device
+        command (str): the command line to run
+
+    Returns:
+        subprocess.CompletedProcess: the return code is the exit code of the command line
+    """
+    if USE_NATIVE_CLIENT:
+        try:
+            return await _native_shell(device_name, command)
+        except AdbServerUnavailableError:
+            pass
+    return await _run_subprocess(
+        [ADB_DEFAULT_PATH, "-s", device_name, "shell", command]
+    )
+
+
+def shell_batch(
+    device_name: str, commands: List[List[str]]
+) -> List[subprocess.CompletedProcess]:
+    """runs every command in a single shell session and returns a result for each one.
+    Saves a round trip to the device for every command after the first
+
+    the commands are run one after the other whatever their exit codes. A sentinel
+    line carrying the exit code is printed to stdout after each command and another
+    to stderr so the output can be split back apart
+
+    Args:
+        device_name (str): name of the android device
+        commands (List[List[str]]): each command and its arguments
+
+    Raises:
+        RemoteDeviceError: if the shell session failed before running the commands
+
+    Returns:
+        List[subprocess.CompletedProcess]: one per command in the same order. The return
+        code is -1 if the session ended before the command finished
+    """
+    return run_sync(async_shell_batch(device_name, commands))
+
+
+async def async_shell_batch(
+    device_name: str, commands: List[List[str]], idempotent: bool = False
+) -> List[subprocess.CompletedProcess]:
+    """same as shell_batch but doesnt block the event loop. Pass idempotent=True if the
+    commands can safely run twice so a transient error runs the batch again"""
+    if not commands:
+        return []
+    if idempotent:
+        return await _retry(
+            "shell_batch",
+            device_name,
+            lambda: async_shell_batch(device_name, commands),
+        )
+    # unique to this batch so output from the commands cant be mistaken for it
+    sentinel = f"__QC_{uuid.uuid4().hex}__"
+    lines: List[str] = []
+    for index, args in enumerate(commands):
+        lines.append(adb_client.quote_args(args))
+        # the leading newline makes sure the sentinel starts on its own line.
+        # it is taken off again when the output is split
+        lines.append(f"printf '\\n{sentinel}:{index}:%d\\n' $?")
+        lines.append(f"printf '\\n{sentinel}:{index}\\n' >&2")
+    result = await async_shell(device_name, "; ".join(lines))
+    stdout_parts, exit_codes = _split_batch_output(result.stdout, sentinel)
+    stderr_parts, _ = _split_batch_output(result.stderr, sentinel)
+    if not exit_codes:
+        raise RemoteDeviceError(result)
+    results: List[subprocess.CompletedProcess] = []
+    for index, args in enumerate(commands):
+        results.append(
+            subprocess.CompletedProcess(
+                args=args,
+                returncode=exit_codes.get(index, -1),
+                stdout=stdout_parts.get(index, b""),
+                stderr=stderr_parts.get(index, b""),
+            )
+        )
+    return results
+
+
+def _split_batch_output(
+    data: bytes, sentinel: str
+) -> Tuple[Dict[int, bytes], Dict[int, int]]:
+    """splits the output of a shell batch on the sentinel lines
+
+    Args:
+        data (bytes): stdout or stderr from the batch
+        sentinel (str): the sentinel the batch was run with
+
+    Returns:
+        Tuple[Dict[int, bytes], Dict[int, int]]: the output and exit code of each command by index
+    """
+    pattern = re.compile(
+        b"\n" + re.escape(sentinel.encode()) + rb":(\d+)(?::(-?\d+))?\n"
+    )
+    outputs: Dict[int, bytes] = {}
+    exit_codes: Dict[int, int] = {}
+    start = 0
+    for match in pattern.finditer(data):
+        index = int(match.group(1))
+        # the legacy shell mixes stderr into stdout so both sentinels can turn up here
+        outputs[index] = outputs.get(index, b"") + data[start : match.start()]
+        if match.group(2) is not None:
+            exit_codes[index] = int(match.group(2))
+        start = match.end()
+    return outputs, exit_codes
+
+
+async def _checked_shell(device_name: str, args: List[str]) -> str:
+    """same as _shell but raises if the exit code is not 0
+
+    Raises:
+        RemoteDeviceError: if the command exited with a non zero code
+
+    Returns:
+        str: decoded stdout
+    """
+    result = await _shell(device_name, args)
+    if result.returncode != Code.SUCCESS:
+        raise RemoteDeviceError(result)
+    return result.stdout.decode("utf-8")
+
+
+async def _devices_output(long_format: bool = False) -> str:
+    """gets the device list text from the adb server
+
+    Args:
+        long_format (bool, optional): include the model, product, usb and transport_id. Defaults to False.
+    """
+    if USE_NATIVE_CLIENT:
+        try:
+            service = "host:devices-l" if long_format else "host:devices"
+
+            async def query() -> subprocess.CompletedProcess:
+                output = await get_client().host_query(service)
+                return subprocess.CompletedProcess(service, 0, output.encode(), b"")
+
+            result = await _traced(flight_recorder.KIND_HOST, "", service, query)
+            return result.stdout.decode()
+        except AdbServerUnavailableError:
+            pass
+    commands = [ADB_DEFAULT_PATH, "devices"]
+    if long_format:
+        commands.append("-l")
+    return await execute_subprocess(commands, ADB_SERVER_TIMEOUT)
+
+
+def _parse_device_names(output: str) -> List[str]:
+    """parses the serials of the ready devices from the adb devices output
+
+    Args:
+        output (str): output from host:devices or adb devices
+
+    Returns:
+        List[str]: the serials of devices in the "device" state
+    """
+    connected_devices = []
+    for line in output.strip().splitlines():
+        if "\t" not in line:
+            # the "List of devices attached" header or a daemon message
+            continue
+        serial, state = line.split("\t", 1)
+        if state.strip() == "device":
+            connected_devices.append(serial)
+    return connected_devices
+
+
 def _remove_showwindow_flag() -> subprocess.STARTUPINFO:
     """removes the show window flag so the terminal isnt shown when executing the adb commands
 
@@ -56,8 +562,24 @@ def close_adb() -> str:
     Returns:
         str: stdout from the process
     """
-    stdout = execute([ADB_DEFAULT_PATH, "kill-server"])
-    return stdout
+    return run_sync(async_close_adb())
+
+
+async def async_close_adb() -> str:
+    """same as close_adb but doesnt block the event loop"""
+    if REPLAYER is not None:
+        # there is no server to stop
+        return ""
+    if USE_NATIVE_CLIENT:
+        try:
+            await get_client().kill_server()
+        except AdbServerUnavailableError:
+            # nothing to kill
+            pass
+        return ""
+    return await execute_subprocess(
+        [ADB_DEFAULT_PATH, "kill-server"], ADB_SERVER_TIMEOUT
+    )
 
 
 # def check_port_avalibility(port: int = ADB_DEFAULT_PORT) -> bool:
@@ -94,7 +616,9 @@ async def start_adb() -> str:
     # stdout = await execute_subprocess(
     #     [ADB_DEFAULT_PATH, "-P", f"{port}", "start-server"]
     # )
-    stdout = await execute_subprocess([ADB_DEFAULT_PATH, "start-server"])
+    stdout = await execute_subprocess(
+        [ADB_DEFAULT_PATH, "start-server"], ADB_SERVER_TIMEOUT
+    )
     return stdout
 
 
@@ -107,28 +631,93 @@ def get_device_names() -> List[str]:
     Returns:
         List[str]: device names. empty list if no devices found
     """
-    commands = [ADB_DEFAULT_PATH, "devices"]
-    output = execute(commands)
-    devices = output.strip().split("\n")[1:]
-    connected_devices = []
-    for device in devices:
-        if "device" in device:
-            connected_device = device.split("\t")[0]
-            connected_devices.append(connected_device)
-    return connected_devices
+    return _parse_device_names(run_sync(_devices_output()))
 
 
 async def async_get_device_names() -> List[str]:
     """same as get_device_names but async"""
-    commands = [ADB_DEFAULT_PATH, "devices"]
-    output = await execute_subprocess(commands)
-    devices = output.strip().split("\n")[1:]
-    connected_devices = []
-    for device in devices:
-        if "device" in device:
-            connected_device = device.split("\t")[0]
-            connected_devices.append(connected_device)
-    return connected_devices
+    return _parse_device_names(await _devices_output())
+
+
+def get_devices() -> List[AdbDevice]:
+    """gets every attached device with the details from adb devices -l in a single
+    request. Use this over calling getprop on each device
+
+    Raises:
+        RemoteDeviceError: will be raised if error is not None
+
+    Returns:
+        List[AdbDevice]: all attached devices whatever their state
+    """
+    return run_sync(async_get_devices())
+
+
+async def async_get_devices() -> List[AdbDevice]:
+    """same as get_devices but async"""
+    return adb_client.parse_device_list(await _devices_output(long_format=True))
+
+
+async def track_devices() -> AsyncGenerator[List[adb_client.AdbDevice], None]:
+    """keeps a connection open to the adb server and yields the attached devices
+    every time they change. There is no subprocess fallback for this, poll
+    get_device_names if the server cant be reached
+
+    Raises:
+        AdbServerUnavailableError: if the adb server is not running
+
+    Yields:
+        List[adb_client.AdbDevice]: the devices currently attached
+    """
+    if REPLAYER is not None:
+        # the device list is polled from the trace instead
+        raise AdbServerUnavailableError("", ADB_DEFAULT_PORT, "replaying an adb trace")
+    async for devices in get_client().track_devices():
+        yield devices
+
+
+async def wait_for_device(device_name: str, timeout: float) -> None:
+    """waits until the device is attached and ready to use. Follows the same device
+    stream as the device monitor and polls the device list if the stream isnt available
+
+    Args:
+        device_name (str): name of the android device
+        timeout (float): seconds to wait
+
+    Raises:
+        asyncio.TimeoutError: if the device didnt come back in time
+    """
+
+    def ready(devices: List[AdbDevice]) -> bool:
+        return any(
+            device.serial == device_name and device.state == "device"
+            for device in devices
+        )
+
+    async def watch() -> None:
+        if USE_NATIVE_CLIENT:
+            try:
+                async for devices in track_devices():
+                    if ready(devices):
+                        return
+            except (AdbServerUnavailableError, ConnectionError) as err:
+                _Log.debug(f"device tracking unavailable: {err.__str__()}")
+        while True:
+            try:
+                if ready(await async_get_devices()):
+                    return
+            except (RemoteDeviceError, ConnectionError) as err:
+                _Log.debug(f"unable to list the devices: {err.__str__()}")
+            await asyncio.sleep(DEVICE_WAIT_POLL_INTERVAL)
+
+    await asyncio.wait_for(watch(), timeout)
+
+
+async def _retry(
+    operation: str, device_name: str, func: Callable[[], Awaitable[_T]]
+) -> _T:
+    """runs func again after transient errors using RETRY_POLICY. The device has to be
+    back before each retry"""
+    return await retry.call(operation, device_name, func, RETRY_POLICY, wait_for_device)
 
 
 def path_exists(device_name: str, path: str) -> bool:
@@ -144,21 +733,24 @@ def path_exists(device_name: str, path: str) -> bool:
     Returns:
         bool: true if path exists
     """
-    "adb -s 1WMHHB62832202 shell test -d /sdcard/Android/obb/com.fitxr.boxvr"
-    result: subprocess.CompletedProcess = subprocess.run(
-        [ADB_DEFAULT_PATH, "-s", device_name, "shell", "test", "-d", path],
-        capture_output=True,
-        startupinfo=_remove_showwindow_flag(),
-        check=False,
-    )
-    if result.returncode == Code.FAILURE:
-        # path doesnt exist but no errors
-        return False
-    elif result.returncode == Code.SUCCESS:
-        # path exists
-        return True
-    # some kind of error raise exception
-    raise RemoteDeviceError(result=result)
+    return run_sync(async_path_exists(device_name, path))
+
+
+async def async_path_exists(device_name: str, path: str) -> bool:
+    """same as path_exists but doesnt block the event loop"""
+
+    async def test() -> bool:
+        result = await _shell(device_name, ["test", "-d", path])
+        if result.returncode == Code.FAILURE:
+            # path doesnt exist but no errors
+            return False
+        elif result.returncode == Code.SUCCESS:
+            # path exists
+            return True
+        # some kind of error raise exception
+        raise RemoteDeviceError(result=result)
+
+    return await _retry("path_exists", device_name, test)
 
 
 def make_dir(device_name: str, path: str) -> str:
@@ -174,17 +766,41 @@ def make_dir(device_name: str, path: str) -> str:
     Returns:
         str: utf-8 encoded stdout string
     """
-    commands = [ADB_DEFAULT_PATH, "-s", device_name, "shell", "mkdir", path]
-    stdout = execute(commands)
-    return stdout
+    return run_sync(async_make_dir(device_name, path))
+
 
+async def async_make_dir(device_name: str, path: str) -> str:
+    """same as make_dir but doesnt block the event loop"""
+    attempts = 0
 
-async def install_apk(device_name, apk_path: str) -> str:
+    async def mkdir() -> str:
+        nonlocal attempts
+        attempts += 1
+        try:
+            return await _checked_shell(device_name, ["mkdir", path])
+        except RemoteDeviceError as err:
+            # the attempt before may have made it before the connection dropped
+            if attempts > 1 and "File exists" in err.message:
+                return ""
+            raise
+
+    return await _retry("make_dir", device_name, mkdir)
+
+
+async def install_apk(
+    device_name,
+    apk_path: str,
+    split_paths: List[str] | None = None,
+    progress_callback: adb_sync.TransferProgressFunction | None = None,
+) -> str:
     """installs the apk from the apk path
 
     Args:
         device_name (_type_): name of the device to communicate with
         apk_path (str): the local path of the apk file
+        split_paths (List[str], optional): split apks to install in the same session. Defaults to None.
+        progress_callback (TransferProgressFunction, optional): recieves the bytes streamed
+        to the package manager. Defaults to None.
 
     Raises:
         RemoteDeviceError: gets raised if return code not equal to 0
@@ -192,13 +808,152 @@ async def install_apk(device_name, apk_path: str) -> str:
     Returns:
         str: utf-8 encoded stdout string
     """
-    # commands =
-    # stdout = await execute_subprocess(commands)
-    # return stdout
-    commands = [ADB_DEFAULT_PATH, "-s", device_name, "install", apk_path]
+    apk_paths = [apk_path, *(split_paths or [])]
+
+    async def install() -> subprocess.CompletedProcess:
+        output = await _install_apk(device_name, apk_paths, progress_callback)
+        return subprocess.CompletedProcess(apk_paths, 0, output.encode(), b"")
+
+    result = await _traced(
+        flight_recorder.KIND_INSTALL,
+        device_name,
+        ["install", *_local_names(apk_paths)],
+        install,
+    )
+    return result.stdout.decode()
+
+
+async def _install_apk(
+    device_name: str,
+    apk_paths: List[str],
+    progress_callback: adb_sync.TransferProgressFunction | None,
+) -> str:
+    """installs the base apk and its splits once. Same arguments as install_apk. A
+    session lost to a dropped connection is abandoned and the install is started again in
+    a new one. Installing the same apk twice leaves the device the same"""
+    apk_path = apk_paths[0]
+    if USE_NATIVE_CLIENT:
+        try:
+            return await _retry(
+                "install_apk",
+                device_name,
+                lambda: _session_install(device_name, apk_paths, progress_callback),
+            )
+        except AdbServerUnavailableError:
+            pass
+    if len(apk_paths) > 1:
+        commands = [ADB_DEFAULT_PATH, "-s", device_name, "install-multiple", *apk_paths]
+    else:
+        commands = [ADB_DEFAULT_PATH, "-s", device_name, "install", apk_path]
     return await execute_subprocess(commands)
 
 
+async def _package_command(
+    device_name: str,
+    args: List[str],
+    stdin_path: str = "",
+    reporter: adb_sync.ProgressReporter | None = None,
+) -> str:
+    """runs cmd package over exec: and checks the output for Success
+
+    Args:
+        device_name (str): name of the device
+        args (List[str]): the arguments after cmd package
+        stdin_path (str, optional): a file to stream into the command. Defaults to "".
+        reporter (ProgressReporter, optional): updated as stdin_path is streamed. Defaults to None.
+
+    Raises:
+        RemoteDeviceError: if the package manager did not report Success
+
+    Returns:
+        str: the output from the package manager
+    """
+    service = f"exec:cmd package {adb_client.quote_args(args)}"
+    async with await get_client().open_service(device_name, service) as conn:
+        if stdin_path:
+
+            async def send_chunk(chunk: memoryview) -> None:
+                conn.write(chunk)
+                await conn.drain()
+
+            if reporter is None:
+                reporter = adb_sync.ProgressReporter(None, 0, 1)
+            output = await adb_sync.stream_file(
+                stdin_path, send_chunk, conn.read_all, reporter
+            )
+        else:
+            output = await conn.read_all()
+    if not output.startswith(b"Success"):
+        raise RemoteDeviceError(
+            subprocess.CompletedProcess(
+                args=[service], returncode=Code.FAILURE, stdout=output, stderr=b""
+            )
+        )
+    return output.decode("utf-8")
+
+
+async def _session_install(
+    device_name: str,
+    apk_paths: List[str],
+    progress_callback: adb_sync.TransferProgressFunction | None = None,
+) -> str:
+    """installs the apks through a package manager session. The apks are streamed
+    straight into the session so nothing is copied to a temp directory on the device first
+    and split apks are written side by side
+
+    Raises:
+        RemoteDeviceError: if the package manager did not report Success. The session is abandoned
+
+    Returns:
+        str: the output from install-commit
+    """
+    sizes = [os.path.getsize(path) for path in apk_paths]
+    output = await _package_command(
+        device_name, ["install-create", "-S", str(sum(sizes))]
+    )
+    # Success: created install session [1234567]
+    session_id = output[output.index("[") + 1 : output.index("]")]
+    reporter = adb_sync.ProgressReporter(progress_callback, sum(sizes), len(apk_paths))
+    writes: List[asyncio.Task] = []
+    try:
+        writes = [
+            asyncio.create_task(
+                _package_command(
+                    device_name,
+                    [
+                        "install-write",
+                        "-S",
+                        str(size),
+                        session_id,
+                        f"{index}_{os.path.basename(path)}",
+                        "-",
+                    ],
+                    stdin_path=path,
+                    reporter=reporter,
+                )
+            )
+            for index, (path, size) in enumerate(zip(apk_paths, sizes))
+        ]
+        await asyncio.gather(*writes)
+        output = await _package_command(device_name, ["install-commit", session_id])
+    except BaseException:
+        # the other writes would keep streaming into the session being abandoned
+        for write in writes:
+            write.cancel()
+        await asyncio.gather(*writes, return_exceptions=True)
+        # leaving the session open keeps the streamed apks on the device
+        try:
+            await asyncio.shield(
+                _package_command(device_name, ["install-abandon", session_id])
+            )
+        except (RemoteDeviceError, ConnectionError):
+            pass
+        raise
+    reporter.progress.files_sent = len(apk_paths)
+    reporter.complete()
+    return output
+
+
 async def uninstall(
     device_name: str, package_name: str, options: List[str] = []
 ) -> None:
@@ -222,18 +977,69 @@ async def uninstall(
         RemoteDeviceError: raises if return code is not 0
         UninstallError: raises if the package is not uninstalled
     """
-    commands = [ADB_DEFAULT_PATH, "-s", device_name, "uninstall"]
+    commands = ["pm", "uninstall"]
     if options:
         commands.extend(options)
     commands.append(package_name)
     try:
-        result = await execute_subprocess(commands)
+        result = await _checked_shell(device_name, commands)
     except Exception as err:
         raise err
     if "Success" not in result:
         raise UnInstallError(package_name, result.strip())
 
 
+async def uninstall_packages(
+    device_name: str,
+    package_names: List[str],
+    options: List[str] = [],
+    data_dirs: List[str] = [],
+) -> Dict[str, Exception | None]:
+    """removes the packages in a single shell session. Unlike uninstall a package that
+    fails doesnt stop the rest from being removed
+
+    the folder named after each package in each of the data_dirs is removed in the same
+    session ie. /sdcard/Android/obb/com.fake.game. It is removed even if pm failed so
+    data left behind by a package that was already gone is cleared too
+
+    Args:
+        device_name (str): the name of the device to remove the packages from
+        package_names (List[str]): the names of the packages to remove
+        options (List[str]): see uninstall for options to pass
+        data_dirs (List[str], optional): folders on the device holding a folder for each
+        package. Defaults to [].
+
+    Raises:
+        RemoteDeviceError: if the shell session itself failed
+
+    Returns:
+        Dict[str, Exception | None]: the package names mapped to None if removed or the
+        RemoteDeviceError or UnInstallError that would have been raised by uninstall
+    """
+    commands: List[List[str]] = []
+    for package in package_names:
+        commands.append(["pm", "uninstall", *options, package])
+        if data_dirs:
+            paths = [f"{data_dir.rstrip('/')}/{package}" for data_dir in data_dirs]
+            commands.append(["rm", "-rf", *paths])
+    results = await async_shell_batch(device_name, commands)
+    # pm then rm for each package if there are data_dirs
+    step = 2 if data_dirs else 1
+    errors: Dict[str, Exception | None] = {}
+    for index, package_name in enumerate(package_names):
+        result = results[index * step]
+        output = result.stdout.decode("utf-8", errors="replace")
+        if result.returncode != Code.SUCCESS:
+            errors[package_name] = RemoteDeviceError(result)
+        elif "Success" not in output:
+            errors[package_name] = UnInstallError(package_name, output.strip())
+        elif data_dirs and results[index * step + 1].returncode != Code.SUCCESS:
+            errors[package_name] = RemoteDeviceError(results[index * step + 1])
+        else:
+            errors[package_name] = None
+    return errors
+
+
 async def get_installed_packages(
     device_name: str, options: List[str] = []
 ) -> List[str]:
@@ -260,10 +1066,12 @@ async def get_installed_packages(
     Returns:
         List[str]: a list of package names
     """
-    commands = [ADB_DEFAULT_PATH, "-s", device_name, "shell", "pm", "list", "packages"]
+    commands = ["pm", "list", "packages"]
     if options:
         commands.extend(options)
-    stdout = await execute_subprocess(commands=commands)
+    stdout = await _retry(
+        "list_packages", device_name, lambda: _checked_shell(device_name, commands)
+    )
     lines = stdout.split("\n")
 
     def parse_line(line: str) -> str:
@@ -287,10 +1095,10 @@ async def get_package_generator(
     Yields:
         Generator[str]: package name on that line
     """
-    commands = [ADB_DEFAULT_PATH, "-s", device_name, "shell", "pm", "list", "packages"]
+    commands = ["pm", "list", "packages"]
     if options:
         commands.extend(options)
-    async for byte_line in execute_subprocess_by_line(commands=commands):
+    async for byte_line in _shell_lines(device_name, commands):
         line: str = byte_line.decode("utf-8")
         if line.startswith("package:"):
             line = line.replace("package:", "")
@@ -298,13 +1106,68 @@ async def get_package_generator(
         yield line
 
 
-async def copy_path(device_name: str, local_path: str, destination_path: str) -> str:
-    """copies a folder and its subdirectories over to the remote anroid device
+async def _shell_lines(
+    device_name: str, args: List[str]
+) -> AsyncGenerator[bytes, None]:
+    """yields stdout a line at a time from a shell command on the device
+
+    Raises:
+        RemoteDeviceError: if the command exited with a non zero code
+    """
+    if USE_NATIVE_CLIENT:
+        command = adb_client.quote_args(args)
+        try:
+            # the server is connected to before the first line is yielded
+            async for line in _traced_lines(
+                flight_recorder.KIND_SHELL_LINES,
+                device_name,
+                command,
+                lambda: get_client().shell_lines(device_name, command),
+            ):
+                yield line
+            return
+        except AdbServerUnavailableError:
+            pass
+    commands = [ADB_DEFAULT_PATH, "-s", device_name, "shell", *args]
+    async for line in execute_subprocess_by_line(commands=commands):
+        yield line
+
+
+async def copy_path(
+    device_name: str,
+    local_path: str,
+    destination_path: str,
+    progress_callback: adb_sync.TransferProgressFunction | None = None,
+    skip_unchanged: bool = False,
+    verify_hash: bool = False,
+    on_file_synced: adb_sync.FileSyncedFunction | None = None,
+    compress: bool = False,
+    tar: bool = False,
+    fan_out_group: fan_out.FanOutGroup | None = None,
+) -> str:
+    """copies a folder and its subdirectories over to the remote anroid device. If the
+    device drops out part way it is pushed again once the device is back
 
     Args:
         device_name (str): name of the device
         local_path (str): the local path of directory
         destination_path (str): the directory remote path to be pushed to
+        progress_callback (TransferProgressFunction, optional): called with the bytes sent
+        and throughput while the files are being pushed. Defaults to None.
+        skip_unchanged (bool, optional): dont copy files already on the device with the
+        same size and modified time. Defaults to False.
+        verify_hash (bool, optional): also compare the md5 of files that would be skipped.
+        Ignored by the adb push fallback. Defaults to False.
+        on_file_synced (FileSyncedFunction, optional): called with the remote path and size of
+        each file once it is on the device. Not called by the adb push fallback. Defaults to None.
+        compress (bool, optional): compress the files if the device supports it. The ratio
+        and throughput are logged. The adb push fallback sends them as they are. Defaults to False.
+        tar (bool, optional): stream a folder through tar on the device instead of sending
+        the files one at a time. Much faster for lots of small files. Falls back to a sync
+        push if the device has no tar. Ignored for files and by the adb push fallback. Defaults to False.
+        fan_out_group (FanOutGroup, optional): push along with the other devices pushing the
+        same path so the files are only read once. Sent uncompressed. Ignored when tar is
+        used and by the adb push fallback. Defaults to None.
 
     Raises:
         RemoteDeviceError: raises if return code is not 0
@@ -312,6 +1175,101 @@ async def copy_path(device_name: str, local_path: str, destination_path: str) ->
     Returns:
         str: utf-8 encoded stdout string
     """
+    attempts = 0
+
+    async def push() -> str:
+        nonlocal attempts
+        attempts += 1
+        return await _push_path(
+            device_name,
+            local_path,
+            destination_path,
+            progress_callback,
+            skip_unchanged=skip_unchanged,
+            verify_hash=verify_hash,
+            on_file_synced=on_file_synced,
+            compress=compress,
+            tar=tar,
+            # the other devices have moved on by the time of a retry so it goes alone
+            fan_out_group=fan_out_group if attempts == 1 else None,
+        )
+
+    async def traced_push() -> subprocess.CompletedProcess:
+        output = await _retry("push", device_name, push)
+        return subprocess.CompletedProcess(local_path, 0, output.encode(), b"")
+
+    result = await _traced(
+        flight_recorder.KIND_PUSH,
+        device_name,
+        ["push", *_local_names([local_path]), destination_path],
+        traced_push,
+    )
+    return result.stdout.decode()
+
+
+async def _push_path(
+    device_name: str,
+    local_path: str,
+    destination_path: str,
+    progress_callback: adb_sync.TransferProgressFunction | None = None,
+    skip_unchanged: bool = False,
+    verify_hash: bool = False,
+    on_file_synced: adb_sync.FileSyncedFunction | None = None,
+    compress: bool = False,
+    tar: bool = False,
+    fan_out_group: fan_out.FanOutGroup | None = None,
+) -> str:
+    """pushes the path once. Same arguments as copy_path"""
+    if USE_NATIVE_CLIENT and tar and os.path.isdir(local_path):
+        try:
+            progress = await tar_stream.push_tar(
+                get_client(),
+                device_name,
+                local_path,
+                destination_path,
+                progress_callback,
+                skip_unchanged=skip_unchanged,
+                verify_hash=verify_hash,
+                on_file_synced=on_file_synced,
+            )
+            return _format_push_summary(local_path, progress)
+        except AdbServerUnavailableError:
+            pass
+        except RemoteDeviceError as err:
+            if err.code != tar_stream.EXIT_COMMAND_NOT_FOUND:
+                raise
+            _Log.info(f"{device_name} has no tar. Pushing {local_path} file by file")
+    if USE_NATIVE_CLIENT and fan_out_group is not None:
+        try:
+            progress = await fan_out_group.push(
+                get_client(),
+                device_name,
+                local_path,
+                destination_path,
+                progress_callback,
+                skip_unchanged=skip_unchanged,
+                verify_hash=verify_hash,
+                on_file_synced=on_file_synced,
+            )
+            return _format_push_summary(local_path, progress)
+        except AdbServerUnavailableError:
+            pass
+    if USE_NATIVE_CLIENT:
+        try:
+            progress = await adb_sync.push(
+                get_client(),
+                device_name,
+                local_path,
+                destination_path,
+                progress_callback,
+                skip_unchanged=skip_unchanged,
+                verify_hash=verify_hash,
+                on_file_synced=on_file_synced,
+                compress=compress,
+            )
+            return _format_push_summary(local_path, progress)
+        except AdbServerUnavailableError:
+            pass
     # wrap the local apk path in double quotes. ADB will kick up a fuss otherwise
     # local_path = f'\"{local_path}\"'
     command = [
@@ -322,10 +1280,22 @@ async def copy_path(device_name: str, local_path: str, destination_path: str) ->
         local_path,
         destination_path,
     ]
+    if skip_unchanged:
+        # only pushes files that are newer on the host
+        command.insert(4, "--sync")
     stdout = await execute_subprocess(command)
     return stdout
 
 
+def _format_push_summary(local_path: str, progress: adb_sync.TransferProgress) -> str:
+    """the same summary line adb push prints when it finishes"""
+    megabytes_per_second = progress.throughput / 1024 / 1024
+    return (
+        f"{local_path}: {progress.files_sent} file(s) pushed, {progress.files_skipped} skipped. "
+        f"{megabytes_per_second:.1f} MB/s ({progress.bytes_sent} bytes in {progress.elapsed:.3f}s)\n"
+    )
+
+
 async def async_remove_path(device_name: str, path: str) -> str:
     """removes a path from the device
 
@@ -339,8 +1309,7 @@ async def async_remove_path(device_name: str, path: str) -> str:
     Returns:
         str: utf-8 encoded stdout string
     """
-    commands = [ADB_DEFAULT_PATH, "-s", device_name, "shell", "rm", "-r", path]
-    result = await execute_subprocess(commands)
+    result = await _checked_shell(device_name, ["rm", "-r", path])
     return result
 
 
@@ -353,16 +1322,16 @@ def get_device_model(device_name: str) -> str:
     Returns:
         str: the model of the device
     """
-    commands = [
-        ADB_DEFAULT_PATH,
-        "-s",
+    return run_sync(async_get_device_model(device_name))
+
+
+async def async_get_device_model(device_name: str) -> str:
+    """same as get_device_model but doesnt block the event loop"""
+    return await _retry(
+        "get_device_model",
         device_name,
-        "shell",
-        "getprop",
-        "ro.product.model",
-    ]
-    stdout = execute(commands)
-    return stdout
+        lambda: _checked_shell(device_name, ["getprop", "ro.product.model"]),
+    )
 
 
 def execute(commands: List[str]) -> str:
@@ -375,89 +1344,52 @@ def execute(commands: List[str]) -> str:
     Returns:
         str: stdout from the command
     """
-    startupinfo = _remove_showwindow_flag()
-    result = subprocess.run(
-        commands, capture_output=True, startupinfo=startupinfo, check=False
-    )
-    if result.returncode != Code.SUCCESS:
-        raise RemoteDeviceError(result)
-    stdout = result.stdout.decode("utf-8")
-    return stdout
+    return run_sync(execute_subprocess(commands))
 
 
 async def execute_subprocess_by_line(
-    commands: List[str],
+    commands: List[str], timeout: float | None = None
 ) -> AsyncGenerator[bytes, None]:
-    """generator function for reading by line from a command subprocess
+    """generator function for reading by line from a command subprocess. stderr is read
+    at the same time so the command cant stall when it fills up
 
     Args:
         commands (List[str]): the array of commands to send to the process
+        timeout (float, optional): seconds the command has to finish. Defaults to None.
+
+    Raises:
+        RemoteDeviceError: if the command exited with a non zero code
+        SubprocessTimeoutError: if the command didnt finish in time
 
     Returns:
         bytes: the line of bytes to return
     """
-    process = await asyncio.create_subprocess_exec(
-        *commands,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        startupinfo=_remove_showwindow_flag(),
-    )
-    while True:
-        if process.stdout is None:
-            raise ValueError("process.stdout is None and has no readline method")
-        line = await process.stdout.readline()
-        if not line:
-            break
+    async for line in _traced_lines(
+        flight_recorder.KIND_SUBPROCESS_LINES,
+        _subprocess_serial(commands),
+        [os.path.basename(commands[0]), *commands[1:]],
+        lambda: subprocess_runner.iter_lines(
+            commands, timeout=timeout, startupinfo=_remove_showwindow_flag()
+        ),
+    ):
         yield line
-    if process.returncode is None or process.returncode != 0:
-        stdout = await _get_bytes_from_stream(process.stdout)
-        stderr = await _get_bytes_from_stream(process.stderr)
-        if process.returncode is None:
-            returncode = -1
-        else:
-            returncode = process.returncode
-        raise RemoteDeviceError(
-            subprocess.CompletedProcess(
-                args=commands,
-                returncode=returncode,
-                stdout=stdout,
-                stderr=stderr,
-            )
-        )
-    await process.wait()
 
 
-async def execute_subprocess(commands: List[str]) -> str:
+async def execute_subprocess(commands: List[str], timeout: float | None = None) -> str:
     """sends commands to the ADB, raises any errors and returns the stdout if successful
 
     Args:
         commands (List[str]): list of commands to send
+        timeout (float, optional): seconds the command has to finish. Defaults to None.
+
+    Raises:
+        RemoteDeviceError: if the command exited with a non zero code
+        SubprocessTimeoutError: if the command didnt finish in time
 
     Returns:
         str: deocded UTF-8 string from the stdout
     """
-    process = await asyncio.create_subprocess_exec(
-        *commands,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        startupinfo=_remove_showwindow_flag(),
-    )
-    stdout, stderr = await process.communicate()
-    await process.wait()
-    if process.returncode is None or process.returncode != 0:
-        stdout = await _get_bytes_from_stream(process.stdout)
-        stderr = await _get_bytes_from_stream(process.stderr)
-        if process.returncode is None:
-            returncode = -1
-        else:
-            returncode = process.returncode
-        raise RemoteDeviceError(
-            subprocess.CompletedProcess(
-                args=commands,
-                returncode=returncode,
-                stdout=stdout,
-                stderr=stderr,
-            )
-        )
-    decoded_output = stdout.decode()
-    return decoded_output
+    result = await _run_subprocess(commands, timeout)
+    if result.returncode != 0:
+        raise RemoteDeviceError(result)
+    return result.stdout.decode()
@@ -0,0 +1,711 @@
+"""
+adb_sync.py
+
+the sync: file transfer protocol. Replaces adb push with a native implementation
+that streams files straight from memory mapped source files into the socket
+
+every request is a 4 byte id, a little endian uint32 and then the payload
+
+SEND  path,mode   start sending a file
+SND2  path        start sending a file then SND2 mode flags. Flags pick the compression
+DATA  chunk       up to 64KiB of file data. The compressed stream if sent with SND2
+DONE  mtime       end of file. The device replies with OKAY or FAIL
+STAT  path        lstat the remote path. Replies with mode, size and mtime
+LIST  path        list a folder. Replies with a DENT per entry then DONE
+QUIT              close the sync session
+"""
+import asyncio
+import hashlib
+import logging
+import math
+import mmap
+import os
+import posixpath
+import stat
+import struct
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple, TypeVar
+
+from adblib import compression
+from adblib.adb_client import AdbClient, AdbConnection, _failed_result, quote_args
+from adblib.compression import Codec
+from adblib.errors import RemoteDeviceError
+
+_Log = logging.getLogger()
+
+# the largest DATA packet adbd accepts
+SYNC_DATA_MAX = 64 * 1024
+
+# how often the progress callback is called during a transfer
+PROGRESS_INTERVAL = 0.1
+
+# seconds the smoothed rate takes to catch up most of the way to a change in speed
+RATE_TIME_CONSTANT = 3.0
+
+# the mode given to files pushed to the device
+DEFAULT_FILE_MODE = 0o644
+
+# STAT and LIST only have 32 bits for the size
+REMOTE_SIZE_MASK = 0xFFFFFFFF
+
+# bytes read at a time when hashing a local file
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# bytes of a file handed to the compressor at a time. Bigger blocks compress better
+COMPRESS_CHUNK_SIZE = 1024 * 1024
+
+# the start of each file is test compressed. Files that dont shrink by at least this
+# much ie. zips and pre compressed textures are sent as they are
+COMPRESS_SAMPLE_SIZE = 256 * 1024
+MIN_COMPRESSION_SAVING = 0.1
+
+# longest md5sum command sent at once. The service request length is 4 hex digits and
+# the device limits the size of a command line so many files are hashed in batches
+HASH_COMMAND_MAX = 16 * 1024
+
+_T = TypeVar("_T")
+
+
+@dataclass
+class TransferProgress:
+    """progress of a push. Passed to the progress callback. The totals include the files
+    that were skipped as they were already on the device"""
+
+    bytes_sent: int
+    total_bytes: int
+    elapsed: float
+    current_file: str
+    files_sent: int
+    total_files: int
+    bytes_skipped: int = 0
+    files_skipped: int = 0
+    # bytes per second since the last report and smoothed over RATE_TIME_CONSTANT
+    rate: float = 0.0
+    smoothed_rate: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """average bytes per second since the transfer started"""
+        if self.elapsed <= 0:
+            return 0.0
+        return self.bytes_sent / self.elapsed
+
+    @property
+    def percent(self) -> float:
+        if self.total_bytes <= 0:
+            return 100.0
+        return (self.bytes_sent + self.bytes_skipped) / self.total_bytes * 100
+
+    @property
+    def remaining_bytes(self) -> int:
+        return max(self.total_bytes - self.bytes_sent - self.bytes_skipped, 0)
+
+    @property
+    def eta(self) -> float | None:
+        """seconds left at the smoothed rate. None until there is a rate"""
+        if self.smoothed_rate <= 0:
+            return None
+        return self.remaining_bytes / self.smoothed_rate
+
+
+TransferProgressFunction = Callable[[TransferProgress], None]
+
+# called with the remote path and size of a file once it is on the device
+FileSyncedFunction = Callable[[str, int], None]
+
+
+@dataclass
+class RemoteStat:
+    mode: int
+    size: int
+    mtime: int
+
+    @property
+    def exists(self) -> bool:
+        # adbd replies with all zeros if lstat failed
+        return self.mode != 0
+
+    @property
+    def is_dir(self) -> bool:
+        return stat.S_ISDIR(self.mode)
+
+
+class SyncConnection:
+    """a device connection that has been switched into sync mode"""
+
+    def __init__(self, conn: AdbConnection) -> None:
+        self.conn = conn
+        # the file data written including any compression
+        self.data_bytes = 0
+
+    def _write_request(self, request_id: bytes, payload: bytes = b"") -> None:
+        self.conn.write(request_id + struct.pack("<I", len(payload)) + payload)
+
+    async def stat(self, remote_path: str) -> RemoteStat:
+        """lstat a path on the device
+
+        Args:
+            remote_path (str): the path to stat
+
+        Returns:
+            RemoteStat: mode is 0 if the path doesnt exist
+        """
+        self._write_request(b"STAT", remote_path.encode())
+        await self.conn.drain()
+        reply = await self.conn.read_exactly(16)
+        if reply[:4] != b"STAT":
+            raise RemoteDeviceError(
+                _failed_result(
+                    f"sync:STAT {remote_path}", f"unexpected reply {reply[:4]!r}"
+                )
+            )
+        mode, size, mtime = struct.unpack("<III", reply[4:])
+        return RemoteStat(mode, size, mtime)
+
+    async def list_dir(self, remote_path: str) -> List[Tuple[str, RemoteStat]]:
+        """lists the entries of a folder on the device. . and .. are left out
+
+        Args:
+            remote_path (str): the folder to list
+
+        Returns:
+            List[Tuple[str, RemoteStat]]: the name and stat of each entry. Empty if the
+            folder doesnt exist
+        """
+        self._write_request(b"LIST", remote_path.encode())
+        await self.conn.drain()
+        entries: List[Tuple[str, RemoteStat]] = []
+        while True:
+            reply = await self.conn.read_exactly(20)
+            mode, size, mtime, name_length = struct.unpack("<IIII", reply[4:])
+            if reply[:4] == b"DONE":
+                return entries
+            if reply[:4] != b"DENT":
+                raise RemoteDeviceError(
+                    _failed_result(
+                        f"sync:LIST {remote_path}", f"unexpected reply {reply[:4]!r}"
+                    )
+                )
+            name = (await self.conn.read_exactly(name_length)).decode(errors="replace")
+            if name not in (".", ".."):
+                entries.append((name, RemoteStat(mode, size, mtime)))
+
+    def start_send(self, remote_path: str, mode: int = DEFAULT_FILE_MODE) -> None:
+        """starts sending a file. Follow with send_data and finish_send
+
+        Args:
+            remote_path (str): the full path of the file on the device
+            mode (int, optional): permission bits of the new file. Defaults to DEFAULT_FILE_MODE.
+        """
+        file_mode = stat.S_IFREG | (mode & 0o777)
+        self._write_request(b"SEND", f"{remote_path},{file_mode}".encode())
+
+    def start_send_v2(self, remote_path: str, mode: int, flags: int) -> None:
+        """starts sending a file with SND2. Follow with send_data and finish_send
+
+        Args:
+            remote_path (str): the full path of the file on the device
+            mode (int): permission bits of the new file
+            flags (int): compression.FLAG_ of the stream the DATA packets hold
+        """
+        file_mode = stat.S_IFREG | (mode & 0o777)
+        self._write_request(b"SND2", remote_path.encode())
+        self.conn.write(b"SND2" + struct.pack("<II", file_mode, flags))
+
+    async def send_data(self, chunk: memoryview) -> None:
+        """writes a single DATA packet. chunk must not be bigger than SYNC_DATA_MAX
+
+        the chunk is handed to the transport as is so slices of a mmap are not
+        copied into a new packet buffer first
+        """
+        self.conn.write(b"DATA" + struct.pack("<I", len(chunk)))
+        self.conn.write(chunk)
+        self.data_bytes += len(chunk)
+        await self.conn.drain()
+
+    async def send_stream(self, data: bytes) -> None:
+        """writes data of any size as DATA packets"""
+        with memoryview(data) as view:
+            for offset in range(0, len(view), SYNC_DATA_MAX):
+                await self.send_data(view[offset : offset + SYNC_DATA_MAX])
+
+    async def finish_send(self, remote_path: str, mtime: int) -> None:
+        """ends the file and waits for the device to confirm it was written
+
+        Args:
+            remote_path (str): the path given to start_send. Used in the error
+            mtime (int): modification time to give the file. Sent in place of the length
+
+        Raises:
+            RemoteDeviceError: if the device could not write the file
+        """
+        self.conn.write(b"DONE" + struct.pack("<I", mtime & 0xFFFFFFFF))
+        await self.conn.drain()
+        reply = await self.conn.read_exactly(8)
+        reply_id, length = reply[:4], struct.unpack("<I", reply[4:])[0]
+        if reply_id == b"OKAY":
+            return
+        if reply_id == b"FAIL":
+            message = (await self.conn.read_exactly(length)).decode(errors="replace")
+        else:
+            message = f"unexpected reply {reply_id!r}"
+        raise RemoteDeviceError(_failed_result(f"sync:SEND {remote_path}", message))
+
+    async def quit(self) -> None:
+        """ends the sync session and closes the connection"""
+        try:
+            self._write_request(b"QUIT")
+            await self.conn.drain()
+        except ConnectionError:
+            pass
+        await self.conn.close()
+
+    async def __aenter__(self) -> "SyncConnection":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.quit()
+
+
+async def open_sync(client: AdbClient, serial: str) -> SyncConnection:
+    """opens a sync session on the device
+
+    Args:
+        client (AdbClient): the client connected to the adb server
+        serial (str): the device to open the session on
+
+    Returns:
+        SyncConnection:
+    """
+    return SyncConnection(await client.open_service(serial, "sync:"))
+
+
+async def remote_manifest(
+    sync: SyncConnection, remote_root: str
+) -> Dict[str, RemoteStat]:
+    """lists every file under a folder on the device
+
+    Args:
+        sync (SyncConnection): an open sync session
+        remote_root (str): the folder to walk
+
+    Returns:
+        Dict[str, RemoteStat]: the stat of each file by its full remote path
+    """
+    manifest: Dict[str, RemoteStat] = {}
+    folders = [remote_root]
+    while folders:
+        folder = folders.pop()
+        for name, remote_stat in await sync.list_dir(folder):
+            remote_path = posixpath.join(folder, name)
+            if remote_stat.is_dir:
+                folders.append(remote_path)
+            else:
+                manifest[remote_path] = remote_stat
+    return manifest
+
+
+def _is_unchanged(local_file: str, remote_stat: Optional[RemoteStat]) -> bool:
+    """the remote file is the same size and has the mtime push gave it"""
+    if remote_stat is None or not remote_stat.exists or remote_stat.is_dir:
+        return False
+    local_stat = os.stat(local_file)
+    return remote_stat.size == local_stat.st_size & REMOTE_SIZE_MASK and (
+        remote_stat.mtime == int(local_stat.st_mtime) & REMOTE_SIZE_MASK
+    )
+
+
+def _md5_file(local_file: str) -> str:
+    digest = hashlib.md5()
+    with open(local_file, "rb") as fp:
+        while chunk := fp.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _hash_commands(remote_files: List[str]) -> List[str]:
+    """md5sum commands for the files each no longer than HASH_COMMAND_MAX unless a
+    single path is"""
+    commands: List[str] = []
+    batch: List[str] = []
+    length = 0
+    for remote_file in remote_files:
+        quoted = quote_args([remote_file])
+        if batch and length + len(quoted) + 1 > HASH_COMMAND_MAX:
+            commands.append(quote_args(["md5sum", *batch]))
+            batch, length = [], 0
+        if not batch:
+            length = len("md5sum")
+        batch.append(remote_file)
+        length += len(quoted) + 1
+    if batch:
+        commands.append(quote_args(["md5sum", *batch]))
+    return commands
+
+
+async def _matching_hashes(
+    client: AdbClient, serial: str, files: List[Tuple[str, str]]
+) -> Set[str]:
+    """hashes the files on both sides
+
+    Args:
+        client (AdbClient): the client connected to the adb server
+        serial (str): the device the files are on
+        files (List[Tuple[str, str]]): pairs of local and remote file paths
+
+    Returns:
+        Set[str]: the remote paths whose md5 matched the local file
+    """
+    remote_hashes: Dict[str, str] = {}
+    for command in _hash_commands([remote_file for _, remote_file in files]):
+        result = await client.shell(serial, command)
+        for line in result.stdout.decode(errors="replace").splitlines():
+            digest, _, remote_file = line.partition("  ")
+            remote_hashes[remote_file] = digest
+    loop = asyncio.get_running_loop()
+    matching: Set[str] = set()
+    for local_file, remote_file in files:
+        if remote_file not in remote_hashes:
+            continue
+        # hashing gigabytes would stall the event loop
+        digest = await loop.run_in_executor(None, _md5_file, local_file)
+        if digest == remote_hashes[remote_file]:
+            matching.add(remote_file)
+    return matching
+
+
+def _collect_files(local_path: str, remote_path: str) -> List[Tuple[str, str]]:
+    """walks the local path and pairs every file with where it should go on the device"""
+    if not os.path.isdir(local_path):
+        return [(local_path, remote_path)]
+    files: List[Tuple[str, str]] = []
+    for root, _dirs, filenames in os.walk(local_path):
+        relative = os.path.relpath(root, local_path)
+        remote_root = remote_path
+        if relative != os.curdir:
+            remote_root = posixpath.join(remote_path, *relative.split(os.sep))
+        for filename in sorted(filenames):
+            files.append(
+                (os.path.join(root, filename), posixpath.join(remote_root, filename))
+            )
+    return files
+
+
+class RateMeter:
+    def __init__(self, time_constant: float = RATE_TIME_CONSTANT) -> None:
+        """works out the current and the smoothed rate of a transfer from its running byte
+        count. The smoothed rate is an exponential moving average weighted by time so
+        it settles the same whatever the reports are spaced at
+
+        Args:
+            time_constant (float, optional): seconds to catch up most of the way to a
+            change in speed. Defaults to RATE_TIME_CONSTANT.
+        """
+        self.time_constant = time_constant
+        self.rate = 0.0
+        self.smoothed_rate = 0.0
+        self._last_bytes = 0
+        self._last_time = time.perf_counter()
+
+    def update(self, total_bytes: int, now: float | None = None) -> None:
+        """
+        Args:
+            total_bytes (int): bytes sent since the transfer started
+            now (float, optional): the time.perf_counter of the count. Defaults to now.
+        """
+        if now is None:
+            now = time.perf_counter()
+        elapsed = now - self._last_time
+        if elapsed <= 0:
+            return
+        self.rate = (total_bytes - self._last_bytes) / elapsed
+        if self.smoothed_rate <= 0:
+            self.smoothed_rate = self.rate
+        else:
+            weight = 1 - math.exp(-elapsed / self.time_constant)
+            self.smoothed_rate += weight * (self.rate - self.smoothed_rate)
+        self._last_bytes = total_bytes
+        self._last_time = now
+
+    def apply(self, progress: TransferProgress) -> None:
+        """copies the rates onto the progress"""
+        progress.rate = self.rate
+        progress.smoothed_rate = self.smoothed_rate
+
+
+class ProgressReporter:
+    """calls the progress callback no more than every PROGRESS_INTERVAL seconds"""
+
+    def __init__(
+        self,
+        callback: Optional[TransferProgressFunction],
+        total_bytes: int,
+        total_files: int,
+    ) -> None:
+        self.callback = callback
+        self.progress = TransferProgress(0, total_bytes, 0.0, "", 0, total_files)
+        self.start = time.perf_counter()
+        self.last_report = 0.0
+        self.meter = RateMeter()
+
+    def skip(self, size: int) -> None:
+        """counts a file that was already on the device"""
+        self.progress.bytes_skipped += size
+        self.progress.files_skipped += 1
+
+    def update(self, sent: int, current_file: str) -> None:
+        self.progress.bytes_sent += sent
+        self.progress.current_file = current_file
+        if not self.callback:
+            return
+        now = time.perf_counter()
+        if now - self.last_report >= PROGRESS_INTERVAL:
+            self.last_report = now
+            self.progress.elapsed = now - self.start
+            self.meter.update(self.progress.bytes_sent, now)
+            self.meter.apply(self.progress)
+            self.callback(self.progress)
+
+    def complete(self) -> TransferProgress:
+        """sends the final progress to the callback
+
+        Returns:
+            TransferProgress: the totals for the transfer
+        """
+        now = time.perf_counter()
+        self.progress.elapsed = now - self.start
+        self.meter.update(self.progress.bytes_sent, now)
+        self.meter.apply(self.progress)
+        if self.callback:
+            self.callback(self.progress)
+        return self.progress
+
+
+async def stream_file(
+    local_file: str,
+    send_chunk: Callable[[memoryview], Awaitable[None]],
+    finish: Callable[[], Awaitable[_T]],
+    reporter: ProgressReporter,
+    chunk_size: int = SYNC_DATA_MAX,
+) -> _T:
+    """memory maps the file and passes it to send_chunk in slices. The map is kept open
+    until finish returns as the transport may still hold slices of it until the device
+    has confirmed it recieved them
+
+    Args:
+        local_file (str): the file to stream
+        send_chunk (Callable[[memoryview], Awaitable[None]]): writes a slice of the file
+        finish (Callable[[], Awaitable[_T]]): called once every slice has been sent
+        reporter (ProgressReporter): updated after each slice
+        chunk_size (int, optional): the size of each slice. Defaults to SYNC_DATA_MAX.
+
+    Returns:
+        _T: what finish returned
+    """
+    size = os.path.getsize(local_file)
+    # mmap cant map an empty file
+    if size == 0:
+        return await finish()
+    with open(local_file, "rb") as fp:
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                for offset in range(0, size, chunk_size):
+                    with view[offset : offset + chunk_size] as chunk:
+                        await send_chunk(chunk)
+                        reporter.update(len(chunk), local_file)
+                return await finish()
+            finally:
+                view.release()
+
+
+async def _send_file(
+    sync: SyncConnection, local_file: str, remote_file: str, reporter: ProgressReporter
+) -> None:
+    """streams a single file over the sync connection"""
+    file_stat = os.stat(local_file)
+    sync.start_send(remote_file, stat.S_IMODE(file_stat.st_mode) or DEFAULT_FILE_MODE)
+    await stream_file(
+        local_file,
+        sync.send_data,
+        lambda: sync.finish_send(remote_file, int(file_stat.st_mtime)),
+        reporter,
+    )
+    reporter.progress.files_sent += 1
+
+
+def _worth_compressing(local_file: str, codec: Codec) -> bool:
+    """test compresses the start of the file"""
+    with open(local_file, "rb") as fp:
+        sample = fp.read(COMPRESS_SAMPLE_SIZE)
+    if not sample:
+        return False
+    compressor = codec.new_compressor()
+    compressed = len(compressor.compress(sample)) + len(compressor.flush())
+    return compressed <= len(sample) * (1 - MIN_COMPRESSION_SAVING)
+
+
+async def _send_file_compressed(
+    sync: SyncConnection,
+    local_file: str,
+    remote_file: str,
+    reporter: ProgressReporter,
+    codec: Codec,
+) -> None:
+    """streams a single file through the compressor over the sync connection"""
+    file_stat = os.stat(local_file)
+    compressor = codec.new_compressor()
+    sync.start_send_v2(
+        remote_file, stat.S_IMODE(file_stat.st_mode) or DEFAULT_FILE_MODE, codec.flag
+    )
+
+    loop = asyncio.get_running_loop()
+
+    async def send_chunk(chunk: memoryview) -> None:
+        # the compressors release the GIL so the event loop keeps running meanwhile
+        compressed = await loop.run_in_executor(None, compressor.compress, chunk)
+        await sync.send_stream(compressed)
+
+    async def finish() -> None:
+        await sync.send_stream(compressor.flush())
+        await sync.finish_send(remote_file, int(file_stat.st_mtime))
+
+    await stream_file(local_file, send_chunk, finish, reporter, COMPRESS_CHUNK_SIZE)
+    reporter.progress.files_sent += 1
+
+
+async def push(
+    client: AdbClient,
+    serial: str,
+    local_path: str,
+    remote_path: str,
+    progress_callback: Optional[TransferProgressFunction] = None,
+    skip_unchanged: bool = False,
+    verify_hash: bool = False,
+    on_file_synced: Optional[FileSyncedFunction] = None,
+    compress: bool = False,
+) -> TransferProgress:
+    """pushes a file or folder to the device. Same rules as adb push. If the remote
+    path is an existing folder the local path is copied into it
+
+    Args:
+        client (AdbClient): the client connected to the adb server
+        serial (str): the device to push to
+        local_path (str): file or folder to copy
+        remote_path (str): where to copy it to on the device
+        progress_callback (TransferProgressFunction, optional): called with the progress
+        every PROGRESS_INTERVAL seconds and once more when the push completes. Defaults to None.
+        skip_unchanged (bool, optional): leave out files already on the device with the same
+        size and mtime. Defaults to False.
+        verify_hash (bool, optional): also compare the md5 of the files that would be
+        skipped. Defaults to False.
+        on_file_synced (FileSyncedFunction, optional): called for each file once the device
+        has confirmed it was written or it was skipped. Defaults to None.
+        compress (bool, optional): compress the files that shrink if the device supports a
+        codec that is installed. Defaults to False.
+
+    Raises:
+        FileNotFoundError: if the local path doesnt exist
+        RemoteDeviceError: if the device refused a file
+
+    Returns:
+        TransferProgress: the totals for the completed push
+    """
+    if not os.path.exists(local_path):
+        raise FileNotFoundError(local_path)
+    codec = None
+    if compress:
+        codec = compression.choose_codec(await client.features(serial))
+    loop = asyncio.get_running_loop()
+    async with await open_sync(client, serial) as sync:
+        remote_stat = await sync.stat(remote_path)
+        if remote_stat.is_dir:
+            name = os.path.basename(os.path.normpath(local_path))
+            remote_path = posixpath.join(remote_path, name)
+        files = _collect_files(local_path, remote_path)
+        total_bytes = sum(os.path.getsize(local_file) for local_file, _ in files)
+        reporter = ProgressReporter(progress_callback, total_bytes, len(files))
+        if skip_unchanged:
+            files = await _skip_unchanged(
+                client,
+                serial,
+                sync,
+                local_path,
+                remote_path,
+                files,
+                reporter,
+                verify_hash,
+                on_file_synced,
+            )
+        for local_file, remote_file in files:
+            # the test compression would stall the event loop for every file
+            if codec is not None and await loop.run_in_executor(
+                None, _worth_compressing, local_file, codec
+            ):
+                await _send_file_compressed(
+                    sync, local_file, remote_file, reporter, codec
+                )
+            else:
+                await _send_file(sync, local_file, remote_file, reporter)
+            if on_file_synced:
+                on_file_synced(remote_file, os.path.getsize(local_file))
+    progress = reporter.complete()
+    if compress:
+        _log_transfer(local_path, progress, sync.data_bytes, codec)
+    return progress
+
+
+def _log_transfer(
+    local_path: str, progress: TransferProgress, data_bytes: int, codec: Codec | None
+) -> None:
+    """logs how much the compression saved so it can be compared with plain pushes"""
+    megabytes_per_second = progress.throughput / 1024 / 1024
+    ratio = data_bytes / progress.bytes_sent if progress.bytes_sent else 1.0
+    codec_name = codec.name if codec else "none"
+    _Log.info(
+        f"Pushed {local_path}: {progress.bytes_sent} bytes as {data_bytes} bytes "
+        f"(compression {codec_name}, ratio {ratio:.2f}) at {megabytes_per_second:.1f} MB/s effective"
+    )
+
+
+async def _skip_unchanged(
+    client: AdbClient,
+    serial: str,
+    sync: SyncConnection,
+    local_path: str,
+    remote_path: str,
+    files: List[Tuple[str, str]],
+    reporter: ProgressReporter,
+    verify_hash: bool,
+    on_file_synced: Optional[FileSyncedFunction],
+) -> List[Tuple[str, str]]:
+    """drops the files that are already on the device from the list and counts them as
+    skipped
+
+    Returns:
+        List[Tuple[str, str]]: the files that still need to be sent
+    """
+    # one listing of the whole remote tree instead of a stat per file
+    if os.path.isdir(local_path):
+        manifest = await remote_manifest(sync, remote_path)
+    else:
+        manifest = {remote_path: await sync.stat(remote_path)}
+    unchanged = [
+        (local_file, remote_file)
+        for local_file, remote_file in files
+        if _is_unchanged(local_file, manifest.get(remote_file))
+    ]
+    skipped = {remote_file for _, remote_file in unchanged}
+    if verify_hash:
+        skipped = await _matching_hashes(client, serial, unchanged)
+    remaining: List[Tuple[str, str]] = []
+    for local_file, remote_file in files:
+        if remote_file in skipped:
+            size = os.path.getsize(local_file)
+            reporter.skip(size)
+            if on_file_synced:
+                on_file_synced(remote_file, size)
+        else:
+            remaining.append((local_file, remote_file))
+    return remaining
@@ -0,0 +1,230 @@
+"""
+apk_manifest.py
+
+reads the package name, version and split name out of the AndroidManifest.xml inside an
+apk without asking the device. The manifest is stored compiled into android's binary xml
+format (AXML) which is a list of chunks
+
+[type: uint16 le][header size: uint16 le][chunk size: uint32 le][header...][data...]
+
+only the string pool, the resource map and the attributes of the <manifest> element are
+read. The apk is a zip so only its central directory and the manifest entry are read
+from disk however big the apk is
+"""
+import struct
+import zipfile
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+MANIFEST_NAME = "AndroidManifest.xml"
+
+# chunk types from androidfw/ResourceTypes.h
+RES_STRING_POOL_TYPE = 0x0001
+RES_XML_TYPE = 0x0003
+RES_XML_START_ELEMENT_TYPE = 0x0102
+RES_XML_RESOURCE_MAP_TYPE = 0x0180
+
+# the string pool is utf-8 instead of utf-16
+UTF8_FLAG = 1 << 8
+
+# Res_value data types
+TYPE_STRING = 0x03
+TYPE_INT_DEC = 0x10
+TYPE_INT_HEX = 0x11
+
+# an attribute without a raw string value
+NO_ENTRY = 0xFFFFFFFF
+
+ANDROID_NAMESPACE = "http://schemas.android.com/apk/res/android"
+
+# android:versionCode, android:versionName and android:versionCodeMajor. Tools that shrink
+# apks can strip the attribute names so they are matched by resource id
+VERSION_CODE_ID = 0x0101021B
+VERSION_NAME_ID = 0x0101021C
+VERSION_CODE_MAJOR_ID = 0x01010576
+
+_CHUNK_HEADER = struct.Struct("<HHI")
+# lineNumber, comment then ns, name, attributeStart, attributeSize, attributeCount
+_START_ELEMENT = struct.Struct("<IIIIHHH")
+# ns, name, rawValue, size, res0, dataType, data
+_ATTRIBUTE = struct.Struct("<IIIHBBI")
+
+
+class ManifestError(Exception):
+    def __init__(self, apk_path: str, reason: str, *args: object) -> None:
+        super().__init__(*args)
+        self.apk_path = apk_path
+        self.reason = reason
+
+    def __str__(self) -> str:
+        return f"Unable to read the manifest of {self.apk_path}. {self.reason}"
+
+
+@dataclass(frozen=True)
+class ApkManifest:
+    package: str
+    # the long version code pm list packages --show-versioncode reports
+    version_code: int
+    version_name: str = ""
+    # the name of the split. Empty for the base apk
+    split: str = ""
+
+    @property
+    def is_split(self) -> bool:
+        return bool(self.split)
+
+
+def _read_utf8_length(data: bytes, offset: int) -> Tuple[int, int]:
+    """a length of one byte or two if the high bit is set"""
+    length = data[offset]
+    if length & 0x80:
+        return ((length & 0x7F) << 8) | data[offset + 1], offset + 2
+    return length, offset + 1
+
+
+def _read_string_pool(data: bytes, start: int, header_size: int) -> List[str]:
+    string_count, _style_count, flags, strings_start = struct.unpack_from(
+        "<IIII", data, start + _CHUNK_HEADER.size
+    )
+    offsets = struct.unpack_from(f"<{string_count}I", data, start + header_size)
+    strings_start += start
+    strings: List[str] = []
+    for offset in offsets:
+        offset += strings_start
+        if flags & UTF8_FLAG:
+            # the length in characters then the length in bytes
+            _, offset = _read_utf8_length(data, offset)
+            length, offset = _read_utf8_length(data, offset)
+            strings.append(data[offset : offset + length].decode("utf-8", "replace"))
+        else:
+            length = struct.unpack_from("<H", data, offset)[0]
+            offset += 2
+            if length & 0x8000:
+                low = struct.unpack_from("<H", data, offset)[0]
+                length = ((length & 0x7FFF) << 16) | low
+                offset += 2
+            raw = data[offset : offset + length * 2]
+            strings.append(raw.decode("utf-16-le", "replace"))
+    return strings
+
+
+def _manifest_attributes(data: bytes) -> Dict[str | int, str | int]:
+    """the attributes of the first element keyed by resource id or by name if the
+    attribute doesnt have one
+
+    Raises:
+        ValueError: if the data isnt binary xml or has no elements
+        struct.error: if a chunk runs past the end of the data
+    """
+    chunk_type, header_size, size = _CHUNK_HEADER.unpack_from(data, 0)
+    if chunk_type != RES_XML_TYPE:
+        raise ValueError("not a binary xml file")
+    strings: List[str] = []
+    resource_ids: Tuple[int, ...] = ()
+    offset = header_size
+    end = min(size, len(data))
+    while offset + _CHUNK_HEADER.size <= end:
+        chunk_type, header_size, size = _CHUNK_HEADER.unpack_from(data, offset)
+        if size < _CHUNK_HEADER.size:
+            raise ValueError(f"bad chunk size {size} at {offset}")
+        if chunk_type == RES_STRING_POOL_TYPE:
+            strings = _read_string_pool(data, offset, header_size)
+        elif chunk_type == RES_XML_RESOURCE_MAP_TYPE:
+            count = (size - header_size) // 4
+            resource_ids = struct.unpack_from(f"<{count}I", data, offset + header_size)
+        elif chunk_type == RES_XML_START_ELEMENT_TYPE:
+            (
+                _line,
+                _comment,
+                _ns,
+                _name,
+                attribute_start,
+                attribute_size,
+                attribute_count,
+            ) = _START_ELEMENT.unpack_from(data, offset + _CHUNK_HEADER.size)
+            attributes: Dict[str | int, str | int] = {}
+            # attributeStart is counted from the ns field after the node header
+            position = offset + header_size + attribute_start
+            for _ in range(attribute_count):
+                (
+                    _ns,
+                    name,
+                    raw_value,
+                    _size,
+                    _res0,
+                    data_type,
+                    value,
+                ) = _ATTRIBUTE.unpack_from(data, position)
+                position += attribute_size
+                key: str | int = (
+                    resource_ids[name] if name < len(resource_ids) else strings[name]
+                )
+                if raw_value != NO_ENTRY:
+                    attributes[key] = strings[raw_value]
+                elif data_type == TYPE_STRING:
+                    attributes[key] = strings[value]
+                elif data_type in (TYPE_INT_DEC, TYPE_INT_HEX):
+                    attributes[key] = value
+            return attributes
+        offset += size
+    raise ValueError("no elements found")
+
+
+def parse_manifest(data: bytes) -> ApkManifest:
+    """reads the manifest element of a compiled AndroidManifest.xml
+
+    Args:
+        data (bytes): the contents of AndroidManifest.xml from the apk
+
+    Raises:
+        ValueError: if the data isnt a compiled manifest or it has no package name
+
+    Returns:
+        ApkManifest:
+    """
+    try:
+        attributes = _manifest_attributes(data)
+    except (struct.error, IndexError, UnicodeDecodeError) as err:
+        raise ValueError(f"manifest is corrupt. {err.__str__()}")
+    package = attributes.get("package")
+    if not isinstance(package, str) or not package:
+        raise ValueError("manifest has no package name")
+
+    def integer(key: int) -> int:
+        value = attributes.get(key, 0)
+        try:
+            return int(value)
+        except ValueError:
+            return 0
+
+    version_code = (integer(VERSION_CODE_MAJOR_ID) << 32) | integer(VERSION_CODE_ID)
+    version_name = attributes.get(VERSION_NAME_ID, "")
+    split = attributes.get("split", "")
+    return ApkManifest(
+        package,
+        version_code,
+        version_name if isinstance(version_name, str) else "",
+        split if isinstance(split, str) else "",
+    )
+
+
+def read_manifest(apk_path: str) -> ApkManifest:
+    """reads the package name and version from an apk on disk
+
+    Args:
+        apk_path (str): the apk file
+
+    Raises:
+        ManifestError: if the apk isnt a zip, has no manifest or the manifest couldnt be read
+
+    Returns:
+        ApkManifest:
+    """
+    try:
+        with zipfile.ZipFile(apk_path) as apk:
+            data = apk.read(MANIFEST_NAME)
+        return parse_manifest(data)
+    except KeyError:
+        raise ManifestError(apk_path, f"{MANIFEST_NAME} is missing")
+    except (OSError, zipfile.BadZipFile, ValueError) as err:
+        raise ManifestError(apk_path, err.__str__())
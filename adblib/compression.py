@@ -0,0 +1,166 @@
+"""
+compression.py
+
+the compression formats adbd can decompress during a sync SND2 transfer. Each one needs
+its python package installed. A format whose package is missing is treated as if the
+device didnt support it
+
+the device decompresses a single stream that runs across all of the DATA packets of a
+file. zstd and lz4 use their frame formats
+"""
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Protocol
+
+try:
+    import zstandard
+
+    _HAVE_ZSTD = True
+except ImportError:
+    _HAVE_ZSTD = False
+
+try:
+    import lz4.frame
+
+    _HAVE_LZ4 = True
+except ImportError:
+    _HAVE_LZ4 = False
+
+try:
+    import brotli
+
+    _HAVE_BROTLI = True
+except ImportError:
+    _HAVE_BROTLI = False
+
+# SND2 flags from adb's file_sync_protocol.h
+FLAG_NONE = 0
+FLAG_BROTLI = 1
+FLAG_LZ4 = 2
+FLAG_ZSTD = 4
+
+# low levels keep up with a USB 2 link without holding up the event loop for long
+ZSTD_LEVEL = 3
+BROTLI_QUALITY = 1
+
+
+class Compressor(Protocol):
+    def compress(self, data: bytes | memoryview) -> bytes:
+        ...
+
+    def flush(self) -> bytes:
+        """ends the stream and returns whatever is left"""
+        ...
+
+
+class Decompressor(Protocol):
+    def decompress(self, data: bytes) -> bytes:
+        ...
+
+
+@dataclass(frozen=True)
+class Codec:
+    name: str
+    # the SND2 flag and the device feature that advertises it
+    flag: int
+    feature: str
+    new_compressor: Callable[[], Compressor]
+    new_decompressor: Callable[[], Decompressor]
+
+
+class _Lz4Compressor:
+    def __init__(self) -> None:
+        self._compressor = lz4.frame.LZ4FrameCompressor()
+        self._header = self._compressor.begin()
+
+    def compress(self, data: bytes | memoryview) -> bytes:
+        header, self._header = self._header, b""
+        return header + self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        header, self._header = self._header, b""
+        return header + self._compressor.flush()
+
+
+class _BrotliCompressor:
+    def __init__(self) -> None:
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data: bytes | memoryview) -> bytes:
+        return self._compressor.process(bytes(data))
+
+    def flush(self) -> bytes:
+        return self._compressor.finish()
+
+
+class _BrotliDecompressor:
+    def __init__(self) -> None:
+        self._decompressor = brotli.Decompressor()
+
+    def decompress(self, data: bytes) -> bytes:
+        return self._decompressor.process(data)
+
+
+def _build_codecs() -> Dict[str, Codec]:
+    """the codecs whose package is installed in the order they are preferred. zstd
+    compresses about as well as brotli at the speed of lz4"""
+    codecs: Dict[str, Codec] = {}
+    if _HAVE_ZSTD:
+        codecs["zstd"] = Codec(
+            "zstd",
+            FLAG_ZSTD,
+            "sendrecv_v2_zstd",
+            lambda: zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj(),
+            lambda: zstandard.ZstdDecompressor().decompressobj(),
+        )
+    if _HAVE_LZ4:
+        codecs["lz4"] = Codec(
+            "lz4",
+            FLAG_LZ4,
+            "sendrecv_v2_lz4",
+            _Lz4Compressor,
+            lz4.frame.LZ4FrameDecompressor,
+        )
+    if _HAVE_BROTLI:
+        codecs["brotli"] = Codec(
+            "brotli",
+            FLAG_BROTLI,
+            "sendrecv_v2_brotli",
+            _BrotliCompressor,
+            _BrotliDecompressor,
+        )
+    return codecs
+
+
+CODECS = _build_codecs()
+
+
+def choose_codec(features: List[str]) -> Codec | None:
+    """picks the preferred codec the device supports
+
+    Args:
+        features (List[str]): the device features from host-serial:<serial>:features
+
+    Returns:
+        Codec | None: None if the device cant take compressed transfers
+    """
+    if "sendrecv_v2" not in features:
+        return None
+    for codec in CODECS.values():
+        if codec.feature in features:
+            return codec
+    return None
+
+
+def codec_for_flags(flags: int) -> Codec | None:
+    """the codec a SND2 request was sent with. None if it wasnt compressed
+
+    Raises:
+        ValueError: if the flags name a codec that isnt installed
+    """
+    compression = flags & (FLAG_BROTLI | FLAG_LZ4 | FLAG_ZSTD)
+    if compression == FLAG_NONE:
+        return None
+    for codec in CODECS.values():
+        if codec.flag == compression:
+            return codec
+    raise ValueError(f"unsupported compression flags {flags:#x}")
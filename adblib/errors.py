@@ -38,3 +38,29 @@ class UnInstallError(Exception):
 
     def __str__(self) -> str:
         return f"{self.package_name} could not be uninstalled. {self.result}"
+
+
+class AdbServerUnavailableError(ConnectionError):
+    """raised when no adb server is listening on the host and port"""
+
+    def __init__(self, host: str, port: int, reason: str, *args: object) -> None:
+        super().__init__(*args)
+        self.host = host
+        self.port = port
+        self.reason = reason
+
+    def __str__(self) -> str:
+        return f"Unable to connect to the adb server on {self.host}:{self.port}. {self.reason}"
+
+
+class SubprocessTimeoutError(TimeoutError):
+    """raised when a command run on the host doesnt finish in time. The command has been
+    killed and result holds what it printed before then"""
+
+    def __init__(self, result: CompletedProcess, timeout: float, *args: object) -> None:
+        super().__init__(*args)
+        self.result = result
+        self.timeout = timeout
+
+    def __str__(self) -> str:
+        return f"{' '.join(map(str, self.result.args))} didnt finish within {self.timeout}s"
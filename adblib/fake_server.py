@@ -0,0 +1,1278 @@
+"""
+fake_server.py
+
+a local stand-in for the adb server so adb_client and adb_interface can be
+exercised without a headset plugged in. It speaks the same smart socket protocol
+on a local port and each FakeDevice keeps its files in a temp directory
+
+only the small subset of the device shell used by this app is emulated
+
+each device can be given a LinkModel to slow it down to the speed of a real USB link,
+add a delay to every request and drop connections at random. Devices that share a
+LinkModel share its bandwidth like headsets plugged into the same hub. Run the module to
+serve fake devices on a port for the app or the adb executable to connect to
+
+    python -m adblib.fake_server --port 5037 --devices 4 --bandwidth-mb 40 --latency-ms 2
+"""
+import argparse
+import asyncio
+import dataclasses
+import hashlib
+import os
+import shlex
+import shutil
+import io
+import posixpath
+import random
+import struct
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Tuple
+
+from adblib import adb_client, apk_manifest, compression
+
+# the version the real adb server reports for platform-tools 33
+FAKE_SERVER_VERSION = 41
+
+# the features reported for every device. Only the protocols the fake server speaks
+FAKE_DEVICE_FEATURES = ",".join(
+    ["shell_v2", "cmd", "sendrecv_v2"]
+    + [codec.feature for codec in compression.CODECS.values()]
+)
+
+_ShellOutput = Tuple[bytes, bytes, int]
+
+
+class InjectedFailure(ConnectionResetError):
+    """drops the connection the fake device was serving"""
+
+
+@dataclass
+class LinkModel:
+    """the speed and reliability of the link to a fake device"""
+
+    # bytes a second sent to the device. 0 is as fast as the host can go
+    bandwidth: float = 0.0
+    # seconds added to every request ie. each shell command or sync STAT and SEND
+    latency: float = 0.0
+    # chance from 0 to 1 that a request drops its connection instead of being served
+    failure_rate: float = 0.0
+    # drop the next push once this many bytes of it have arrived. 0 doesnt
+    fail_after_bytes: int = 0
+    # drop the next request. Only happens once
+    drop_next_request: bool = False
+    # makes the failures the same every run
+    seed: int | None = None
+    _random: random.Random = field(init=False, repr=False)
+    # when the bytes already sent will have finished going over the link
+    _busy_until: float = field(default=0.0, init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self._random = random.Random(self.seed)
+
+    async def request(self) -> None:
+        """waits out the latency of a request
+
+        Raises:
+            InjectedFailure: if the request was chosen to fail
+        """
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        if self.drop_next_request:
+            self.drop_next_request = False
+            raise InjectedFailure("fake link dropped the request")
+        if self.failure_rate > 0 and self._random.random() < self.failure_rate:
+            raise InjectedFailure("fake link dropped the request")
+
+    async def transfer(self, size: int) -> None:
+        """waits until size bytes would have gone over the link. Every connection to the
+        devices using this model is queued behind the others"""
+        if self.bandwidth <= 0:
+            return
+        now = time.monotonic()
+        self._busy_until = max(self._busy_until, now) + size / self.bandwidth
+        await asyncio.sleep(self._busy_until - now)
+
+    def check_push(self, received: int) -> None:
+        """fails a push once it has received fail_after_bytes. Only happens once
+
+        Raises:
+            InjectedFailure: if the push has reached fail_after_bytes
+        """
+        if self.fail_after_bytes and received >= self.fail_after_bytes:
+            self.fail_after_bytes = 0
+            raise InjectedFailure("fake link dropped the push")
+
+
+class FakeDevice:
+    def __init__(
+        self,
+        serial: str,
+        model: str = "Quest 2",
+        state: str = "device",
+        packages: List[str] | None = None,
+        properties: Dict[str, str] | None = None,
+        usb: str = "1-1",
+        storage_total: int = 128 * 1024**3,
+        battery_level: int = 85,
+        link: LinkModel | None = None,
+    ) -> None:
+        """a fake android device. Remote paths are mapped into a temp directory
+
+        Args:
+            serial (str): the serial reported by host:devices
+            model (str, optional): ro.product.model. Defaults to "Quest 2".
+            state (str, optional): device, offline or unauthorized. Defaults to "device".
+            packages (List[str] | None, optional): installed third party packages. Defaults to None.
+            properties (Dict[str, str] | None, optional): extra getprop values. Defaults to None.
+            usb (str, optional): the usb port path reported by host:devices-l. Defaults to "1-1".
+            storage_total (int, optional): size of /sdcard in bytes. Defaults to 128GB.
+            battery_level (int, optional): reported by dumpsys battery. Defaults to 85.
+            link (LinkModel, optional): bandwidth, latency and failures of the link. Defaults
+            to an instant link that never fails.
+        """
+        self.serial = serial
+        self.state = state
+        self.usb = usb
+        self.storage_total = storage_total
+        self.battery_level = battery_level
+        self.link = link or LinkModel()
+        self.packages: List[str] = list(packages or [])
+        # package name -> versionCode. Packages not in here report 1
+        self.version_codes: Dict[str, int] = {}
+        self.properties: Dict[str, str] = {
+            "ro.product.model": model,
+            "ro.product.manufacturer": "Oculus",
+            "ro.build.version.sdk": "32",
+        }
+        self.properties.update(properties or {})
+        self.root = tempfile.mkdtemp(prefix=f"fakeadb-{serial}-")
+        os.makedirs(self.local_path("/sdcard/Android/obb"))
+        os.makedirs(self.local_path("/sdcard/Android/data"))
+        self._installed_count = 0
+        # install session id -> the apks written to it by name
+        self.sessions: Dict[int, Dict[str, bytes]] = {}
+        self._session_count = 0
+
+    @property
+    def model(self) -> str:
+        return self.properties["ro.product.model"]
+
+    def local_path(self, remote_path: str) -> str:
+        """maps a path on the device into the temp directory
+
+        Args:
+            remote_path (str): absolute path on the device ie. /sdcard/Android/obb
+
+        Returns:
+            str: the local path
+        """
+        parts = [part for part in remote_path.split("/") if part and part != ".."]
+        return os.path.join(self.root, *parts)
+
+    @property
+    def storage_free(self) -> int:
+        """the storage left once the files pushed to the device are taken off"""
+        used = 0
+        for root, _dirs, files in os.walk(self.root):
+            used += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+        return max(self.storage_total - used, 0)
+
+    def remove(self) -> None:
+        """deletes the temp directory backing the device"""
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def install_package(self, apk_data: bytes) -> str:
+        """records a streamed apk as an installed package. An apk made with make_apk is
+        installed under the package name and version in its manifest. Anything else gets
+        a made up package name
+
+        Args:
+            apk_data (bytes): the apk bytes that were streamed to the device
+
+        Returns:
+            str: the name of the package that was installed
+        """
+        manifest = _read_apk_manifest(apk_data)
+        if manifest is None:
+            self._installed_count += 1
+            package_name = f"com.fakeadb.app{self._installed_count}"
+        else:
+            package_name = manifest.package
+            self.version_codes[package_name] = manifest.version_code
+        if package_name not in self.packages:
+            self.packages.append(package_name)
+        return package_name
+
+    def create_session(self) -> int:
+        """starts a package install session like pm install-create"""
+        self._session_count += 1
+        self.sessions[self._session_count] = {}
+        return self._session_count
+
+    def commit_session(self, session_id: int) -> str:
+        """installs every apk written to the session as one package
+
+        Raises:
+            KeyError: if the session doesnt exist or has nothing written to it
+        """
+        apks = self.sessions.pop(session_id)
+        if not apks:
+            raise KeyError(session_id)
+        for apk_data in apks.values():
+            manifest = _read_apk_manifest(apk_data)
+            if manifest is not None and not manifest.is_split:
+                return self.install_package(apk_data)
+        return self.install_package(b"".join(apks.values()))
+
+    def run_shell(self, command: str, stdin: bytes = b"") -> _ShellOutput:
+        """runs the command line through the emulated shell
+
+        Args:
+            command (str): the command line
+            stdin (bytes, optional): passed to the first command. Defaults to b"".
+
+        Returns:
+            Tuple[bytes, bytes, int]: stdout, stderr and the exit code
+        """
+        return _FakeShell(self).run(command, stdin)
+
+
+def _read_apk_manifest(apk_data: bytes) -> apk_manifest.ApkManifest | None:
+    try:
+        with zipfile.ZipFile(io.BytesIO(apk_data)) as apk:
+            return apk_manifest.parse_manifest(apk.read(apk_manifest.MANIFEST_NAME))
+    except (zipfile.BadZipFile, KeyError, ValueError):
+        return None
+
+
+def _string_pool(strings: List[str]) -> bytes:
+    """a utf-8 string pool chunk. Only short strings are supported"""
+    offsets = []
+    data = b""
+    for string in strings:
+        encoded = string.encode()
+        offsets.append(len(data))
+        data += bytes([len(string), len(encoded)]) + encoded + b"\0"
+    data += bytes(-len(data) % 4)
+    header_size = 28
+    strings_start = header_size + 4 * len(strings)
+    header = struct.pack(
+        "<HHIIIIII",
+        apk_manifest.RES_STRING_POOL_TYPE,
+        header_size,
+        strings_start + len(data),
+        len(strings),
+        0,
+        apk_manifest.UTF8_FLAG,
+        strings_start,
+        0,
+    )
+    return header + struct.pack(f"<{len(offsets)}I", *offsets) + data
+
+
+def build_manifest(
+    package: str, version_code: int, version_name: str = "", split: str = ""
+) -> bytes:
+    """compiles a manifest with just the <manifest> element the way aapt2 would
+
+    Args:
+        package (str): the package name
+        version_code (int): android:versionCode
+        version_name (str, optional): android:versionName. Defaults to "".
+        split (str, optional): the split name for a split apk. Defaults to "".
+
+    Returns:
+        bytes: the binary xml of AndroidManifest.xml
+    """
+    # attribute names with a resource id come first so the resource map lines up
+    strings = [
+        "versionCode",
+        "versionName",
+        "package",
+        "split",
+        apk_manifest.ANDROID_NAMESPACE,
+        "manifest",
+        package,
+        version_name,
+        split,
+    ]
+    resource_map = struct.pack(
+        "<HHI2I",
+        apk_manifest.RES_XML_RESOURCE_MAP_TYPE,
+        8,
+        16,
+        apk_manifest.VERSION_CODE_ID,
+        apk_manifest.VERSION_NAME_ID,
+    )
+    no_entry = apk_manifest.NO_ENTRY
+    string_type = apk_manifest.TYPE_STRING
+    attributes = [
+        (4, 0, no_entry, apk_manifest.TYPE_INT_DEC, version_code),
+        (4, 1, 7, string_type, 7),
+        (no_entry, 2, 6, string_type, 6),
+    ]
+    if split:
+        attributes.append((no_entry, 3, 8, string_type, 8))
+    body = b"".join(
+        struct.pack("<IIIHBBI", ns, name, raw, 8, 0, data_type, value)
+        for ns, name, raw, data_type, value in attributes
+    )
+    element = (
+        struct.pack("<II", 1, no_entry)
+        + struct.pack("<IIHHHHHH", no_entry, 5, 20, 20, len(attributes), 0, 0, 0)
+        + body
+    )
+    start_element = (
+        struct.pack(
+            "<HHI",
+            apk_manifest.RES_XML_START_ELEMENT_TYPE,
+            16,
+            8 + len(element),
+        )
+        + element
+    )
+    chunks = _string_pool(strings) + resource_map + start_element
+    return struct.pack("<HHI", apk_manifest.RES_XML_TYPE, 8, 8 + len(chunks)) + chunks
+
+
+def make_apk(
+    package: str,
+    version_code: int = 1,
+    version_name: str = "1.0",
+    split: str = "",
+    size: int = 50000,
+) -> bytes:
+    """an apk the fake devices install under its package name
+
+    Args:
+        package (str): the package name in the manifest
+        version_code (int, optional): the version code in the manifest. Defaults to 1.
+        version_name (str, optional): the version name in the manifest. Defaults to "1.0".
+        split (str, optional): the split name for a split apk. Defaults to "".
+        size (int, optional): bytes of random data stored with it. Defaults to 50000.
+
+    Returns:
+        bytes: the zip
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as apk:
+        apk.writestr(
+            apk_manifest.MANIFEST_NAME,
+            build_manifest(package, version_code, version_name, split),
+        )
+        apk.writestr("classes.dex", os.urandom(size))
+    return buffer.getvalue()
+
+
+class _FakeShell:
+    """runs a command line made up of simple commands joined with ; && || and |"""
+
+    def __init__(self, device: FakeDevice) -> None:
+        self.device = device
+        self.status = 0
+        self.commands: Dict[str, Callable[[List[str], bytes], _ShellOutput]] = {
+            "echo": self._echo,
+            "printf": self._printf,
+            "true": lambda args, stdin: (b"", b"", 0),
+            "false": lambda args, stdin: (b"", b"", 1),
+            "test": self._test,
+            "[": self._test,
+            "mkdir": self._mkdir,
+            "rm": self._rm,
+            "cat": self._cat,
+            "md5sum": self._md5sum,
+            "tar": self._tar,
+            "getprop": self._getprop,
+            "df": self._df,
+            "du": self._du,
+            "dumpsys": self._dumpsys,
+            "pm": self._pm,
+            "cmd": self._cmd,
+        }
+
+    def run(self, command: str, stdin: bytes = b"") -> _ShellOutput:
+        lexer = shlex.shlex(command, posix=True, punctuation_chars=";&|<>")
+        lexer.whitespace_split = True
+        lexer.commenters = ""
+        tokens = list(lexer)
+        stdout: List[bytes] = []
+        stderr: List[bytes] = []
+        pipeline: List[List[str]] = [[]]
+        skip_next = False
+        for token in tokens + [";"]:
+            if token not in (";", "&&", "||", "|"):
+                pipeline[-1].append(token)
+                continue
+            if token == "|":
+                pipeline.append([])
+                continue
+            if pipeline[0] and not skip_next:
+                out, err = self._run_pipeline(pipeline, stdin)
+                stdout.append(out)
+                stderr.append(err)
+            pipeline = [[]]
+            skip_next = (token == "&&" and self.status != 0) or (
+                token == "||" and self.status == 0
+            )
+        return b"".join(stdout), b"".join(stderr), self.status
+
+    def _run_pipeline(
+        self, pipeline: List[List[str]], stdin: bytes
+    ) -> Tuple[bytes, bytes]:
+        stderr: List[bytes] = []
+        data = stdin
+        for args in pipeline:
+            data, err = self._run_simple(args, data)
+            stderr.append(err)
+        return data, b"".join(stderr)
+
+    def _run_simple(self, args: List[str], stdin: bytes) -> Tuple[bytes, bytes]:
+        args = [arg.replace("$?", str(self.status)) for arg in args]
+        args, redirects = self._split_redirects(args)
+        if not args:
+            return b"", b""
+        handler = self.commands.get(args[0])
+        if handler is None:
+            out, err, self.status = (
+                b"",
+                f"/system/bin/sh: {args[0]}: inaccessible or not found\n".encode(),
+                127,
+            )
+        else:
+            out, err, self.status = handler(args[1:], stdin)
+        for fd, target in redirects:
+            if fd == 1 and target == "&2":
+                out, err = b"", err + out
+            elif fd == 2 and target == "&1":
+                out, err = out + err, b""
+            elif target == "/dev/null":
+                if fd == 1:
+                    out = b""
+                else:
+                    err = b""
+            elif fd == 1:
+                with open(self.device.local_path(target), "wb") as fp:
+                    fp.write(out)
+                out = b""
+        return out, err
+
+    @staticmethod
+    def _split_redirects(args: List[str]) -> Tuple[List[str], List[Tuple[int, str]]]:
+        """pulls the >, >&, 2> and 2>&1 redirections out of the arguments"""
+        words: List[str] = []
+        redirects: List[Tuple[int, str]] = []
+        index = 0
+        while index < len(args):
+            arg = args[index]
+            if arg in (">", ">&") and index + 1 < len(args):
+                fd = 1
+                if words and words[-1] in ("1", "2"):
+                    fd = int(words.pop())
+                target = args[index + 1]
+                redirects.append((fd, f"&{target}" if arg == ">&" else target))
+                index += 2
+                continue
+            words.append(arg)
+            index += 1
+        return words, redirects
+
+    # commands
+
+    def _echo(self, args: List[str], stdin: bytes) -> _ShellOutput:
+        newline = "\n"
+        if args and args[0] == "-n":
+            args, newline = args[1:], ""
+        return (" ".join(args) + newline).encode(), b"", 0
+
+    def _printf(self, args: List[str], stdin: bytes) -> _ShellOutput:
+        if not args:
+            return b"", b"", 1
+        fmt = args[0].replace("\\n", "\n")
+        values = args[1:]
+        try:
+            text = fmt.replace("%d", "%s") % tuple(values) if values else fmt
+        except TypeError:
+            text = fmt
+        return text.encode(), b"", 0
+
+    def _test(self, args: List[str], stdin: bytes) -> _ShellOutput:
+        if args and args[-1] == "]":
+            args = args[:-1]
+        if len(args) != 2:
+            return b"", b"", 2
+        flag, path = args
+        local_path = self.device.local_path(path)
+        checks = {"-d": os.path.isdir, "-f": os.path.isfile, "-e": os.path.exists}
+        if flag not in checks:
+            return b"", b"", 2
+        return b"", b"", 0 if checks[flag](local_path) else 1
+
+    def _mkdir(self, args: List[str], stdin: bytes) -> _ShellOutput:
+        parents = "-p" in args
+        for path in (arg for arg in args if not arg.startswith("-")):
+            local_path = self.device.local_path(path)
+            try:
+                if parents:
+                    os.makedirs(local_path, exist_ok=True)
+                else:
+                    os.mkdir(local_path)
+            except OSError:
+                return b"", f"mkdir: '{path}': File exists\n".encode(), 1
+        return b"", b"", 0
+
+    def _rm(self, args: List[str], stdin: bytes) -> _ShellOutput:
+        flags = "".join(arg[1:] for arg in args if arg.startswith("-"))
+        status = 0
+        stderr = b""
+        for path in (arg for arg in args if not arg.startswith("-")):
+            local_path = self.device.local_path(path)
+            if os.path.isdir(local_path) and "r" in flags:
+                shutil.rmtree(local_path)
+            elif os.path.isfile(local_path):
+                os.remove(local_path)
+            elif "f" not in flags:
+                stderr += f"rm: {path}: No such file or directory\n".encode()
+                status = 1
+        return b"", stderr, status
+
+    def _cat(self, args: List[str], stdin: bytes) -> _ShellOutput:
+        if not args:
+            return stdin, b"", 0
+        try:
+            with open(self.device.local_path(args[0]), "rb") as fp:
+                return fp.read(), b"", 0
+        except OSError:
+            return b"", f"cat: {args[0]}: No such file or directory\n".encode(), 1
+
+    def _md5sum(self, args: List[str], stdin: bytes) -> _ShellOutput:
+        stdout: List[bytes] = []
+        stderr: List[bytes] = []
+        status = 0
+        for path in args:
+            try:
+                with open(self.device.local_path(path), "rb") as fp:
+                    digest = hashlib.md5(fp.read()).hexdigest()
+            except OSError:
+                stderr.append(f"md5sum: {path}: No such file or directory\n".encode())
+                status = 1
+                continue
+            stdout.append(f"{digest}  {path}\n".encode())
+        return b"".join(stdout), b"".join(stderr), status
+
+    def _tar(self, args: List[str], stdin: bytes) -> _ShellOutput:
+        """only tar -xf - -C folder. The archive is read from stdin"""
+        if ("-x" not in args and "-xf" not in args) or "-C" not in args:
+            return b"", b"tar: only -x -C is supported\n", 1
+        folder = args[args.index("-C") + 1]
+        if not os.path.isdir(self.device.local_path(folder)):
+            return (
+                b"",
+                f"tar: chdir '{folder}': No such file or directory\n".encode(),
+                1,
+            )
+        try:
+            with tarfile.open(fileobj=io.BytesIO(stdin), mode="r:") as archive:
+                for member in archive:
+                    local_path = self.device.local_path(
+                        posixpath.join(folder, member.name)
+                    )
+                    if member.isdir():
+                        os.makedirs(local_path, exist_ok=True)
+                    elif member.isfile():
+                        source = archive.extractfile(member)
+                        if source is None:
+                            continue
+                        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+                        with source, open(local_path, "wb") as fp:
+                            shutil.copyfileobj(source, fp)
+                    else:
+                        continue
+                    os.utime(local_path, (member.mtime, member.mtime))
+        except tarfile.TarError as err:
+            return b"", f"tar: {err.__str__()}\n".encode(), 1
+        return b"", b"", 0
+
+    def _getprop(self, args: List[str], stdin: bytes) -> _ShellOutput:
+        if args:
+            return (self.device.properties.get(args[0], "") + "\n").encode(), b"", 0
+        lines = [f"[{key}]: [{value}]" for key, value in self.device.properties.items()]
+        return ("\n".join(lines) + "\n").encode(), b"", 0
+
+    def _df(self, args: List[str], stdin: bytes) -> _ShellOutput:
+        # toybox df -k. Every path is on the one sdcard
+        paths = [arg for arg in args if not arg.startswith("-")] or ["/sdcard"]
+        total = self.device.storage_total // 1024
+        free = self.device.storage_free // 1024
+        lines = ["Filesystem     1K-blocks     Used Available Use% Mounted on"]
+        for _path in paths:
+            used = total - free
+            percent = used * 100 // total if total else 0
+            lines.append(
+                f"/dev/fuse      {total:9d} {used:8d} {free:9d} {percent:3d}% /storage/emulated"
+            )
+        return ("\n".join(lines) + "\n").encode(), b"", 0
+
+    def _du(self, args: List[str], stdin: bytes) -> _ShellOutput:
+        # toybox du -k [-s] [-d depth]. Sizes are the file sizes rounded up to a KiB
+        max_depth: int | None = None
+        paths: List[str] = []
+        arg_iter = iter(args)
+        for arg in arg_iter:
+            if arg == "-d":
+                max_depth = int(next(arg_iter, "0"))
+            elif arg == "-s":
+                max_depth = 0
+            elif not arg.startswith("-"):
+                paths.append(arg)
+        stdout: List[str] = []
+        stderr: List[str] = []
+        for path in paths or ["."]:
+            local_root = self.device.local_path(path)
+            if os.path.isfile(local_root):
+                stdout.append(f"{-(-os.path.getsize(local_root) // 1024)}\t{path}")
+                continue
+            if not os.path.isdir(local_root):
+                stderr.append(f"du: {path}: No such file or directory")
+                continue
+            sizes: Dict[str, int] = {}
+            # bottom up so each folder is printed after the folders in it
+            for root, dirs, files in os.walk(local_root, topdown=False):
+                size = sum(os.path.getsize(os.path.join(root, name)) for name in files)
+                size += sum(sizes[os.path.join(root, name)] for name in dirs)
+                sizes[root] = size
+                relative = os.path.relpath(root, local_root)
+                depth = 0 if relative == os.curdir else relative.count(os.sep) + 1
+                if max_depth is not None and depth > max_depth:
+                    continue
+                remote = (
+                    path
+                    if depth == 0
+                    else posixpath.join(path, relative.replace(os.sep, "/"))
+                )
+                stdout.append(f"{-(-size // 1024)}\t{remote}")
+        output = "".join(f"{line}\n" for line in stdout).encode()
+        errors = "".join(f"{line}\n" for line in stderr).encode()
+        return output, errors, 1 if stderr else 0
+
+    def _dumpsys(self, args: List[str], stdin: bytes) -> _ShellOutput:
+        if args[:1] != ["battery"]:
+            return b"", f"Can't find service: {' '.join(args)}\n".encode(), 0
+        lines = [
+            "Current Battery Service state:",
+            "  AC powered: false",
+            "  USB powered: true",
+            f"  level: {self.device.battery_level}",
+            "  scale: 100",
+        ]
+        return ("\n".join(lines) + "\n").encode(), b"", 0
+
+    def _pm(self, args: List[str], stdin: bytes) -> _ShellOutput:
+        if args[:2] == ["list", "packages"]:
+            lines = [f"package:{package}" for package in self.device.packages]
+            if "--show-versioncode" in args:
+                lines = [
+                    f"{line} versionCode:{self.device.version_codes.get(package, 1)}"
+                    for line, package in zip(lines, self.device.packages)
+                ]
+            lines = [f"{line}\n" for line in lines]
+            return "".join(lines).encode(), b"", 0
+        if args and args[0] == "install":
+            # pm install [-r] path. adb install pushes the apk before running it
+            try:
+                with open(self.device.local_path(args[-1]), "rb") as fp:
+                    apk_data = fp.read()
+            except OSError:
+                return b"Failure [INSTALL_FAILED_INVALID_URI]\n", b"", 1
+            self.device.install_package(apk_data)
+            return b"Success\n", b"", 0
+        if args and args[0] == "uninstall":
+            package_name = args[-1]
+            if package_name not in self.device.packages:
+                return b"Failure [DELETE_FAILED_INTERNAL_ERROR]\n", b"", 1
+            self.device.packages.remove(package_name)
+            return b"Success\n", b"", 0
+        return b"", f"Unknown command: {' '.join(args)}\n".encode(), 1
+
+    def _cmd(self, args: List[str], stdin: bytes) -> _ShellOutput:
+        if args and args[0] == "package":
+            return self._pm(args[1:], stdin)
+        return b"", b"cmd: unknown service\n", 1
+
+
+class FakeAdbServer:
+    def __init__(
+        self, devices: List[FakeDevice], host: str = "127.0.0.1", port: int = 0
+    ) -> None:
+        """serves the adb smart socket protocol for the fake devices
+
+        Args:
+            devices (List[FakeDevice]): the devices to report as attached
+            host (str, optional): address to listen on. Defaults to "127.0.0.1".
+            port (int, optional): port to listen on. 0 picks a free port. Defaults to 0.
+        """
+        self.devices = devices
+        self.host = host
+        self.port = port
+        self._server: asyncio.AbstractServer | None = None
+        self._thread: threading.Thread | None = None
+        self._thread_loop: asyncio.AbstractEventLoop | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        # the event and writer of each open host:track-devices connection
+        self._trackers: Dict[asyncio.Event, asyncio.StreamWriter] = {}
+        # the handler task and writer of every open connection
+        self._connections: Dict[asyncio.Task, asyncio.StreamWriter] = {}
+        self._stopping = False
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._stopping = False
+        self._server = await asyncio.start_server(
+            self._handle_connection, self.host, self.port
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._server is None:
+            return
+        # the real server drops every connection when it is killed
+        self._stopping = True
+        for writer in self._trackers.values():
+            writer.close()
+        self._notify_trackers()
+        self._server.close()
+        await self._server.wait_closed()
+        # interactive shells stay open until the client closes them. Closing their end
+        # lets the handlers finish instead of being cancelled which 3.11 logs as an error
+        for writer in list(self._connections.values()):
+            writer.close()
+        tasks = list(self._connections)
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=1.0)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self._server = None
+
+    def start_in_thread(self) -> None:
+        """runs the server on its own event loop in a daemon thread. The sync functions in
+        adb_interface block the calling thread so the server cant share its event loop
+        """
+        started = threading.Event()
+
+        def run() -> None:
+            loop = asyncio.new_event_loop()
+            self._thread_loop = loop
+            loop.run_until_complete(self.start())
+            started.set()
+            loop.run_forever()
+            loop.run_until_complete(self.stop())
+            loop.close()
+
+        self._thread = threading.Thread(target=run, name="fake-adb-server", daemon=True)
+        self._thread.start()
+        started.wait()
+
+    def stop_thread(self) -> None:
+        """stops a server started with start_in_thread"""
+        if self._thread is None or self._thread_loop is None:
+            return
+        self._thread_loop.call_soon_threadsafe(self._thread_loop.stop)
+        self._thread.join()
+        self._thread = None
+
+    async def __aenter__(self) -> "FakeAdbServer":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.stop()
+
+    def client(self) -> adb_client.AdbClient:
+        """an AdbClient pointing at this server"""
+        return adb_client.AdbClient(self.host, self.port)
+
+    def get_device(self, serial: str) -> FakeDevice | None:
+        return next((dev for dev in self.devices if dev.serial == serial), None)
+
+    def devices_text(self, long_format: bool = False) -> str:
+        """the reply to host:devices or host:devices-l"""
+        if not long_format:
+            return "".join(f"{dev.serial}\t{dev.state}\n" for dev in self.devices)
+        lines = []
+        for transport_id, dev in enumerate(self.devices, start=1):
+            line = f"{dev.serial:<22} {dev.state} usb:{dev.usb}"
+            if dev.state == "device":
+                model = dev.model.replace(" ", "_")
+                line += f" product:hollywood model:{model} device:hollywood"
+            lines.append(f"{line} transport_id:{transport_id}\n")
+        return "".join(lines)
+
+    def devices_changed(self) -> None:
+        """call after adding, removing or changing the state of a device so any
+        track-devices connections are sent the new list. Safe to call from any thread
+        """
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._notify_trackers)
+
+    def _notify_trackers(self) -> None:
+        for event in self._trackers:
+            event.set()
+
+    async def _track_devices(self, writer: asyncio.StreamWriter) -> None:
+        """sends the device list now and again every time devices_changed is called"""
+        changed = asyncio.Event()
+        self._trackers[changed] = writer
+        try:
+            writer.write(b"OKAY")
+            while not self._stopping:
+                payload = self.devices_text(long_format=True).encode()
+                writer.write(b"%04x" % len(payload) + payload)
+                await writer.drain()
+                await changed.wait()
+                changed.clear()
+        finally:
+            del self._trackers[changed]
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        device: FakeDevice | None = None
+        task = asyncio.current_task()
+        if task is not None:
+            self._connections[task] = writer
+        try:
+            while True:
+                try:
+                    length = int(await reader.readexactly(4), 16)
+                    service = (await reader.readexactly(length)).decode()
+                except (asyncio.IncompleteReadError, ValueError):
+                    return
+                if service.startswith(("host:", "host-serial:")):
+                    device, keep_open = await self._handle_host(service, writer)
+                    if not keep_open:
+                        return
+                elif device is None:
+                    await _write_fail(writer, "no device selected")
+                    return
+                else:
+                    await self._handle_device(device, service, reader, writer)
+                    return
+        except InjectedFailure:
+            # reset rather than close like a cable being pulled
+            writer.transport.abort()
+        except ConnectionError:
+            pass
+        finally:
+            if task is not None:
+                self._connections.pop(task, None)
+            writer.close()
+
+    async def _handle_host(
+        self, service: str, writer: asyncio.StreamWriter
+    ) -> Tuple[FakeDevice | None, bool]:
+        """handles host: services
+
+        Returns:
+            Tuple[FakeDevice | None, bool]: the device switched to and whether to keep reading requests
+        """
+        if service == "host:version":
+            await _write_okay(writer, b"%04x" % FAKE_SERVER_VERSION)
+        elif service in ("host:devices", "host:devices-l"):
+            text = self.devices_text(long_format=service.endswith("-l"))
+            await _write_okay(writer, text.encode())
+        elif service == "host:track-devices-l":
+            await self._track_devices(writer)
+        elif service.startswith("host-serial:") and service.endswith(":features"):
+            # the adb executable asks for the features before every push
+            await _write_okay(writer, FAKE_DEVICE_FEATURES.encode())
+        elif service.startswith(("host:transport:", "host:tport:serial:")):
+            serial = service.rsplit(":", 1)[1]
+            device = self.get_device(serial)
+            if device is None:
+                await _write_fail(writer, f"device '{serial}' not found")
+            elif device.state != "device":
+                await _write_fail(writer, f"device {device.state}")
+            else:
+                writer.write(b"OKAY")
+                if service.startswith("host:tport:"):
+                    # tport replies with the transport id as a uint64
+                    writer.write(struct.pack("<Q", self.devices.index(device) + 1))
+                await writer.drain()
+                return device, True
+        elif service == "host:kill":
+            writer.write(b"OKAY")
+            await writer.drain()
+        else:
+            await _write_fail(writer, f"unknown host service {service}")
+        return None, False
+
+    async def _handle_device(
+        self,
+        device: FakeDevice,
+        service: str,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        """handles the service requested after host:transport"""
+        await device.link.request()
+        name, _, command = service.partition(":")
+        if name.startswith("shell,v2") and not command:
+            writer.write(b"OKAY")
+            await self._interactive_shell(device, reader, writer)
+        elif name.startswith("shell,v2"):
+            writer.write(b"OKAY")
+            stdout, stderr, status = device.run_shell(command)
+            for packet_id, data in (
+                (adb_client.SHELL_ID_STDOUT, stdout),
+                (adb_client.SHELL_ID_STDERR, stderr),
+            ):
+                if data:
+                    writer.write(struct.pack("<BI", packet_id, len(data)) + data)
+            writer.write(
+                struct.pack("<BIB", adb_client.SHELL_ID_EXIT, 1, status & 0xFF)
+            )
+        elif name == "shell":
+            writer.write(b"OKAY")
+            stdout, stderr, _ = device.run_shell(command)
+            writer.write(stdout + stderr)
+        elif name == "exec":
+            writer.write(b"OKAY")
+            writer.write(await self._handle_exec(device, command, reader))
+        elif name == "sync":
+            writer.write(b"OKAY")
+            await self._handle_sync(device, reader, writer)
+        else:
+            await _write_fail(writer, "closed")
+            return
+        await writer.drain()
+
+    async def _interactive_shell(
+        self,
+        device: FakeDevice,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        """a shell,v2 service without a command. Runs each line written to stdin in the
+        same shell until stdin is closed"""
+        shell = _FakeShell(device)
+        pending = b""
+        while True:
+            try:
+                packet_id, length = struct.unpack("<BI", await reader.readexactly(5))
+                data = await reader.readexactly(length)
+            except asyncio.IncompleteReadError:
+                return
+            if packet_id == adb_client.SHELL_ID_CLOSE_STDIN:
+                break
+            if packet_id != adb_client.SHELL_ID_STDIN:
+                continue
+            pending += data
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                await device.link.request()
+                stdout, stderr, _ = shell.run(line.decode())
+                for out_id, out in (
+                    (adb_client.SHELL_ID_STDOUT, stdout),
+                    (adb_client.SHELL_ID_STDERR, stderr),
+                ):
+                    if out:
+                        writer.write(struct.pack("<BI", out_id, len(out)) + out)
+            await writer.drain()
+        writer.write(
+            struct.pack("<BIB", adb_client.SHELL_ID_EXIT, 1, shell.status & 0xFF)
+        )
+
+    async def _handle_exec(
+        self, device: FakeDevice, command: str, reader: asyncio.StreamReader
+    ) -> bytes:
+        """exec: is a raw stream. Streamed installs send the apk bytes after the request"""
+        args = shlex.split(command)
+        if args[:3] == ["cmd", "package", "install"] and "-S" in args:
+            size = int(args[args.index("-S") + 1])
+            apk_data = await reader.readexactly(size)
+            await device.link.transfer(size)
+            device.install_package(apk_data)
+            return b"Success\n"
+        if args[:2] == ["cmd", "package"] and len(args) > 2:
+            return await self._handle_install_session(device, args[2:], reader)
+        stdin = b""
+        if args[:1] == ["tar"]:
+            stdin = await _read_tar_archive(reader)
+            await device.link.transfer(len(stdin))
+        stdout, stderr, _ = device.run_shell(command, stdin)
+        return stdout + stderr
+
+    async def _handle_install_session(
+        self, device: FakeDevice, args: List[str], reader: asyncio.StreamReader
+    ) -> bytes:
+        """install-create, install-write, install-commit and install-abandon"""
+        action = args[0]
+        if action == "install-create":
+            session_id = device.create_session()
+            return f"Success: created install session [{session_id}]\n".encode()
+        if action == "install-write":
+            # install-write -S size session_id name -
+            size = int(args[args.index("-S") + 1])
+            session_id, name = int(args[3]), args[4]
+            data = await reader.readexactly(size)
+            await device.link.transfer(size)
+            if session_id not in device.sessions:
+                return b"Failure [INSTALL_FAILED_INVALID_SESSION]\n"
+            device.sessions[session_id][name] = data
+            return f"Success: streamed {size} bytes\n".encode()
+        if action == "install-commit":
+            try:
+                device.commit_session(int(args[1]))
+            except KeyError:
+                return b"Failure [INSTALL_FAILED_INVALID_APK]\n"
+            return b"Success\n"
+        if action == "install-abandon":
+            device.sessions.pop(int(args[1]), None)
+            return b"Success\n"
+        stdout, stderr, _ = device.run_shell(shlex.join(["cmd", "package", *args]))
+        return stdout + stderr
+
+    async def _handle_sync(
+        self,
+        device: FakeDevice,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        """sync: requests are [id: 4 bytes][length: uint32 le][payload] until QUIT"""
+        while True:
+            try:
+                header = await reader.readexactly(8)
+            except asyncio.IncompleteReadError:
+                return
+            request_id, length = header[:4], struct.unpack("<I", header[4:])[0]
+            if request_id == b"QUIT":
+                return
+            payload = await reader.readexactly(length)
+            await device.link.request()
+            if request_id == b"STAT":
+                local_path = device.local_path(payload.decode())
+                try:
+                    st = os.lstat(local_path)
+                    reply = (st.st_mode, st.st_size, int(st.st_mtime))
+                except OSError:
+                    reply = (0, 0, 0)
+                writer.write(b"STAT" + struct.pack("<III", *reply))
+            elif request_id == b"LIST":
+                self._list_dir(device, payload.decode(), writer)
+            elif request_id == b"SEND":
+                remote_path, _, _mode = payload.decode().rpartition(",")
+                await self._receive_file(device, remote_path, reader, writer)
+            elif request_id == b"SND2":
+                # the path is followed by SND2 mode flags
+                _mode, flags = struct.unpack("<II", (await reader.readexactly(12))[4:])
+                try:
+                    codec = compression.codec_for_flags(flags)
+                except ValueError as err:
+                    _write_sync_fail(writer, err.__str__())
+                    return
+                decompressor = codec.new_decompressor() if codec else None
+                await self._receive_file(
+                    device, payload.decode(), reader, writer, decompressor
+                )
+            else:
+                _write_sync_fail(writer, f"unknown sync request {request_id!r}")
+                return
+            await writer.drain()
+
+    def _list_dir(
+        self, device: FakeDevice, remote_path: str, writer: asyncio.StreamWriter
+    ) -> None:
+        """a DENT for every entry including . and .. then DONE. Sizes are cut to 32 bits
+        like the real LIST"""
+        local_path = device.local_path(remote_path)
+        names = [".", ".."]
+        if os.path.isdir(local_path):
+            names += sorted(os.listdir(local_path))
+        for name in names:
+            try:
+                st = os.lstat(os.path.join(local_path, name))
+            except OSError:
+                continue
+            encoded = name.encode()
+            writer.write(
+                b"DENT"
+                + struct.pack(
+                    "<IIII",
+                    st.st_mode,
+                    st.st_size & 0xFFFFFFFF,
+                    int(st.st_mtime),
+                    len(encoded),
+                )
+                + encoded
+            )
+        writer.write(b"DONE" + bytes(16))
+
+    async def _receive_file(
+        self,
+        device: FakeDevice,
+        remote_path: str,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        decompressor: compression.Decompressor | None = None,
+    ) -> None:
+        """reads DATA packets until DONE. Missing parent folders are created like adbd does"""
+        local_path = device.local_path(remote_path)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        received = 0
+        try:
+            with open(local_path, "wb") as fp:
+                while True:
+                    header = await reader.readexactly(8)
+                    request_id, length = header[:4], struct.unpack("<I", header[4:])[0]
+                    if request_id == b"DATA":
+                        data = await reader.readexactly(length)
+                        await device.link.transfer(length)
+                        received += length
+                        device.link.check_push(received)
+                        fp.write(
+                            decompressor.decompress(data) if decompressor else data
+                        )
+                    elif request_id == b"DONE":
+                        # the length field holds the mtime
+                        mtime = length
+                        break
+                    else:
+                        _write_sync_fail(
+                            writer, f"unexpected {request_id!r} during SEND"
+                        )
+                        return
+        except (asyncio.IncompleteReadError, InjectedFailure) as err:
+            # the connection dropped part way through. adbd removes the partial file
+            os.remove(local_path)
+            if isinstance(err, InjectedFailure):
+                raise
+            return
+        try:
+            os.utime(local_path, (mtime, mtime))
+        except OSError as err:
+            # removed by another connection while it was being written
+            _write_sync_fail(writer, err.__str__())
+            return
+        writer.write(b"OKAY" + struct.pack("<I", 0))
+
+
+async def _read_tar_archive(reader: asyncio.StreamReader) -> bytes:
+    """reads a tar archive up to the empty blocks that end it. Like the real tar the
+    stream doesnt have to be closed"""
+    blocks: List[bytes] = []
+    empty = bytes(tarfile.BLOCKSIZE)
+    while True:
+        try:
+            header = await reader.readexactly(tarfile.BLOCKSIZE)
+        except asyncio.IncompleteReadError as err:
+            blocks.append(err.partial)
+            break
+        blocks.append(header)
+        if header == empty:
+            break
+        # the data of every entry is padded out to whole blocks
+        size = tarfile.TarInfo.frombuf(header, "utf-8", "surrogateescape").size
+        padded = -(-size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+        blocks.append(await reader.readexactly(padded))
+    return b"".join(blocks)
+
+
+async def _write_okay(writer: asyncio.StreamWriter, payload: bytes) -> None:
+    writer.write(b"OKAY" + b"%04x" % len(payload) + payload)
+    await writer.drain()
+
+
+async def _write_fail(writer: asyncio.StreamWriter, message: str) -> None:
+    payload = message.encode()
+    writer.write(b"FAIL" + b"%04x" % len(payload) + payload)
+    await writer.drain()
+
+
+def _write_sync_fail(writer: asyncio.StreamWriter, message: str) -> None:
+    payload = message.encode()
+    writer.write(b"FAIL" + struct.pack("<I", len(payload)) + payload)
+
+
+def make_devices(count: int, link: LinkModel | None = None) -> List[FakeDevice]:
+    """fake headsets named FAKE-1, FAKE-2 and so on. Four to a usb hub
+
+    Args:
+        count (int): the number of devices
+        link (LinkModel, optional): the link each device gets a copy of. Defaults to None.
+
+    Returns:
+        List[FakeDevice]:
+    """
+    devices: List[FakeDevice] = []
+    for index in range(count):
+        device_link = None
+        if link is not None:
+            # each device gets its own bandwidth and failures
+            seed = None if link.seed is None else link.seed + index
+            device_link = dataclasses.replace(link, seed=seed)
+        devices.append(
+            FakeDevice(
+                f"FAKE-{index + 1}",
+                usb=f"1-{index // 4 + 1}.{index % 4 + 1}",
+                link=device_link,
+            )
+        )
+    return devices
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="serves fake headsets over the adb server protocol"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5037)
+    parser.add_argument("--devices", type=int, default=1)
+    parser.add_argument(
+        "--bandwidth-mb",
+        type=float,
+        default=0.0,
+        help="MB/s to each device. 0 is unlimited",
+    )
+    parser.add_argument(
+        "--latency-ms", type=float, default=0.0, help="added to every request"
+    )
+    parser.add_argument(
+        "--failure-rate", type=float, default=0.0, help="chance a request is dropped"
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    link = LinkModel(
+        bandwidth=args.bandwidth_mb * 1024 * 1024,
+        latency=args.latency_ms / 1000,
+        failure_rate=args.failure_rate,
+        seed=args.seed,
+    )
+    devices = make_devices(args.devices, link)
+    server = FakeAdbServer(devices, args.host, args.port)
+
+    async def serve() -> None:
+        async with server:
+            print(
+                f"serving {len(devices)} fake device(s) on {server.host}:{server.port}"
+            )
+            for device in devices:
+                print(f"{device.serial} files in {device.root}")
+            await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for device in devices:
+            device.remove()
+
+
+if __name__ == "__main__":
+    main()
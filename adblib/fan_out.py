@@ -0,0 +1,518 @@
+"""
+fan_out.py
+
+pushes the same files to many devices while reading them from disk only once. Each
+chunk is read into a buffer that every device's sync stream writes from, so a multi GB
+OBB going to a dozen headsets is read once instead of a dozen times
+
+every device has a queue of FAN_OUT_QUEUE_DEPTH chunks. The reader waits for room in
+every queue before reading the next chunk, which caps the memory held at the depth
+times the chunk size however slow a device is. A device that keeps the others waiting
+is ejected and pushed on its own after the rest have finished. The files it already
+has are skipped on that pass
+
+FanOutGroup lets installs running on their own for each device meet up so the pushes
+of the same folder that start around the same time share the reads
+"""
+import asyncio
+import logging
+import os
+import stat
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+
+from adblib import adb_sync
+from adblib.adb_client import AdbClient
+from adblib.adb_sync import (
+    FileSyncedFunction,
+    ProgressReporter,
+    SyncConnection,
+    TransferProgress,
+    TransferProgressFunction,
+)
+from adblib.errors import RemoteDeviceError
+
+_Log = logging.getLogger()
+
+# bytes read from disk at a time. Sent to each device as SYNC_DATA_MAX packets
+FAN_OUT_CHUNK_SIZE = 1024 * 1024
+
+# chunks a device can fall behind before it holds up the others
+FAN_OUT_QUEUE_DEPTH = 8
+
+# seconds the others wait on a device with a full queue before it is ejected
+EJECT_TIMEOUT = 5.0
+
+# a device that has kept the others waiting for more than this share of the push is
+# ejected. Only checked once the push has been going for EJECT_MIN_ELAPSED seconds
+EJECT_STALL_SHARE = 0.25
+EJECT_MIN_ELAPSED = 10.0
+
+# seconds a FanOutGroup waits for the other devices to join a push
+DEFAULT_GATHER_WINDOW = 10.0
+
+
+# what is queued for each device
+@dataclass
+class _Start:
+    local_file: str
+    mode: int
+
+
+@dataclass
+class _Data:
+    local_file: str
+    chunk: bytes
+
+
+@dataclass
+class _Finish:
+    local_file: str
+    mtime: int
+
+
+# None ends the push
+_Item = _Start | _Data | _Finish | None
+
+
+@dataclass
+class FanOutTarget:
+    """a device to push to and its callbacks"""
+
+    serial: str
+    progress_callback: Optional[TransferProgressFunction] = None
+    on_file_synced: Optional[FileSyncedFunction] = None
+
+
+@dataclass
+class FanOutResult:
+    serial: str
+    progress: Optional[TransferProgress] = None
+    # fell behind and was pushed on its own
+    ejected: bool = False
+    error: Optional[BaseException] = None
+
+
+class _DeviceStream:
+    def __init__(
+        self,
+        target: FanOutTarget,
+        sync: SyncConnection,
+        files: Dict[str, str],
+        reporter: ProgressReporter,
+    ) -> None:
+        """the sync stream to a single device
+
+        Args:
+            target (FanOutTarget): the device
+            sync (SyncConnection): the open sync session
+            files (Dict[str, str]): remote path by local path of the files it needs
+            reporter (ProgressReporter): the devices progress
+        """
+        self.target = target
+        self.sync = sync
+        self.files = files
+        self.reporter = reporter
+        self.queue: asyncio.Queue[_Item] = asyncio.Queue(FAN_OUT_QUEUE_DEPTH)
+        self.task: asyncio.Task | None = None
+        self.active = True
+        self.ejected = False
+        # seconds the reader spent waiting on this device while others had nothing to send
+        self.stalled = 0.0
+
+    async def write(self) -> None:
+        """sends what is queued until the None that ends the push"""
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                return
+            remote_file = self.files[item.local_file]
+            if isinstance(item, _Start):
+                self.sync.start_send(remote_file, item.mode)
+            elif isinstance(item, _Data):
+                # the transport may hold slices of the chunk after drain returns so the
+                # view is left for the garbage collector instead of being released
+                view = memoryview(item.chunk)
+                for offset in range(0, len(view), adb_sync.SYNC_DATA_MAX):
+                    await self.sync.send_data(
+                        view[offset : offset + adb_sync.SYNC_DATA_MAX]
+                    )
+                self.reporter.update(len(view), item.local_file)
+            else:
+                await self.sync.finish_send(remote_file, item.mtime)
+                self.reporter.progress.files_sent += 1
+                if self.target.on_file_synced:
+                    self.target.on_file_synced(
+                        remote_file, os.path.getsize(item.local_file)
+                    )
+
+    async def close(self) -> None:
+        """stops sending and drops the connection. adbd removes a file that was part way"""
+        self.active = False
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        await self.sync.conn.close()
+
+
+class FanOutPush:
+    def __init__(
+        self,
+        client: AdbClient,
+        targets: List[FanOutTarget],
+        local_path: str,
+        remote_path: str,
+        skip_unchanged: bool = False,
+        verify_hash: bool = False,
+        eject_timeout: float = EJECT_TIMEOUT,
+    ) -> None:
+        """pushes a file or folder to every device reading it once. Same rules as
+        adb_sync.push. Call run to start it
+
+        Args:
+            client (AdbClient): the client connected to the adb server
+            targets (List[FanOutTarget]): the devices to push to
+            local_path (str): file or folder to copy
+            remote_path (str): where to copy it to on each device
+            skip_unchanged (bool, optional): leave out the files each device already has
+            with the same size and mtime. Defaults to False.
+            verify_hash (bool, optional): also compare the md5 of the files that would be
+            skipped. Defaults to False.
+            eject_timeout (float, optional): seconds a device can hold up the others. Defaults to EJECT_TIMEOUT.
+        """
+        self.client = client
+        self.targets = targets
+        self.local_path = local_path
+        self.remote_path = remote_path
+        self.skip_unchanged = skip_unchanged
+        self.verify_hash = verify_hash
+        self.eject_timeout = eject_timeout
+        self.results = {
+            target.serial: FanOutResult(target.serial) for target in targets
+        }
+        self._streams: Dict[str, _DeviceStream] = {}
+        self._dropped: Set[str] = set()
+        self._started = 0.0
+
+    async def run(self) -> Dict[str, FanOutResult]:
+        """pushes to every device. An error on one device doesnt stop the others
+
+        Raises:
+            FileNotFoundError: if the local path doesnt exist
+
+        Returns:
+            Dict[str, FanOutResult]: the outcome for each device by serial
+        """
+        if not os.path.exists(self.local_path):
+            raise FileNotFoundError(self.local_path)
+        self._started = asyncio.get_running_loop().time()
+        try:
+            await asyncio.gather(*(self._open(target) for target in self.targets))
+            for stream in self._streams.values():
+                stream.task = asyncio.create_task(stream.write())
+            await self._fan_out()
+            await self._finish()
+        finally:
+            for stream in self._streams.values():
+                if stream.active:
+                    await stream.close()
+        ejected = [stream for stream in self._streams.values() if stream.ejected]
+        await asyncio.gather(*(self._push_alone(stream) for stream in ejected))
+        return self.results
+
+    async def drop(self, serial: str) -> None:
+        """stops pushing to the device without a pass on its own. Used when the caller
+        for the device was cancelled"""
+        self._dropped.add(serial)
+        self.results[serial].error = asyncio.CancelledError()
+        stream = self._streams.get(serial)
+        if stream is not None and stream.active:
+            await stream.close()
+
+    async def _open(self, target: FanOutTarget) -> None:
+        """opens the sync session and works out what the device needs"""
+        sync: SyncConnection | None = None
+        try:
+            sync = await adb_sync.open_sync(self.client, target.serial)
+            remote_path = self.remote_path
+            if (await sync.stat(remote_path)).is_dir:
+                name = os.path.basename(os.path.normpath(self.local_path))
+                remote_path = f"{remote_path.rstrip('/')}/{name}"
+            files = adb_sync._collect_files(self.local_path, remote_path)
+            total_bytes = sum(os.path.getsize(local_file) for local_file, _ in files)
+            reporter = ProgressReporter(
+                target.progress_callback, total_bytes, len(files)
+            )
+            if self.skip_unchanged:
+                files = await adb_sync._skip_unchanged(
+                    self.client,
+                    target.serial,
+                    sync,
+                    self.local_path,
+                    remote_path,
+                    files,
+                    reporter,
+                    self.verify_hash,
+                    target.on_file_synced,
+                )
+        except (RemoteDeviceError, ConnectionError, asyncio.IncompleteReadError) as err:
+            self.results[target.serial].error = err
+            if sync is not None:
+                await sync.conn.close()
+            return
+        if target.serial in self._dropped:
+            await sync.conn.close()
+            return
+        self._streams[target.serial] = _DeviceStream(
+            target, sync, dict(files), reporter
+        )
+
+    async def _fan_out(self) -> None:
+        """reads each file once and queues it for every device that needs it"""
+        loop = asyncio.get_running_loop()
+        for local_file, _ in adb_sync._collect_files(self.local_path, ""):
+            streams = [
+                stream
+                for stream in self._streams.values()
+                if stream.active and local_file in stream.files
+            ]
+            if not streams:
+                continue
+            file_stat = os.stat(local_file)
+            mode = stat.S_IMODE(file_stat.st_mode) or adb_sync.DEFAULT_FILE_MODE
+            await self._put(streams, _Start(local_file, mode))
+            with open(local_file, "rb") as fp:
+                # a slow disk would hold up the event loop and every device with it
+                while chunk := await loop.run_in_executor(
+                    None, fp.read, FAN_OUT_CHUNK_SIZE
+                ):
+                    await self._put(streams, _Data(local_file, chunk))
+            await self._put(streams, _Finish(local_file, int(file_stat.st_mtime)))
+        await self._put(list(self._streams.values()), None)
+
+    async def _finish(self) -> None:
+        """waits for the devices to send what is queued then ends their sessions"""
+        for stream in list(self._streams.values()):
+            if not stream.active or stream.task is None:
+                continue
+            try:
+                await stream.task
+            except (RemoteDeviceError, ConnectionError, asyncio.IncompleteReadError):
+                pass
+            stream.active = False
+            result = self.results[stream.target.serial]
+            if stream.task.exception() is not None:
+                result.error = stream.task.exception()
+                await stream.sync.conn.close()
+            else:
+                result.progress = stream.reporter.complete()
+                await stream.sync.quit()
+
+    def _others_waiting(self, stream: _DeviceStream) -> bool:
+        """another device has sent everything it was given and is waiting for more"""
+        return any(
+            other.active and other is not stream and other.queue.empty()
+            for other in self._streams.values()
+        )
+
+    async def _put(self, streams: List[_DeviceStream], item: _Item) -> None:
+        """queues the item for each device. Waits while a queue is full and ejects the
+        device if the others are left waiting on it for too long"""
+        loop = asyncio.get_running_loop()
+        for stream in streams:
+            writer = stream.task
+            if not stream.active or writer is None:
+                continue
+            if writer.done():
+                # it failed. _finish picks up the error
+                continue
+            try:
+                stream.queue.put_nowait(item)
+                continue
+            except asyncio.QueueFull:
+                pass
+            holding_up = self._others_waiting(stream)
+            waited_from = loop.time()
+            queued = await self._wait_for_room(stream, writer, item)
+            while not queued and not writer.done():
+                if self._others_waiting(stream):
+                    await self._eject(stream, f"no progress for {self.eject_timeout}s")
+                    break
+                queued = await self._wait_for_room(stream, writer, item)
+            if not holding_up or not stream.active:
+                continue
+            stream.stalled += loop.time() - waited_from
+            elapsed = loop.time() - self._started
+            if (
+                elapsed >= EJECT_MIN_ELAPSED
+                and stream.stalled > elapsed * EJECT_STALL_SHARE
+            ):
+                await self._eject(
+                    stream, f"held up the others for {stream.stalled:.1f}s"
+                )
+
+    async def _wait_for_room(
+        self, stream: _DeviceStream, writer: asyncio.Task, item: _Item
+    ) -> bool:
+        """waits for room in the queue or the device to stop
+
+        Args:
+            stream (_DeviceStream): the device
+            writer (asyncio.Task): the task sending to the device
+            item (_Item): what to queue
+
+        Returns:
+            bool: True if the item was queued
+        """
+        put = asyncio.ensure_future(stream.queue.put(item))
+        try:
+            await asyncio.wait(
+                {put, writer},
+                timeout=self.eject_timeout,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+        finally:
+            if not put.done():
+                put.cancel()
+        return put.done() and not put.cancelled()
+
+    async def _eject(self, stream: _DeviceStream, reason: str) -> None:
+        _Log.info(
+            f"{stream.target.serial} fell behind the other devices ({reason}). "
+            "It will be pushed on its own"
+        )
+        stream.ejected = True
+        self.results[stream.target.serial].ejected = True
+        await stream.close()
+
+    async def _push_alone(self, stream: _DeviceStream) -> None:
+        """the pass for an ejected device. The files it already got are skipped"""
+        serial = stream.target.serial
+        if serial in self._dropped:
+            return
+        try:
+            self.results[serial].progress = await adb_sync.push(
+                self.client,
+                serial,
+                self.local_path,
+                self.remote_path,
+                stream.target.progress_callback,
+                skip_unchanged=True,
+                verify_hash=self.verify_hash,
+                on_file_synced=stream.target.on_file_synced,
+            )
+        except (RemoteDeviceError, ConnectionError, asyncio.IncompleteReadError) as err:
+            self.results[serial].error = err
+
+
+@dataclass
+class _Batch:
+    targets: List[FanOutTarget] = field(default_factory=list)
+    full: asyncio.Event = field(default_factory=asyncio.Event)
+    push: FanOutPush | None = None
+    task: asyncio.Task[Dict[str, FanOutResult]] | None = None
+
+
+class FanOutGroup:
+    def __init__(
+        self, expected: int, gather_window: float = DEFAULT_GATHER_WINDOW
+    ) -> None:
+        """joins up pushes of the same path to different devices. The first push waits
+        for the others to join for up to the gather window and then they all run as one
+        FanOutPush. Pushes that come along after it has started make a new one
+
+        Args:
+            expected (int): the devices that are going to push. The push starts as soon as
+            this many have joined
+            gather_window (float, optional): seconds to wait for the others. Defaults to DEFAULT_GATHER_WINDOW.
+        """
+        self.expected = max(1, expected)
+        self.gather_window = gather_window
+        self._batches: Dict[Tuple[str, str, bool, bool], _Batch] = {}
+
+    def set_expected(self, expected: int) -> None:
+        """changes how many devices are going to push. Pushes waiting on devices that
+        are no longer coming start straight away"""
+        self.expected = max(1, expected)
+        for batch in self._batches.values():
+            if len(batch.targets) >= self.expected:
+                batch.full.set()
+
+    async def push(
+        self,
+        client: AdbClient,
+        serial: str,
+        local_path: str,
+        remote_path: str,
+        progress_callback: Optional[TransferProgressFunction] = None,
+        skip_unchanged: bool = False,
+        verify_hash: bool = False,
+        on_file_synced: Optional[FileSyncedFunction] = None,
+    ) -> TransferProgress:
+        """pushes the path to the device along with any other devices pushing it. Same
+        arguments as adb_sync.push
+
+        Raises:
+            FileNotFoundError: if the local path doesnt exist
+            RemoteDeviceError: if the device refused a file
+            ConnectionError: if the device or adb server went away
+
+        Returns:
+            TransferProgress: the totals for the device
+        """
+        key = (os.path.normpath(local_path), remote_path, skip_unchanged, verify_hash)
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = _Batch()
+            self._batches[key] = batch
+            batch.task = asyncio.create_task(
+                self._run(key, batch, client, local_path, remote_path)
+            )
+        task = batch.task
+        # set as soon as the batch is made
+        assert task is not None
+        target = FanOutTarget(serial, progress_callback, on_file_synced)
+        batch.targets.append(target)
+        if len(batch.targets) >= self.expected:
+            batch.full.set()
+        try:
+            results = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if batch.push is not None:
+                await asyncio.shield(batch.push.drop(serial))
+            elif target in batch.targets:
+                batch.targets.remove(target)
+            raise
+        result = results[serial]
+        if result.error is not None:
+            raise result.error
+        if result.progress is None:
+            # every device ends with one or the other
+            raise RuntimeError(f"fan out push to {serial} finished without a result")
+        return result.progress
+
+    async def _run(
+        self,
+        key: Tuple[str, str, bool, bool],
+        batch: _Batch,
+        client: AdbClient,
+        local_path: str,
+        remote_path: str,
+    ) -> Dict[str, FanOutResult]:
+        try:
+            await asyncio.wait_for(batch.full.wait(), self.gather_window)
+        except asyncio.TimeoutError:
+            pass
+        # later pushes of the same path start a new batch
+        if self._batches.get(key) is batch:
+            del self._batches[key]
+        _, _, skip_unchanged, verify_hash = key
+        batch.push = FanOutPush(
+            client,
+            list(batch.targets),
+            local_path,
+            remote_path,
+            skip_unchanged=skip_unchanged,
+            verify_hash=verify_hash,
+        )
+        return await batch.push.run()
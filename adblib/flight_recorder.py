@@ -0,0 +1,357 @@
+"""
+flight_recorder.py
+
+records every command adb_interface sends to a device or the adb server into a trace
+and plays a trace back in place of the device. A replay serves the recorded output of
+each command after the time it originally took so an install can be profiled and
+benchmarked the same way every time on a machine without a headset
+
+the trace is json lines. The first line is a header and every line after is one command
+
+{"version":1,"started":1700000000.0}
+{"kind":"shell","serial":"1WMHH...","command":"getprop ro.product.model","start":0.01,
+ "duration":0.02,"returncode":0,"stdout_bytes":7,"stderr_bytes":0,"stdout":"UXVlc3QgMgo=",...}
+
+the output is base64 encoded. Commands that have been recorded more than once are
+replayed in the order they were recorded and the last one is repeated when they run out
+so a device list that is polled keeps getting an answer
+"""
+import asyncio
+import base64
+import collections
+import json
+import logging
+import re
+import subprocess
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import (
+    AsyncGenerator,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    List,
+    Tuple,
+)
+
+from adblib.errors import AdbServerUnavailableError, RemoteDeviceError
+
+_Log = logging.getLogger()
+
+TRACE_VERSION = 1
+
+# kinds of command
+KIND_SUBPROCESS = "subprocess"
+KIND_SUBPROCESS_LINES = "subprocess_lines"
+KIND_SHELL = "shell"
+KIND_SHELL_LINES = "shell_lines"
+KIND_HOST = "host"
+KIND_PUSH = "push"
+KIND_INSTALL = "install"
+
+# the shell batch sentinel is new every run. It is matched whatever its value and the
+# recorded one in the output is swapped for the one the replay is looking for
+VOLATILE_TOKEN = re.compile(r"__QC_[0-9a-f]{32}__")
+
+Command = List[str] | str
+
+
+@dataclass
+class TraceEvent:
+    kind: str
+    serial: str
+    command: Command
+    # seconds from the start of the recording
+    start: float
+    duration: float
+    returncode: int
+    stdout_bytes: int
+    stderr_bytes: int
+    # base64. Empty if the output wasnt captured
+    stdout: str = ""
+    stderr: str = ""
+    # the name of the exception the command raised instead of returning
+    error: str = ""
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), separators=(",", ":"))
+
+    @staticmethod
+    def from_json(line: str) -> "TraceEvent":
+        return TraceEvent(**json.loads(line))
+
+
+def _command_text(command: Command) -> str:
+    return command if isinstance(command, str) else " ".join(command)
+
+
+def _key(kind: str, serial: str, command: Command) -> str:
+    text = VOLATILE_TOKEN.sub("__QC__", _command_text(command))
+    return f"{kind}\0{serial}\0{text}"
+
+
+class FlightRecorder:
+    def __init__(self, path: str, capture_output: bool = True) -> None:
+        """writes a trace of the commands passed to record. Each command is written as
+        soon as it finishes so a crash keeps everything before it. Safe to use from any
+        thread
+
+        Args:
+            path (str): the trace file. Replaced if it exists
+            capture_output (bool, optional): keep the output so the trace can be replayed.
+            Without it only the sizes are kept. Defaults to True.
+        """
+        self.path = path
+        self.capture_output = capture_output
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+        self._fp = open(path, "w", encoding="utf-8")
+        header = {"version": TRACE_VERSION, "started": time.time()}
+        self._fp.write(json.dumps(header, separators=(",", ":")) + "\n")
+        self._fp.flush()
+
+    def _write(
+        self,
+        kind: str,
+        serial: str,
+        command: Command,
+        start: float,
+        result: subprocess.CompletedProcess,
+        error: str = "",
+    ) -> None:
+        stdout = result.stdout or b""
+        stderr = result.stderr or b""
+        event = TraceEvent(
+            kind=kind,
+            serial=serial,
+            command=command,
+            start=round(start - self._started, 6),
+            duration=round(time.monotonic() - start, 6),
+            returncode=result.returncode,
+            stdout_bytes=len(stdout),
+            stderr_bytes=len(stderr),
+        )
+        if self.capture_output:
+            event.stdout = base64.b64encode(stdout).decode("ascii")
+            event.stderr = base64.b64encode(stderr).decode("ascii")
+        event.error = error
+        with self._lock:
+            if self._fp.closed:
+                return
+            self._fp.write(event.to_json() + "\n")
+            self._fp.flush()
+
+    def _write_error(
+        self, kind: str, serial: str, command: Command, start: float, err: Exception
+    ) -> None:
+        if isinstance(err, RemoteDeviceError):
+            result = subprocess.CompletedProcess(
+                command, err.code, err.message.encode(), b""
+            )
+        else:
+            result = subprocess.CompletedProcess(
+                command, -1, b"", err.__str__().encode()
+            )
+        self._write(kind, serial, command, start, result, type(err).__name__)
+
+    async def record(
+        self,
+        kind: str,
+        serial: str,
+        command: Command,
+        func: Callable[[], Awaitable[subprocess.CompletedProcess]],
+    ) -> subprocess.CompletedProcess:
+        """runs func and records the result or the error it raised
+
+        Args:
+            kind (str): one of the KIND_ constants
+            serial (str): the device the command was sent to. Empty for the adb server
+            command (Command): the command as it should be matched on replay
+            func (Callable[[], Awaitable[subprocess.CompletedProcess]]): runs the command
+
+        Returns:
+            subprocess.CompletedProcess: what func returned
+        """
+        start = time.monotonic()
+        try:
+            result = await func()
+        except AdbServerUnavailableError:
+            # the caller falls back to another way of running it which gets recorded
+            raise
+        except Exception as err:
+            self._write_error(kind, serial, command, start, err)
+            raise
+        self._write(kind, serial, command, start, result)
+        return result
+
+    async def record_lines(
+        self,
+        kind: str,
+        serial: str,
+        command: Command,
+        lines: AsyncIterator[bytes],
+    ) -> AsyncGenerator[bytes, None]:
+        """passes the lines through and records them all as the output once they end
+
+        Args:
+            kind (str): one of the KIND_ constants
+            serial (str): the device the command was sent to
+            command (Command): the command as it should be matched on replay
+            lines (AsyncIterator[bytes]): the lines from the command
+
+        Yields:
+            bytes: each line
+        """
+        start = time.monotonic()
+        output: List[bytes] = []
+        try:
+            async for line in lines:
+                output.append(line)
+                yield line
+        except AdbServerUnavailableError:
+            raise
+        except Exception as err:
+            self._write_error(kind, serial, command, start, err)
+            raise
+        self._write(
+            kind,
+            serial,
+            command,
+            start,
+            subprocess.CompletedProcess(command, 0, b"".join(output), b""),
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            self._fp.close()
+
+
+class TraceMissError(LookupError):
+    """raised on replay when the trace has no recording of a command"""
+
+    def __init__(self, kind: str, serial: str, command: Command, *args: object) -> None:
+        super().__init__(*args)
+        self.kind = kind
+        self.serial = serial
+        self.command = command
+
+    def __str__(self) -> str:
+        return f"{self.kind} {_command_text(self.command)} on {self.serial or 'host'} isnt in the trace"
+
+
+def load_trace(path: str) -> List[TraceEvent]:
+    """reads the commands from a trace
+
+    Args:
+        path (str): the trace file
+
+    Raises:
+        OSError: if the file couldnt be read
+        ValueError: if it isnt a trace or is from another version
+
+    Returns:
+        List[TraceEvent]: in the order they finished
+    """
+    with open(path, "r", encoding="utf-8") as fp:
+        header = json.loads(fp.readline() or "{}")
+        if header.get("version") != TRACE_VERSION:
+            raise ValueError(f"{path} isnt a version {TRACE_VERSION} adb trace")
+        events: List[TraceEvent] = []
+        for line in fp:
+            if not line.strip():
+                continue
+            try:
+                events.append(TraceEvent.from_json(line))
+            except (ValueError, TypeError):
+                # the last line of a trace that was still being written
+                _Log.warning(f"skipping a broken line in {path}")
+    return events
+
+
+def summarize(events: List[TraceEvent]) -> Dict[str, Tuple[int, float]]:
+    """the number of commands of each kind and the seconds they took
+
+    Args:
+        events (List[TraceEvent]): from load_trace
+
+    Returns:
+        Dict[str, Tuple[int, float]]: kind -> (commands, seconds)
+    """
+    totals: Dict[str, Tuple[int, float]] = {}
+    for event in events:
+        count, seconds = totals.get(event.kind, (0, 0.0))
+        totals[event.kind] = (count + 1, seconds + event.duration)
+    return totals
+
+
+class Replayer:
+    def __init__(self, events: List[TraceEvent], speed: float = 1.0) -> None:
+        """serves recorded commands in place of a device. Safe to use from any thread
+
+        Args:
+            events (List[TraceEvent]): from load_trace
+            speed (float, optional): how much faster than recorded to replay. 0 doesnt
+            wait at all. Defaults to 1.0.
+        """
+        self.speed = speed
+        self._events: Dict[str, Deque[TraceEvent]] = collections.defaultdict(
+            collections.deque
+        )
+        for event in events:
+            self._events[_key(event.kind, event.serial, event.command)].append(event)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def load(path: str, speed: float = 1.0) -> "Replayer":
+        """same as Replayer(load_trace(path), speed)"""
+        return Replayer(load_trace(path), speed)
+
+    def _next(self, key: str) -> TraceEvent | None:
+        with self._lock:
+            queue = self._events.get(key)
+            if not queue:
+                return None
+            # the last recording is kept for a command that is repeated
+            return queue.popleft() if len(queue) > 1 else queue[0]
+
+    async def replay(
+        self, kind: str, serial: str, command: Command
+    ) -> subprocess.CompletedProcess:
+        """waits as long as the command took and returns what it returned or raises what
+        it raised
+
+        Args:
+            kind (str): one of the KIND_ constants
+            serial (str): the device the command is for
+            command (Command): the command
+
+        Raises:
+            TraceMissError: if the command wasnt recorded
+            RemoteDeviceError: if the command raised one when it was recorded
+            ConnectionError: if the command raised any other error when it was recorded
+
+        Returns:
+            subprocess.CompletedProcess:
+        """
+        event = self._next(_key(kind, serial, command))
+        if event is None:
+            raise TraceMissError(kind, serial, command)
+        if self.speed > 0:
+            await asyncio.sleep(event.duration / self.speed)
+        stdout = base64.b64decode(event.stdout)
+        stderr = base64.b64decode(event.stderr)
+        recorded = VOLATILE_TOKEN.search(_command_text(event.command))
+        current = VOLATILE_TOKEN.search(_command_text(command))
+        if recorded is not None and current is not None:
+            old, new = recorded.group().encode(), current.group().encode()
+            stdout = stdout.replace(old, new)
+            stderr = stderr.replace(old, new)
+        result = subprocess.CompletedProcess(command, event.returncode, stdout, stderr)
+        if event.error == RemoteDeviceError.__name__:
+            raise RemoteDeviceError(result)
+        if event.error:
+            raise ConnectionError(f"{event.error}: {stderr.decode(errors='replace')}")
+        return result
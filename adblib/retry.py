@@ -0,0 +1,252 @@
+"""
+retry.py
+
+decides which device errors are worth trying again and retries the operations that can
+safely be run twice. A RemoteDeviceError only carries the text adb or the device printed
+so the message is matched against the errors adb gives while a device is replugged,
+renegotiating USB or waiting for its authorisation prompt
+
+each retry waits an exponentially growing delay with jitter added so a hub full of
+headsets that dropped together dont all come back at the same moment. Every operation
+that needed a retry is recorded with the time it lost
+"""
+import asyncio
+import collections
+import logging
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Deque, Dict, List, Tuple, TypeVar
+
+from adblib.errors import RemoteDeviceError
+
+_T = TypeVar("_T")
+
+_Log = logging.getLogger()
+
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+UNKNOWN = "unknown"
+
+# lower case text from adb and the device that clears up by itself. Checked after the
+# permanent messages
+TRANSIENT_MESSAGES = (
+    "device offline",
+    "device unauthorized",
+    "device still authorizing",
+    "protocol fault",
+    "no devices/emulators found",
+    "connection reset",
+    "broken pipe",
+    "connection closed",
+)
+
+# lower case text that will be the same however many times the command is run
+PERMANENT_MESSAGES = (
+    "no such file or directory",
+    "permission denied",
+    "read-only file system",
+    "no space left on device",
+    "install_failed",
+    "install_parse_failed",
+    "delete_failed",
+    "unknown package",
+    "inaccessible or not found",
+)
+
+# the most recent retried operations kept for the log
+MAX_RECORDS = 100
+
+
+def classify(err: BaseException) -> str:
+    """sorts an error into TRANSIENT, PERMANENT or UNKNOWN
+
+    Args:
+        err (BaseException): the error an adb operation raised
+
+    Returns:
+        str: TRANSIENT if running the operation again later can succeed. PERMANENT if it
+        cant. UNKNOWN if neither the error nor the one it was raised from say
+    """
+    if isinstance(err, RemoteDeviceError):
+        message = err.message.lower()
+        if any(text in message for text in PERMANENT_MESSAGES):
+            return PERMANENT
+        if any(text in message for text in TRANSIENT_MESSAGES):
+            return TRANSIENT
+        # adb names the serial it couldnt find ie. device 'QUEST-1' not found
+        if message.startswith("device '") and "not found" in message:
+            return TRANSIENT
+    elif isinstance(err, (ConnectionResetError, asyncio.IncompleteReadError)):
+        return TRANSIENT
+    # the error that was wrapped ie. the dropped connection of a lost pooled shell
+    if err.__cause__ is not None:
+        return classify(err.__cause__)
+    return UNKNOWN
+
+
+def is_transient(err: BaseException) -> bool:
+    return classify(err) == TRANSIENT
+
+
+@dataclass
+class RetryPolicy:
+    # tries in total including the first one
+    attempts: int = 4
+    # seconds before the first retry. Doubles with each retry after
+    base_delay: float = 0.5
+    max_delay: float = 8.0
+    # seconds to wait for the device to come back before giving up
+    device_timeout: float = 30.0
+
+    def delay(self, retry: int) -> float:
+        """seconds to wait before a retry. Half the backoff is fixed and half is random
+
+        Args:
+            retry (int): 0 for the first retry
+        """
+        backoff = min(self.max_delay, self.base_delay * 2**retry)
+        return backoff / 2 + random.uniform(0, backoff / 2)
+
+
+@dataclass
+class RetryRecord:
+    operation: str
+    device_name: str
+    retries: int
+    # seconds from the first failure to the end of the last attempt
+    lost: float
+    succeeded: bool
+    error: str
+
+
+class RetryStats:
+    def __init__(self, max_records: int = MAX_RECORDS) -> None:
+        """counts the retries of each operation and the time they cost. Safe to use from
+        any thread
+
+        Args:
+            max_records (int, optional): recent retried operations kept. Defaults to MAX_RECORDS.
+        """
+        self._records: Deque[RetryRecord] = collections.deque(maxlen=max_records)
+        # operation -> retries, seconds lost
+        self._totals: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, record: RetryRecord) -> None:
+        with self._lock:
+            self._records.append(record)
+            totals = self._totals.setdefault(record.operation, [0, 0.0])
+            totals[0] += record.retries
+            totals[1] += record.lost
+
+    def records(self) -> List[RetryRecord]:
+        """the most recent retried operations oldest first"""
+        with self._lock:
+            return list(self._records)
+
+    def totals(self) -> Dict[str, Tuple[int, float]]:
+        """the retries and seconds lost for each operation since the app started
+
+        Returns:
+            Dict[str, Tuple[int, float]]: operation -> (retries, seconds lost)
+        """
+        with self._lock:
+            return {
+                operation: (int(retries), lost)
+                for operation, (retries, lost) in self._totals.items()
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._records.clear()
+            self._totals.clear()
+
+
+# shared by every retried adb operation
+retry_stats = RetryStats()
+
+DeviceWaitFunction = Callable[[str, float], Awaitable[None]]
+
+
+async def call(
+    operation: str,
+    device_name: str,
+    func: Callable[[], Awaitable[_T]],
+    policy: RetryPolicy,
+    wait_for_device: DeviceWaitFunction | None = None,
+    stats: RetryStats = retry_stats,
+) -> _T:
+    """runs func again after a transient error. Only pass operations that leave the
+    device the same however many times they run
+
+    Args:
+        operation (str): name the retries are recorded under ie. make_dir
+        device_name (str): the device the operation talks to
+        func (Callable[[], Awaitable[_T]]): starts a new attempt each time it is called
+        policy (RetryPolicy): how many times and how long to wait
+        wait_for_device (DeviceWaitFunction, optional): awaited with the device name and
+        policy.device_timeout before each retry. Should raise asyncio.TimeoutError if the
+        device didnt come back. Defaults to None.
+        stats (RetryStats, optional): where the retries are recorded. Defaults to retry_stats.
+
+    Raises:
+        Exception: the error from the last attempt or a permanent error straight away
+
+    Returns:
+        _T: what func returned
+    """
+    retries = 0
+    first_failure = 0.0
+    while True:
+        try:
+            result = await func()
+        except Exception as err:
+            if retries == 0:
+                first_failure = time.monotonic()
+            if not is_transient(err) or retries + 1 >= policy.attempts:
+                if retries:
+                    _record(stats, operation, device_name, retries, first_failure, err)
+                raise
+            delay = policy.delay(retries)
+            retries += 1
+            _Log.warning(
+                f"{operation} on {device_name} failed. Retry {retries} in {delay:.1f}s. "
+                f"{err.__str__()}"
+            )
+            await asyncio.sleep(delay)
+            if wait_for_device is not None:
+                try:
+                    await wait_for_device(device_name, policy.device_timeout)
+                except asyncio.TimeoutError:
+                    _record(stats, operation, device_name, retries, first_failure, err)
+                    raise err
+        else:
+            if retries:
+                _record(stats, operation, device_name, retries, first_failure, None)
+            return result
+
+
+def _record(
+    stats: RetryStats,
+    operation: str,
+    device_name: str,
+    retries: int,
+    first_failure: float,
+    err: BaseException | None,
+) -> None:
+    record = RetryRecord(
+        operation=operation,
+        device_name=device_name,
+        retries=retries,
+        lost=time.monotonic() - first_failure,
+        succeeded=err is None,
+        error="" if err is None else err.__str__(),
+    )
+    stats.record(record)
+    outcome = "succeeded" if record.succeeded else "gave up"
+    _Log.info(
+        f"{operation} on {device_name} {outcome} after {retries} retries. "
+        f"{record.lost:.1f}s lost"
+    )
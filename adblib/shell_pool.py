@@ -0,0 +1,249 @@
+"""
+shell_pool.py
+
+keeps interactive shells open on each device and runs commands over them so each
+query doesnt pay for a new connection and a new shell on the device
+
+commands are written to the shell's stdin followed by a printf of a marker that
+is unique to the command. The output is read until the marker turns up on both
+stdout and stderr. Only one command runs at a time on a session
+
+commands run this way must not read from stdin, it is the stream the next
+command is written to
+"""
+import asyncio
+import logging
+import re
+import struct
+import subprocess
+import time
+import uuid
+from typing import Callable, Dict, List, Tuple
+
+from adblib import adb_client
+from adblib.adb_client import AdbClient, AdbConnection
+
+_Log = logging.getLogger()
+
+# a session idle for longer than this is checked before a command is sent to it
+HEALTH_CHECK_INTERVAL = 5.0
+
+# seconds the health check has to finish
+HEALTH_CHECK_TIMEOUT = 2.0
+
+# sessions opened per device before commands start waiting for a free one
+DEFAULT_MAX_SESSIONS = 2
+
+
+class ShellSession:
+    def __init__(self, serial: str, conn: AdbConnection) -> None:
+        """an interactive v2 shell on a device. Use ShellSession.open to create one
+
+        Args:
+            serial (str): the device the shell is running on
+            conn (AdbConnection): the connection with the shell,v2 service open
+        """
+        self.serial = serial
+        self.conn = conn
+        self.last_used = time.monotonic()
+        self.closed = False
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    async def open(client: AdbClient, serial: str) -> "ShellSession":
+        """starts an interactive shell on the device
+
+        Raises:
+            AdbServerUnavailableError: if the adb server isnt running
+            RemoteDeviceError: if the device cant be found or doesnt support shell v2
+
+        Returns:
+            ShellSession:
+        """
+        conn = await client.open_service(serial, "shell,v2,raw:")
+        return ShellSession(serial, conn)
+
+    def _write_stdin(self, data: bytes) -> None:
+        header = struct.pack("<BI", adb_client.SHELL_ID_STDIN, len(data))
+        self.conn.write(header + data)
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    async def run(
+        self, command: str, timeout: float | None = None
+    ) -> subprocess.CompletedProcess:
+        """runs the command line in the shell and waits for it to finish
+
+        Args:
+            command (str): the command line to run
+            timeout (float, optional): seconds to wait. Defaults to None which waits until it finishes.
+
+        Raises:
+            ConnectionError: if the shell closed or didnt finish in time. The session is closed
+
+        Returns:
+            subprocess.CompletedProcess: stdout, stderr and exit code of the command
+        """
+        async with self._lock:
+            if self.closed:
+                raise ConnectionResetError(f"shell session to {self.serial} is closed")
+            marker = f"__QC_POOL_{uuid.uuid4().hex}__"
+            script = (
+                f"{command}\n"
+                f"printf '\\n{marker}:%d\\n' $?\n"
+                f"printf '\\n{marker}\\n' >&2\n"
+            )
+            try:
+                self._write_stdin(script.encode())
+                await self.conn.drain()
+                stdout, stderr, returncode = await asyncio.wait_for(
+                    self._read_until(marker.encode()), timeout
+                )
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, OSError) as err:
+                # the output can no longer be matched to the right command
+                await self.close()
+                raise ConnectionResetError(
+                    f"shell session to {self.serial} was lost. {err.__str__()}"
+                ) from err
+            except asyncio.CancelledError:
+                await self.close()
+                raise
+            self.last_used = time.monotonic()
+            return subprocess.CompletedProcess(
+                args=[command], returncode=returncode, stdout=stdout, stderr=stderr
+            )
+
+    async def _read_until(self, marker: bytes) -> Tuple[bytes, bytes, int]:
+        """reads the shell packets until both markers have been seen"""
+        stdout_marker = re.compile(b"\n" + re.escape(marker) + rb":(-?\d+)\n")
+        stderr_marker = b"\n" + marker + b"\n"
+        stdout = bytearray()
+        stderr = bytearray()
+        returncode: int | None = None
+        stderr_done = False
+        while returncode is None or not stderr_done:
+            header = await self.conn.read_exactly(5)
+            packet_id, length = struct.unpack("<BI", header)
+            data = await self.conn.read_exactly(length) if length else b""
+            if packet_id == adb_client.SHELL_ID_STDOUT and returncode is None:
+                # only search the new data and enough before it to catch a split marker
+                search_from = max(0, len(stdout) - len(marker) - 16)
+                stdout += data
+                match = stdout_marker.search(stdout, search_from)
+                if match:
+                    returncode = int(match.group(1))
+                    del stdout[match.start() :]
+            elif packet_id == adb_client.SHELL_ID_STDERR and not stderr_done:
+                search_from = max(0, len(stderr) - len(stderr_marker))
+                stderr += data
+                index = stderr.find(stderr_marker, search_from)
+                if index != -1:
+                    stderr_done = True
+                    del stderr[index:]
+            elif packet_id == adb_client.SHELL_ID_EXIT:
+                raise asyncio.IncompleteReadError(b"", None)
+        return bytes(stdout), bytes(stderr), returncode
+
+    async def ping(self, timeout: float = HEALTH_CHECK_TIMEOUT) -> bool:
+        """checks the shell is still responding
+
+        Returns:
+            bool: False if the session had to be closed
+        """
+        try:
+            result = await self.run("true", timeout=timeout)
+        except ConnectionError:
+            return False
+        return result.returncode == 0
+
+    async def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        await self.conn.close()
+
+
+class ShellPool:
+    def __init__(
+        self,
+        client_factory: Callable[[], AdbClient],
+        max_sessions: int = DEFAULT_MAX_SESSIONS,
+        health_check_interval: float = HEALTH_CHECK_INTERVAL,
+    ) -> None:
+        """keeps ShellSessions open for each device. Sessions are bound to the event loop
+        they were created on so there should be one pool per loop
+
+        Args:
+            client_factory (Callable[[], AdbClient]): returns the client to open sessions with
+            max_sessions (int, optional): sessions per device. Defaults to DEFAULT_MAX_SESSIONS.
+            health_check_interval (float, optional): idle seconds before a session is checked. Defaults to HEALTH_CHECK_INTERVAL.
+        """
+        self.client_factory = client_factory
+        self.max_sessions = max(1, max_sessions)
+        self.health_check_interval = health_check_interval
+        # keyed by the adb server address as well so a restarted server gets new sessions
+        self._sessions: Dict[Tuple[str, int, str], List[ShellSession]] = {}
+        self._opening: Dict[Tuple[str, int, str], asyncio.Lock] = {}
+
+    async def session(self, serial: str) -> ShellSession:
+        """gets an idle session for the device. A new one is opened if they are all busy
+        and there is room for another. Otherwise the least recently used one is returned
+        and the command waits its turn on it
+
+        Raises:
+            AdbServerUnavailableError: if the adb server isnt running
+            RemoteDeviceError: if the device cant be found
+
+        Returns:
+            ShellSession:
+        """
+        client = self.client_factory()
+        key = (client.host, client.port, serial)
+        lock = self._opening.setdefault(key, asyncio.Lock())
+        async with lock:
+            sessions = self._sessions.setdefault(key, [])
+            for session in list(sessions):
+                if session.busy or session.closed:
+                    continue
+                idle = time.monotonic() - session.last_used
+                if idle < self.health_check_interval or await session.ping():
+                    return session
+                _Log.info(f"shell session to {serial} stopped responding")
+            sessions[:] = [session for session in sessions if not session.closed]
+            if len(sessions) < self.max_sessions:
+                session = await ShellSession.open(client, serial)
+                sessions.append(session)
+                return session
+            return min(sessions, key=lambda session: session.last_used)
+
+    async def run(
+        self, serial: str, command: str, timeout: float | None = None
+    ) -> subprocess.CompletedProcess:
+        """runs the command line on the devices pooled session
+
+        Args:
+            serial (str): the device to run the command on
+            command (str): the command line. Must not read from stdin
+            timeout (float, optional): seconds to wait. Defaults to None which waits until it finishes.
+
+        Raises:
+            AdbServerUnavailableError: if the adb server isnt running
+            RemoteDeviceError: if the device cant be found
+            ConnectionError: if the session was lost while the command was running. The
+            command may or may not have run so it is not retried
+
+        Returns:
+            subprocess.CompletedProcess:
+        """
+        session = await self.session(serial)
+        return await session.run(command, timeout)
+
+    async def close(self, serial: str | None = None) -> None:
+        """closes the sessions to the device or every session if serial is None"""
+        for key, sessions in list(self._sessions.items()):
+            if serial is None or key[2] == serial:
+                del self._sessions[key]
+                for session in sessions:
+                    await session.close()
@@ -0,0 +1,201 @@
+"""
+subprocess_runner.py
+
+runs a command on the host and reads stdout and stderr at the same time. Reading one
+pipe to the end before the other lets the unread pipe fill up and the command stalls
+writing to it. Only the last part of each stream is kept in a ring buffer so a command
+that never stops talking ie. logcat cant use up all the memory
+
+lines can be handed to a consumer as they arrive. Reading stops while the consumer is
+busy so a slow consumer slows the command down through its full pipe instead of the
+lines piling up in memory
+"""
+import asyncio
+import logging
+import subprocess
+from typing import Any, AsyncGenerator, Awaitable, Callable, List
+
+from adblib.errors import RemoteDeviceError, SubprocessTimeoutError
+
+_Log = logging.getLogger()
+
+# bytes of stdout and of stderr kept. Big enough for any listing parsed in one go
+DEFAULT_BUFFER_SIZE = 8 * 1024 * 1024
+
+# bytes read from a pipe at a time
+READ_CHUNK_SIZE = 64 * 1024
+
+# a line longer than this is handed over in pieces
+MAX_LINE_LENGTH = 1024 * 1024
+
+# lines waiting for the consumer of iter_lines
+LINE_QUEUE_SIZE = 256
+
+LineConsumer = Callable[[bytes], Awaitable[None]]
+
+
+class RingBuffer:
+    def __init__(self, size: int = DEFAULT_BUFFER_SIZE) -> None:
+        """keeps the last size bytes written to it
+
+        Args:
+            size (int, optional): the most bytes kept. Defaults to DEFAULT_BUFFER_SIZE.
+        """
+        self.size = size
+        self.dropped = 0
+        self._data = bytearray()
+
+    def write(self, data: bytes) -> None:
+        self._data += data
+        overflow = len(self._data) - self.size
+        if overflow > 0:
+            del self._data[:overflow]
+            self.dropped += overflow
+
+    def getvalue(self) -> bytes:
+        return bytes(self._data)
+
+
+async def _pump(
+    stream: asyncio.StreamReader,
+    buffer: RingBuffer,
+    on_line: LineConsumer | None,
+) -> None:
+    """reads the stream to the end into the buffer and passes each line to on_line"""
+    partial = bytearray()
+    while chunk := await stream.read(READ_CHUNK_SIZE):
+        buffer.write(chunk)
+        if on_line is None:
+            continue
+        partial += chunk
+        start = 0
+        while (end := partial.find(b"\n", start)) != -1:
+            await on_line(bytes(partial[start : end + 1]))
+            start = end + 1
+        del partial[:start]
+        while len(partial) >= MAX_LINE_LENGTH:
+            await on_line(bytes(partial[:MAX_LINE_LENGTH]))
+            del partial[:MAX_LINE_LENGTH]
+    if partial and on_line is not None:
+        # the last line didnt end in a newline
+        await on_line(bytes(partial))
+
+
+async def run(
+    commands: List[str],
+    on_stdout_line: LineConsumer | None = None,
+    on_stderr_line: LineConsumer | None = None,
+    timeout: float | None = None,
+    buffer_size: int = DEFAULT_BUFFER_SIZE,
+    **kwargs: Any,
+) -> subprocess.CompletedProcess:
+    """runs the command to the end without checking the return code. If it is cancelled
+    or times out the process is killed
+
+    Args:
+        commands (List[str]): the program and its arguments
+        on_stdout_line (LineConsumer, optional): awaited with each line of stdout. Defaults to None.
+        on_stderr_line (LineConsumer, optional): awaited with each line of stderr. Defaults to None.
+        timeout (float, optional): seconds the command has to finish. Defaults to None.
+        buffer_size (int, optional): bytes of each stream kept for the result. Defaults to DEFAULT_BUFFER_SIZE.
+        kwargs: passed on to asyncio.create_subprocess_exec ie. startupinfo
+
+    Raises:
+        SubprocessTimeoutError: if the command didnt finish in time. It holds the output so far
+
+    Returns:
+        subprocess.CompletedProcess: the last buffer_size bytes of stdout and stderr
+    """
+    process = await asyncio.create_subprocess_exec(
+        *commands,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        **kwargs,
+    )
+    stdout = RingBuffer(buffer_size)
+    stderr = RingBuffer(buffer_size)
+    # bound to locals so they are still narrowed inside communicate
+    stdout_pipe, stderr_pipe = process.stdout, process.stderr
+    assert stdout_pipe is not None and stderr_pipe is not None
+
+    async def communicate() -> None:
+        await asyncio.gather(
+            _pump(stdout_pipe, stdout, on_stdout_line),
+            _pump(stderr_pipe, stderr, on_stderr_line),
+        )
+        await process.wait()
+
+    try:
+        await asyncio.wait_for(communicate(), timeout)
+    except asyncio.TimeoutError:
+        raise SubprocessTimeoutError(
+            subprocess.CompletedProcess(
+                commands, -1, stdout.getvalue(), stderr.getvalue()
+            ),
+            timeout or 0.0,
+        )
+    finally:
+        if process.returncode is None:
+            process.kill()
+            # reap it so it doesnt linger as a zombie
+            await asyncio.shield(process.wait())
+    for name, buffer in (("stdout", stdout), ("stderr", stderr)):
+        if buffer.dropped:
+            _Log.warning(
+                f"{commands[0]} wrote more than {buffer_size} bytes to {name}. "
+                f"The first {buffer.dropped} bytes were dropped"
+            )
+    returncode = -1 if process.returncode is None else process.returncode
+    return subprocess.CompletedProcess(
+        commands, returncode, stdout.getvalue(), stderr.getvalue()
+    )
+
+
+async def iter_lines(
+    commands: List[str],
+    timeout: float | None = None,
+    **kwargs: Any,
+) -> AsyncGenerator[bytes, None]:
+    """yields stdout a line at a time as the command prints it. stderr is read at the
+    same time so the command cant stall on it. Closing the generator early kills the
+    command
+
+    Args:
+        commands (List[str]): the program and its arguments
+        timeout (float, optional): seconds the command has to finish. Defaults to None.
+        kwargs: passed on to asyncio.create_subprocess_exec ie. startupinfo
+
+    Raises:
+        RemoteDeviceError: if the command exited with a non zero code
+        SubprocessTimeoutError: if the command didnt finish in time
+
+    Yields:
+        bytes: each line including its newline
+    """
+    lines: asyncio.Queue[bytes | None] = asyncio.Queue(LINE_QUEUE_SIZE)
+
+    async def produce() -> subprocess.CompletedProcess:
+        # None after the last line marks the end. Not sent if cancelled as nothing is
+        # reading any more
+        try:
+            result = await run(
+                commands, on_stdout_line=lines.put, timeout=timeout, **kwargs
+            )
+        except Exception:
+            await lines.put(None)
+            raise
+        await lines.put(None)
+        return result
+
+    task = asyncio.create_task(produce())
+    try:
+        while (line := await lines.get()) is not None:
+            yield line
+        result = await task
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+    if result.returncode != 0:
+        raise RemoteDeviceError(result)
@@ -0,0 +1,211 @@
+"""
+tar_stream.py
+
+copies a folder as a single tar archive piped into tar on the device. adb push and the
+sync protocol wait for the device to confirm every file before starting the next one
+which makes folders of thousands of small files crawl. The archive is built on the fly
+as it is written so nothing is staged in a temp file on either side
+
+exec:tar -xf - -C <folder>; echo <marker>$?
+
+exec: has no exit code so the command echos tar's status after its output. tar stops
+reading at the end of archive blocks so the stream doesnt need to be closed first
+"""
+import logging
+import os
+import posixpath
+import stat
+import subprocess
+import tarfile
+from typing import List, Optional, Tuple
+
+from adblib import adb_sync
+from adblib.adb_client import AdbClient, AdbConnection, quote_args
+from adblib.adb_sync import (
+    FileSyncedFunction,
+    ProgressReporter,
+    TransferProgress,
+    TransferProgressFunction,
+)
+from adblib.errors import RemoteDeviceError
+
+_Log = logging.getLogger()
+
+# bytes read from a file and written to the stream at a time
+TAR_CHUNK_SIZE = 256 * 1024
+
+# the mode given to folders created on the device
+DEFAULT_DIR_MODE = 0o755
+
+# follows tar's output with its exit code
+_EXIT_MARKER = b"__QC_TAR_EXIT__:"
+
+# the shell couldnt find tar on the device
+EXIT_COMMAND_NOT_FOUND = 127
+
+
+def _tar_header(name: str, local_path: str, entry_type: bytes) -> bytes:
+    """the header block of a folder or file. GNU format so names longer than 100
+    characters still fit"""
+    local_stat = os.stat(local_path)
+    info = tarfile.TarInfo(name)
+    info.type = entry_type
+    info.mtime = int(local_stat.st_mtime)
+    if entry_type == tarfile.DIRTYPE:
+        info.mode = DEFAULT_DIR_MODE
+    else:
+        info.mode = stat.S_IMODE(local_stat.st_mode) or adb_sync.DEFAULT_FILE_MODE
+        info.size = local_stat.st_size
+    return info.tobuf(tarfile.GNU_FORMAT, "utf-8", "surrogateescape")
+
+
+def _archive_folders(local_path: str, names: List[str]) -> List[Tuple[str, str]]:
+    """the folders the files are in with their parents before them. Each is paired with
+    the local folder its mtime is taken from"""
+    folders = set()
+    for name in names:
+        folder = posixpath.dirname(name)
+        while folder:
+            folders.add(folder)
+            folder = posixpath.dirname(folder)
+    parent = os.path.dirname(os.path.normpath(local_path))
+    return [
+        (folder, os.path.join(parent, *folder.split("/"))) for folder in sorted(folders)
+    ]
+
+
+async def _write_archive(
+    conn: AdbConnection,
+    local_path: str,
+    files: List[Tuple[str, str]],
+    reporter: ProgressReporter,
+) -> None:
+    """writes the tar archive of the files to the connection
+
+    Args:
+        conn (AdbConnection): the connection tar is reading from
+        local_path (str): the folder being copied. Names in the archive start with its name
+        files (List[Tuple[str, str]]): the local file and its name in the archive
+        reporter (ProgressReporter): updated as the file data is written
+    """
+    for name, local_folder in _archive_folders(local_path, [name for _, name in files]):
+        conn.write(_tar_header(name, local_folder, tarfile.DIRTYPE))
+    for local_file, name in files:
+        conn.write(_tar_header(name, local_file, tarfile.REGTYPE))
+        size = 0
+        with open(local_file, "rb") as fp:
+            # the chunks are read into new buffers as the transport may hold on to them
+            # after drain returns
+            while chunk := fp.read(TAR_CHUNK_SIZE):
+                conn.write(chunk)
+                size += len(chunk)
+                await conn.drain()
+                reporter.update(len(chunk), local_file)
+        # data is padded out to a whole block
+        remainder = size % tarfile.BLOCKSIZE
+        if remainder:
+            conn.write(bytes(tarfile.BLOCKSIZE - remainder))
+        reporter.progress.files_sent += 1
+    # two empty blocks end the archive
+    conn.write(bytes(tarfile.BLOCKSIZE * 2))
+    await conn.drain()
+
+
+def _check_output(service: str, output: bytes) -> None:
+    """finds tar's exit code at the end of the output
+
+    Raises:
+        RemoteDeviceError: if tar failed or the output was cut short
+    """
+    index = output.rfind(_EXIT_MARKER)
+    returncode = 1
+    if index != -1:
+        try:
+            returncode = int(output[index + len(_EXIT_MARKER) :].strip())
+        except ValueError:
+            pass
+        output = output[:index]
+    if returncode != 0:
+        raise RemoteDeviceError(
+            subprocess.CompletedProcess(
+                args=[service], returncode=returncode, stdout=output, stderr=b""
+            )
+        )
+
+
+async def push_tar(
+    client: AdbClient,
+    serial: str,
+    local_path: str,
+    remote_path: str,
+    progress_callback: Optional[TransferProgressFunction] = None,
+    skip_unchanged: bool = False,
+    verify_hash: bool = False,
+    on_file_synced: Optional[FileSyncedFunction] = None,
+) -> TransferProgress:
+    """copies a folder into a folder on the device by streaming it through tar. The
+    files keep their modified times so a later push can skip them
+
+    Args:
+        client (AdbClient): the client connected to the adb server
+        serial (str): the device to push to
+        local_path (str): the folder to copy
+        remote_path (str): the folder on the device to copy it into. Must already exist
+        progress_callback (TransferProgressFunction, optional): called with the progress
+        every PROGRESS_INTERVAL seconds and once more when the push completes. Defaults to None.
+        skip_unchanged (bool, optional): leave out files already on the device with the same
+        size and mtime. Defaults to False.
+        verify_hash (bool, optional): also compare the md5 of the files that would be
+        skipped. Defaults to False.
+        on_file_synced (FileSyncedFunction, optional): called for each file once tar has
+        extracted the whole archive or it was skipped. Defaults to None.
+
+    Raises:
+        NotADirectoryError: if the local path isnt a folder
+        RemoteDeviceError: if tar failed. Its exit code is EXIT_COMMAND_NOT_FOUND if the
+        device doesnt have tar. Some of the files may have been extracted
+
+    Returns:
+        TransferProgress: the totals for the completed push
+    """
+    if not os.path.isdir(local_path):
+        raise NotADirectoryError(local_path)
+    remote_root = posixpath.join(
+        remote_path, os.path.basename(os.path.normpath(local_path))
+    )
+    files = adb_sync._collect_files(local_path, remote_root)
+    total_bytes = sum(os.path.getsize(local_file) for local_file, _ in files)
+    reporter = ProgressReporter(progress_callback, total_bytes, len(files))
+    if skip_unchanged:
+        async with await adb_sync.open_sync(client, serial) as sync:
+            files = await adb_sync._skip_unchanged(
+                client,
+                serial,
+                sync,
+                local_path,
+                remote_root,
+                files,
+                reporter,
+                verify_hash,
+                on_file_synced,
+            )
+    if not files:
+        return reporter.complete()
+    command = quote_args(["tar", "-xf", "-", "-C", remote_path])
+    service = f"exec:{command} 2>&1; echo {_EXIT_MARKER.decode()}$?"
+    entries = [
+        (local_file, posixpath.relpath(remote_file, remote_path))
+        for local_file, remote_file in files
+    ]
+    async with await client.open_service(serial, service) as conn:
+        try:
+            await _write_archive(conn, local_path, entries, reporter)
+        except ConnectionError as err:
+            # tar stopped reading. What it printed says why
+            _Log.error(f"tar stream to {serial} was cut off. {err.__str__()}")
+        output = await conn.read_all()
+    _check_output(service, output)
+    if on_file_synced:
+        for local_file, remote_file in files:
+            on_file_synced(remote_file, os.path.getsize(local_file))
+    return reporter.complete()
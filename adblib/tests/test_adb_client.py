@@ -0,0 +1,580 @@
+import asyncio
+import os
+
+import pytest
+
+import adblib.adb_interface as adb
+from adblib import (
+    adb_client,
+    adb_sync,
+    compression,
+    fake_server,
+    fan_out,
+    flight_recorder,
+    retry,
+    shell_pool,
+    tar_stream,
+)
+from adblib.errors import RemoteDeviceError
+from adblib.fake_server import FakeAdbServer, FakeDevice
+
+
+@pytest.fixture
+def fake_devices():
+    devices = [
+        FakeDevice("QUEST-1", packages=["com.fake.game"]),
+        FakeDevice("PHONE-1", model="Pixel 6"),
+        FakeDevice("QUEST-2", state="unauthorized"),
+    ]
+    yield devices
+    for device in devices:
+        device.remove()
+
+
+@pytest.mark.asyncio
+async def test_version_and_devices(fake_devices):
+    async with FakeAdbServer(fake_devices) as server:
+        client = server.client()
+        assert await client.version() == 41
+        devices = await client.devices()
+    assert ("QUEST-1", "device") in devices
+    assert ("QUEST-2", "unauthorized") in devices
+
+
+@pytest.mark.asyncio
+async def test_shell_keeps_exit_code_and_streams_apart(fake_devices):
+    async with FakeAdbServer(fake_devices) as server:
+        result = await server.client().shell(
+            "QUEST-1", "echo hello; echo oops >&2; false"
+        )
+    assert result.stdout == b"hello\n"
+    assert result.stderr == b"oops\n"
+    assert result.returncode == 1
+
+
+@pytest.mark.asyncio
+async def test_transport_to_unknown_device_raises(fake_devices):
+    async with FakeAdbServer(fake_devices) as server:
+        with pytest.raises(RemoteDeviceError) as exc_info:
+            await server.client().shell("NOPE", "true")
+    assert "not found" in exc_info.value.message
+
+
+@pytest.fixture
+def threaded_server(fake_devices, monkeypatch):
+    # the sync wrappers block the calling thread so the server needs its own loop
+    server = FakeAdbServer(fake_devices)
+    server.start_in_thread()
+    monkeypatch.setattr(adb, "ADB_DEFAULT_PORT", server.port)
+    yield server
+    server.stop_thread()
+
+
+def test_sync_wrappers_use_the_server(threaded_server, fake_devices):
+    assert adb.get_device_names() == ["QUEST-1", "PHONE-1"]
+    assert adb.path_exists("QUEST-1", "/sdcard/Android/obb") == True
+    assert adb.path_exists("QUEST-1", "/sdcard/Android/obb/com.fake.game") == False
+    adb.make_dir("QUEST-1", "/sdcard/Android/obb/com.fake.game")
+    assert os.path.isdir(
+        fake_devices[0].local_path("/sdcard/Android/obb/com.fake.game")
+    )
+    assert adb.get_device_model("PHONE-1").strip() == "Pixel 6"
+    devices = adb.get_devices()
+    assert [(dev.serial, dev.state, dev.model) for dev in devices] == [
+        ("QUEST-1", "device", "Quest_2"),
+        ("PHONE-1", "device", "Pixel_6"),
+        ("QUEST-2", "unauthorized", ""),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_async_wrappers_use_the_server(threaded_server, tmp_path):
+    assert await adb.async_get_device_names() == ["QUEST-1", "PHONE-1"]
+    apk_path = tmp_path / "game.apk"
+    apk_path.write_bytes(os.urandom(200000))
+    assert "Success" in await adb.install_apk("QUEST-1", str(apk_path))
+    packages = await adb.get_installed_packages("QUEST-1")
+    assert packages == ["com.fake.game", "com.fakeadb.app1"]
+    await adb.uninstall("QUEST-1", "com.fake.game")
+    streamed = [pkg async for pkg in adb.get_package_generator("QUEST-1")]
+    assert streamed == ["com.fakeadb.app1"]
+
+
+@pytest.mark.asyncio
+async def test_transient_errors_retry_once_the_device_is_back(
+    fake_devices, monkeypatch
+):
+    policy = retry.RetryPolicy(attempts=3, base_delay=0.01, device_timeout=5.0)
+    monkeypatch.setattr(adb, "RETRY_POLICY", policy)
+    retry.retry_stats.clear()
+    async with FakeAdbServer(fake_devices) as server:
+        monkeypatch.setattr(adb, "ADB_DEFAULT_PORT", server.port)
+        quest = fake_devices[0]
+        quest.state = "offline"
+
+        async def replug() -> None:
+            await asyncio.sleep(0.2)
+            quest.state = "device"
+            server.devices_changed()
+
+        replugged = asyncio.create_task(replug())
+        assert (await adb.async_get_device_model("QUEST-1")).strip() == "Quest 2"
+        await replugged
+        # a permanent error isnt tried again
+        with pytest.raises(RemoteDeviceError):
+            await adb.async_make_dir("QUEST-1", "/sdcard/missing/parent")
+    (record,) = retry.retry_stats.records()
+    assert (record.operation, record.retries, record.succeeded) == (
+        "get_device_model",
+        1,
+        True,
+    )
+    assert record.lost >= 0.2
+    fault = RemoteDeviceError(adb_client._failed_result("shell:", "protocol fault"))
+    assert retry.classify(fault) == retry.TRANSIENT
+
+
+@pytest.mark.asyncio
+async def test_lost_pooled_shell_is_retried(fake_devices, monkeypatch):
+    policy = retry.RetryPolicy(attempts=3, base_delay=0.01, device_timeout=5.0)
+    monkeypatch.setattr(adb, "RETRY_POLICY", policy)
+    monkeypatch.setattr(adb, "USE_SHELL_POOL", True)
+    retry.retry_stats.clear()
+    quest = fake_devices[0]
+    quest.link = fake_server.LinkModel()
+    async with FakeAdbServer(fake_devices) as server:
+        monkeypatch.setattr(adb, "ADB_DEFAULT_PORT", server.port)
+        # opens the pooled shell
+        assert await adb.async_path_exists("QUEST-1", "/sdcard/Android/obb")
+        # the next command line on the pooled shell drops its connection
+        quest.link.drop_next_request = True
+        assert (await adb.async_get_device_model("QUEST-1")).strip() == "Quest 2"
+        await adb.get_shell_pool().close()
+    (record,) = retry.retry_stats.records()
+    assert (record.operation, record.retries, record.succeeded) == (
+        "get_device_model",
+        1,
+        True,
+    )
+
+
+@pytest.mark.asyncio
+async def test_link_model_throttles_and_drops_a_push(
+    fake_devices, tmp_path, monkeypatch
+):
+    policy = retry.RetryPolicy(attempts=3, base_delay=0.01, device_timeout=5.0)
+    monkeypatch.setattr(adb, "RETRY_POLICY", policy)
+    retry.retry_stats.clear()
+    data = os.urandom(200 * 1024)
+    local_file = tmp_path / "main.obb"
+    local_file.write_bytes(data)
+    quest = fake_devices[0]
+    quest.link = fake_server.LinkModel(
+        bandwidth=2 * 1024 * 1024, fail_after_bytes=64 * 1024, seed=1
+    )
+    async with FakeAdbServer(fake_devices) as server:
+        monkeypatch.setattr(adb, "ADB_DEFAULT_PORT", server.port)
+        start = asyncio.get_running_loop().time()
+        await adb.copy_path("QUEST-1", str(local_file), "/sdcard/main.obb")
+        elapsed = asyncio.get_running_loop().time() - start
+    with open(quest.local_path("/sdcard/main.obb"), "rb") as fp:
+        assert fp.read() == data
+    # the dropped bytes went over the link as well as the whole file
+    assert elapsed >= len(data) / quest.link.bandwidth
+    (record,) = retry.retry_stats.records()
+    assert (record.operation, record.retries, record.succeeded) == (
+        "push",
+        1,
+        True,
+    )
+
+
+@pytest.mark.asyncio
+async def test_replays_a_recorded_session_without_a_device(
+    fake_devices, tmp_path, monkeypatch
+):
+    trace_path = str(tmp_path / "trace.jsonl")
+    obb_dir = tmp_path / "com.fake.game"
+    obb_dir.mkdir()
+    (obb_dir / "main.obb").write_bytes(os.urandom(5000))
+
+    async def session():
+        return (
+            await adb.async_get_device_names(),
+            await adb.async_get_device_model("QUEST-1"),
+            [
+                r.stdout
+                for r in await adb.async_shell_batch("QUEST-1", [["echo", "hi"]])
+            ],
+            [pkg async for pkg in adb.get_package_generator("QUEST-1")],
+            await adb.copy_path("QUEST-1", str(obb_dir), "/sdcard/Android/obb"),
+        )
+
+    recorder = flight_recorder.FlightRecorder(trace_path)
+    monkeypatch.setattr(adb, "RECORDER", recorder)
+    async with FakeAdbServer(fake_devices) as server:
+        monkeypatch.setattr(adb, "ADB_DEFAULT_PORT", server.port)
+        recorded = await session()
+    recorder.close()
+    events = flight_recorder.load_trace(trace_path)
+    assert flight_recorder.summarize(events)[flight_recorder.KIND_PUSH][0] == 1
+    assert all(event.serial == "QUEST-1" for event in events[1:])
+
+    monkeypatch.setattr(adb, "RECORDER", None)
+    monkeypatch.setattr(adb, "REPLAYER", flight_recorder.Replayer(events, speed=0))
+    # nothing is listening on the port any more
+    assert await session() == recorded
+    with pytest.raises(flight_recorder.TraceMissError):
+        await adb.async_get_device_model("QUEST-9")
+
+
+def test_parse_device_list():
+    output = (
+        "1WMHH000X00000         device usb:1-1.2 product:hollywood model:Quest_2 device:hollywood transport_id:3\n"
+        "R58M00000             no permissions (user in plugdev group) usb:1-4 transport_id:4\n"
+    )
+    quest, phone = adb_client.parse_device_list(output)
+    assert quest.serial == "1WMHH000X00000"
+    assert quest.state == "device"
+    assert quest.display_model == "Quest 2"
+    assert quest.usb == "1-1.2"
+    assert phone.state == "no permissions (user in plugdev group)"
+
+
+@pytest.mark.asyncio
+async def test_track_devices_streams_changes(fake_devices):
+    async with FakeAdbServer(fake_devices) as server:
+        tracker = server.client().track_devices()
+        devices = await tracker.__anext__()
+        assert [dev.serial for dev in devices] == ["QUEST-1", "PHONE-1", "QUEST-2"]
+        fake_devices[2].state = "device"
+        server.devices_changed()
+        devices = await tracker.__anext__()
+        assert devices[2].state == "device"
+        assert devices[2].model == "Quest_2"
+        await tracker.aclose()
+
+
+@pytest.mark.asyncio
+async def test_push_copies_folder_into_existing_directory(fake_devices, tmp_path):
+    obb_dir = tmp_path / "com.fake.game"
+    (obb_dir / "sub").mkdir(parents=True)
+    main_obb = os.urandom(adb_sync.SYNC_DATA_MAX * 3 + 17)
+    (obb_dir / "main.obb").write_bytes(main_obb)
+    (obb_dir / "sub" / "empty.obb").write_bytes(b"")
+    updates = []
+    async with FakeAdbServer(fake_devices) as server:
+        progress = await adb_sync.push(
+            server.client(),
+            "QUEST-1",
+            str(obb_dir),
+            "/sdcard/Android/obb",
+            updates.append,
+        )
+    device = fake_devices[0]
+    remote_dir = device.local_path("/sdcard/Android/obb/com.fake.game")
+    with open(os.path.join(remote_dir, "main.obb"), "rb") as fp:
+        assert fp.read() == main_obb
+    assert os.path.getsize(os.path.join(remote_dir, "sub", "empty.obb")) == 0
+    assert progress.bytes_sent == progress.total_bytes == len(main_obb)
+    assert progress.files_sent == progress.total_files == 2
+    assert updates[-1].bytes_sent == len(main_obb)
+
+
+@pytest.mark.asyncio
+async def test_push_skips_unchanged_files(fake_devices, tmp_path, monkeypatch):
+    obb_dir = tmp_path / "com.fake.game"
+    (obb_dir / "sub").mkdir(parents=True)
+    (obb_dir / "main.obb").write_bytes(os.urandom(5000))
+    (obb_dir / "sub" / "patch.obb").write_bytes(os.urandom(300))
+    async with FakeAdbServer(fake_devices) as server:
+        args = (server.client(), "QUEST-1", str(obb_dir), "/sdcard/Android/obb")
+        await adb_sync.push(*args)
+        (obb_dir / "sub" / "patch.obb").write_bytes(os.urandom(400))
+        progress = await adb_sync.push(*args, skip_unchanged=True)
+        assert (progress.files_sent, progress.bytes_sent) == (1, 400)
+        assert (progress.files_skipped, progress.bytes_skipped) == (1, 5000)
+        # same size and mtime but different contents is only caught by the hash
+        remote_main = fake_devices[0].local_path(
+            "/sdcard/Android/obb/com.fake.game/main.obb"
+        )
+        mtime = os.path.getmtime(remote_main)
+        with open(remote_main, "r+b") as fp:
+            fp.write(b"corrupt")
+        os.utime(remote_main, (mtime, mtime))
+        # every file is hashed by its own md5sum
+        monkeypatch.setattr(adb_sync, "HASH_COMMAND_MAX", 60)
+        assert len(adb_sync._hash_commands(["/sdcard/" + "a" * 40] * 3)) == 3
+        progress = await adb_sync.push(*args, skip_unchanged=True, verify_hash=True)
+        assert (progress.files_sent, progress.files_skipped) == (1, 1)
+    with open(remote_main, "rb") as fp:
+        assert fp.read() == (obb_dir / "main.obb").read_bytes()
+
+
+def test_rate_meter_smooths_a_stall():
+    meter = adb_sync.RateMeter(time_constant=1.0)
+    start = meter._last_time
+    meter.update(1000, start + 1.0)
+    assert meter.rate == meter.smoothed_rate == 1000
+    # a second with nothing sent drops the current rate but not all of the smoothed one
+    meter.update(1000, start + 2.0)
+    assert meter.rate == 0
+    assert 300 < meter.smoothed_rate < 400
+    progress = adb_sync.TransferProgress(500, 1500, 2.0, "", 0, 1, bytes_skipped=500)
+    meter.apply(progress)
+    assert progress.eta == pytest.approx(500 / meter.smoothed_rate)
+
+
+def test_session_install_streams_splits(threaded_server, fake_devices, tmp_path):
+    paths = []
+    for name, size in (("base.apk", 300000), ("split_config.arm64_v8a.apk", 5000)):
+        path = tmp_path / name
+        path.write_bytes(os.urandom(size))
+        paths.append(str(path))
+    updates = []
+    output = adb.run_sync(
+        adb.install_apk("QUEST-1", paths[0], paths[1:], updates.append)
+    )
+    assert output.startswith("Success")
+    assert fake_devices[0].packages == ["com.fake.game", "com.fakeadb.app1"]
+    assert fake_devices[0].sessions == {}
+    assert updates[-1].bytes_sent == 305000
+    assert updates[-1].files_sent == 2
+
+
+def test_shell_batch_splits_each_command(threaded_server):
+    results = adb.shell_batch(
+        "QUEST-1",
+        [
+            ["echo", "first"],
+            ["printf", "no newline"],
+            ["test", "-d", "/sdcard/missing"],
+            ["cat", "/sdcard/missing"],
+        ],
+    )
+    assert [result.returncode for result in results] == [0, 0, 1, 1]
+    assert results[0].stdout == b"first\n"
+    assert results[1].stdout == b"no newline"
+    assert results[2].stdout == results[2].stderr == b""
+    assert results[3].stderr == b"cat: /sdcard/missing: No such file or directory\n"
+
+
+@pytest.mark.asyncio
+async def test_uninstall_packages_reports_each_package(threaded_server, fake_devices):
+    quest = fake_devices[0]
+    obb_dir = quest.local_path("/sdcard/Android/obb/com.fake.game")
+    os.makedirs(obb_dir)
+    errors = await adb.uninstall_packages(
+        "QUEST-1", ["com.fake.game", "com.nope"], data_dirs=["/sdcard/Android/obb"]
+    )
+    assert errors["com.fake.game"] is None
+    assert isinstance(errors["com.nope"], RemoteDeviceError)
+    assert not os.path.exists(obb_dir)
+
+
+@pytest.mark.asyncio
+async def test_shell_pool_reuses_and_reopens_sessions(fake_devices):
+    async with FakeAdbServer(fake_devices) as server:
+        pool = shell_pool.ShellPool(server.client, health_check_interval=0)
+        first = await pool.session("QUEST-1")
+        result = await pool.run("QUEST-1", "echo hello; echo oops >&2; false")
+        assert (result.stdout, result.stderr, result.returncode) == (
+            b"hello\n",
+            b"oops\n",
+            1,
+        )
+        result = await pool.run("QUEST-1", "echo $?")
+        assert result.stdout == b"0\n"
+        assert await pool.session("QUEST-1") is first
+        # a dropped shell fails the health check and is replaced
+        await first.conn.close()
+        second = await pool.session("QUEST-1")
+        assert second is not first
+        assert (await pool.run("QUEST-1", "getprop ro.product.model")).stdout
+        await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_blocking_call_on_event_loop_is_logged(
+    threaded_server, monkeypatch, caplog
+):
+    monkeypatch.setattr(adb, "WARN_BLOCKING_CALLS", True)
+    assert await adb.async_get_device_model("QUEST-1") == "Quest 2\n"
+    assert not caplog.records
+    assert adb.get_device_model("QUEST-1") == "Quest 2\n"
+    assert "async_get_device_model held up the event loop" in caplog.text
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("codec", ["zstd", "lz4", "brotli"])
+async def test_push_compresses_when_the_device_supports_it(
+    fake_devices, tmp_path, monkeypatch, caplog, codec
+):
+    caplog.set_level("INFO")
+    if codec not in compression.CODECS:
+        pytest.skip(f"{codec} isnt installed")
+    monkeypatch.setattr(
+        fake_server, "FAKE_DEVICE_FEATURES", f"shell_v2,sendrecv_v2,sendrecv_v2_{codec}"
+    )
+    obb_dir = tmp_path / "com.fake.game"
+    obb_dir.mkdir()
+    # compresses well and shouldnt
+    textures = b"texture " * 300000
+    (obb_dir / "textures.obb").write_bytes(textures)
+    (obb_dir / "packed.obb").write_bytes(os.urandom(100000))
+    async with FakeAdbServer(fake_devices) as server:
+        progress = await adb_sync.push(
+            server.client(),
+            "QUEST-1",
+            str(obb_dir),
+            "/sdcard/Android/obb",
+            compress=True,
+        )
+    remote_dir = fake_devices[0].local_path("/sdcard/Android/obb/com.fake.game")
+    with open(os.path.join(remote_dir, "textures.obb"), "rb") as fp:
+        assert fp.read() == textures
+    assert os.path.getsize(os.path.join(remote_dir, "packed.obb")) == 100000
+    assert progress.bytes_sent == len(textures) + 100000
+    assert f"compression {codec}, ratio 0.0" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_push_tar_streams_many_small_files(fake_devices, tmp_path):
+    obb_dir = tmp_path / "com.fake.game"
+    contents = {}
+    for index in range(150):
+        # names too long for a plain ustar header
+        relative = os.path.join(f"level{index % 3}", f"{'asset' * 25}{index}.bin")
+        contents[relative] = os.urandom(index * 7)
+        (obb_dir / relative).parent.mkdir(parents=True, exist_ok=True)
+        (obb_dir / relative).write_bytes(contents[relative])
+    synced = []
+    async with FakeAdbServer(fake_devices) as server:
+        args = (server.client(), "QUEST-1", str(obb_dir), "/sdcard/Android/obb")
+        progress = await tar_stream.push_tar(
+            *args, on_file_synced=lambda path, size: synced.append(path)
+        )
+        assert (progress.files_sent, progress.bytes_sent) == (150, 7 * 149 * 75)
+        assert len(synced) == 150
+        remote_dir = fake_devices[0].local_path("/sdcard/Android/obb/com.fake.game")
+        for relative, data in contents.items():
+            remote_file = os.path.join(remote_dir, relative)
+            with open(remote_file, "rb") as fp:
+                assert fp.read() == data
+        # the files keep their mtimes so the next push skips them
+        progress = await tar_stream.push_tar(*args, skip_unchanged=True)
+        assert (progress.files_sent, progress.files_skipped) == (0, 150)
+
+
+@pytest.mark.asyncio
+async def test_push_tar_raises_when_tar_fails(fake_devices, tmp_path):
+    obb_dir = tmp_path / "com.fake.game"
+    obb_dir.mkdir()
+    (obb_dir / "main.obb").write_bytes(b"data")
+    async with FakeAdbServer(fake_devices) as server:
+        with pytest.raises(RemoteDeviceError) as err:
+            await tar_stream.push_tar(
+                server.client(), "QUEST-1", str(obb_dir), "/sdcard/missing"
+            )
+    assert err.value.code == 1
+    assert "No such file or directory" in err.value.message
+
+
+@pytest.fixture
+def quests():
+    devices = [FakeDevice(f"QUEST-{index}") for index in range(1, 4)]
+    yield devices
+    for device in devices:
+        device.remove()
+
+
+@pytest.mark.asyncio
+async def test_fan_out_reads_each_file_once(quests, tmp_path, monkeypatch):
+    obb_dir = tmp_path / "com.fake.game"
+    (obb_dir / "sub").mkdir(parents=True)
+    main = os.urandom(3 * 1024 * 1024 + 5)
+    (obb_dir / "main.obb").write_bytes(main)
+    (obb_dir / "sub" / "patch.obb").write_bytes(b"patch")
+    # one of the headsets already has the patch
+    remote_patch = quests[0].local_path("/sdcard/Android/obb/com.fake.game/sub")
+    os.makedirs(remote_patch)
+    (obb_dir / "sub" / "patch.obb").touch()
+    os.utime(obb_dir / "sub" / "patch.obb", (1000, 1000))
+    with open(os.path.join(remote_patch, "patch.obb"), "wb") as fp:
+        fp.write(b"patch")
+    os.utime(os.path.join(remote_patch, "patch.obb"), (1000, 1000))
+    opened = []
+
+    def counting_open(path, *args, **kwargs):
+        opened.append(path)
+        return open(path, *args, **kwargs)
+
+    monkeypatch.setattr(fan_out, "open", counting_open, raising=False)
+    async with FakeAdbServer(quests) as server:
+        group = fan_out.FanOutGroup(len(quests))
+        results = await asyncio.gather(
+            *(
+                group.push(
+                    server.client(),
+                    device.serial,
+                    str(obb_dir),
+                    "/sdcard/Android/obb",
+                    skip_unchanged=True,
+                )
+                for device in quests
+            )
+        )
+    assert sorted(opened) == sorted(
+        [str(obb_dir / "main.obb"), str(obb_dir / "sub" / "patch.obb")]
+    )
+    assert [(p.files_sent, p.files_skipped) for p in results] == [
+        (1, 1),
+        (2, 0),
+        (2, 0),
+    ]
+    for device in quests:
+        remote_dir = device.local_path("/sdcard/Android/obb/com.fake.game")
+        with open(os.path.join(remote_dir, "main.obb"), "rb") as fp:
+            assert fp.read() == main
+
+
+@pytest.mark.asyncio
+async def test_fan_out_ejects_a_slow_device(quests, tmp_path, monkeypatch):
+    monkeypatch.setattr(fan_out, "FAN_OUT_CHUNK_SIZE", 64 * 1024)
+    monkeypatch.setattr(fan_out, "FAN_OUT_QUEUE_DEPTH", 2)
+    data = os.urandom(2 * 1024 * 1024)
+    local_file = tmp_path / "main.obb"
+    local_file.write_bytes(data)
+    open_sync = adb_sync.open_sync
+    slowed = []
+
+    class SlowSync(adb_sync.SyncConnection):
+        async def send_data(self, chunk):
+            # longer than the others will wait for it
+            await asyncio.sleep(0.3)
+            await super().send_data(chunk)
+
+    async def slow_first_open(client, serial):
+        sync = await open_sync(client, serial)
+        if serial == "QUEST-2" and not slowed:
+            slowed.append(serial)
+            return SlowSync(sync.conn)
+        return sync
+
+    monkeypatch.setattr(adb_sync, "open_sync", slow_first_open)
+    async with FakeAdbServer(quests) as server:
+        targets = [fan_out.FanOutTarget(device.serial) for device in quests]
+        push = fan_out.FanOutPush(
+            server.client(),
+            targets,
+            str(local_file),
+            "/sdcard/Android/obb",
+            eject_timeout=0.1,
+        )
+        results = await push.run()
+    assert [results[t.serial].ejected for t in targets] == [False, True, False]
+    for device in quests:
+        assert results[device.serial].error is None
+        assert results[device.serial].progress.bytes_sent == len(data)
+        with open(device.local_path("/sdcard/Android/obb/main.obb"), "rb") as fp:
+            assert fp.read() == data
@@ -1,10 +1,14 @@
 import asyncio
+import os
 import subprocess
+import sys
 from unittest.mock import MagicMock, AsyncMock
 
 import pytest
 
 import adblib.adb_interface as adb
+from adblib import subprocess_runner
+from adblib.errors import RemoteDeviceError, SubprocessTimeoutError
 
 
 def get_mock_stream_reader() -> MagicMock:
@@ -18,6 +22,20 @@ def test__remove_showwindow_flag():
     assert (stup_info.dwFlags & subprocess.STARTF_USESHOWWINDOW) == 1
 
 
+def test_blocking_call_inside_a_blocking_call_raises():
+    async def inner():
+        # running on the sync worker so another blocking call would wait for itself
+        return adb.run_sync(asyncio.sleep(0, "never"))
+
+    async def outer():
+        return adb.run_sync(inner())
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(outer())
+    # the worker is still free
+    assert adb.run_sync(asyncio.sleep(0, "done")) == "done"
+
+
 class TestGetBytesFromStream:
     @pytest.mark.asyncio
     async def test_get_bytes_from_stream_equal_to_bytes(self):
@@ -30,3 +48,51 @@ class TestGetBytesFromStream:
     async def test_get_bytes_From_stream_is_none(self):
         v = await adb._get_bytes_from_stream(stream_reader=None)
         assert type(v) == bytes
+
+
+class TestSubprocessRunner:
+    @pytest.mark.asyncio
+    async def test_reads_both_pipes_without_stalling(self):
+        # more stderr than a pipe holds written before any stdout
+        script = (
+            "import sys\n"
+            "sys.stderr.write('e' * 1000000)\n"
+            "sys.stderr.flush()\n"
+            "for i in range(3):\n"
+            "    print(f'line {i}')\n"
+        )
+        lines = []
+
+        async def on_line(line: bytes) -> None:
+            lines.append(line)
+
+        result = await asyncio.wait_for(
+            subprocess_runner.run(
+                [sys.executable, "-c", script],
+                on_stdout_line=on_line,
+                buffer_size=1000,
+            ),
+            30,
+        )
+        assert result.returncode == 0
+        assert [line.strip() for line in lines] == [b"line 0", b"line 1", b"line 2"]
+        # only the end of stderr is kept
+        assert result.stderr == b"e" * 1000
+
+    @pytest.mark.asyncio
+    async def test_timeout_kills_the_command(self):
+        script = "import time\nprint('started', flush=True)\ntime.sleep(60)\n"
+        with pytest.raises(SubprocessTimeoutError) as exc_info:
+            await subprocess_runner.run([sys.executable, "-c", script], timeout=1.0)
+        assert exc_info.value.result.stdout.strip() == b"started"
+
+    @pytest.mark.asyncio
+    async def test_iter_lines_raises_on_error_code(self):
+        script = "import sys\nprint('one')\nsys.exit(3)\n"
+        lines = []
+        with pytest.raises(RemoteDeviceError):
+            async for line in subprocess_runner.iter_lines(
+                [sys.executable, "-c", script]
+            ):
+                lines.append(line)
+        assert lines == [b"one" + os.linesep.encode()]
@@ -49,6 +49,12 @@ APP_DOWNLOADS_PATH: str = os.path.join(APP_BASE_PATH, "Games")
 APP_DATA_PATH = os.path.join(APP_BASE_PATH, "Data")
 APP_LOG_PATH = os.path.join(APP_DATA_PATH, "log.txt")
 APP_SETTINGS_PATH = os.path.join(APP_DATA_PATH, "settings.json")
+# progress of unfinished installs so they can be resumed
+APP_INSTALL_JOURNAL_PATH = os.path.join(APP_DATA_PATH, "install_journal.json")
+# the packages last seen on each device so the installed list shows straight away
+APP_PACKAGE_CACHE_PATH = os.path.join(APP_DATA_PATH, "package_cache.json")
+# every command sent to adb when started with --record-adb
+APP_ADB_TRACE_PATH = os.path.join(APP_DATA_PATH, "adb_trace.jsonl")
 
 
 # local json file for storing local magnet database incase no response from the API
@@ -62,9 +68,6 @@ QUEST_ROOT = "/sdcard"
 QUEST_DATA_DIRECTORY = f"{QUEST_ROOT}/Android/data"
 QUEST_OBB_DIRECTORY = f"{QUEST_ROOT}/Android/obb"
 
-# where the apk will temp be pushed to and installed from
-QUEST_APK_TEMP_DIRECTORY = QUEST_ROOT + "/Download"
-
 # avoid the circular import
 from lib.settings import Settings
 
@@ -87,6 +90,23 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Use local host (http://127.0.0.1:8000)",
     )
+    parser.add_argument(
+        "--record-adb",
+        action="store_true",
+        help=f"Record every adb command to {APP_ADB_TRACE_PATH}",
+    )
+    parser.add_argument(
+        "--replay-adb",
+        metavar="TRACE",
+        default="",
+        help="Answer adb commands from a recorded trace instead of a device",
+    )
+    parser.add_argument(
+        "--replay-speed",
+        type=float,
+        default=1.0,
+        help="How much faster than recorded to replay. 0 doesnt wait",
+    )
     args = parser.parse_args()
     return args
 
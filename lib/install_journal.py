@@ -0,0 +1,188 @@
+"""
+install_journal.py
+
+records each step of an install as it completes so an install that was interrupted by a
+crash, a pulled cable or a cancel can carry on from where it got to instead of starting
+again
+
+the data files arent recorded one by one. The push on resume compares every file with
+the one on the device and skips those already there which also catches files removed
+from the device since
+
+the journal is a json file that is rewritten after every step. It is written to a temp
+file, flushed to disk and then swapped in place of the old one so a crash part way
+through a write leaves the previous journal intact. The writes happen on a thread of
+their own so the event loop isnt held up by the disk
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List
+
+import lib.config
+import lib.utils
+
+_Log = logging.getLogger()
+
+JOURNAL_VERSION = 1
+
+
+@dataclass
+class BundleRecord:
+    """the steps of a bundle install that have finished"""
+
+    apk_path: str
+    # the apk the record was made for. A new download of the game starts over
+    apk_size: int
+    apk_mtime: float
+    apk_installed: bool = False
+    packages: List[str] = field(default_factory=list)
+
+    def matches(self, apk_path: str) -> bool:
+        """the apk on disk is the one this record was made for"""
+        try:
+            st = os.stat(apk_path)
+        except OSError:
+            return False
+        return st.st_size == self.apk_size and st.st_mtime == self.apk_mtime
+
+
+class InstallJournal:
+    def __init__(self, path: str = lib.config.APP_INSTALL_JOURNAL_PATH) -> None:
+        """the unfinished installs on each device. Use InstallJournal.load to read the
+        journal from disk. Safe to use from any thread
+
+        Args:
+            path (str, optional): the journal file. Defaults to lib.config.APP_INSTALL_JOURNAL_PATH.
+        """
+        self.path = path
+        # device serial -> apk path -> record
+        self._devices: Dict[str, Dict[str, BundleRecord]] = {}
+        self._lock = threading.Lock()
+        # notified when the writer has nothing left to write
+        self._idle = threading.Condition(self._lock)
+        # one thread so the writes land in order
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="journal")
+        # the newest journal text waiting for the writer
+        self._pending: str | None = None
+        self._writing = False
+
+    @staticmethod
+    def load(path: str = lib.config.APP_INSTALL_JOURNAL_PATH) -> "InstallJournal":
+        """reads the journal. A missing or unreadable journal gives an empty one
+
+        Args:
+            path (str, optional): the journal file. Defaults to lib.config.APP_INSTALL_JOURNAL_PATH.
+
+        Returns:
+            InstallJournal:
+        """
+        journal = InstallJournal(path)
+        try:
+            with open(path, "r") as fp:
+                data = json.load(fp)
+            if data.get("version") != JOURNAL_VERSION:
+                raise ValueError(f"unknown journal version {data.get('version')}")
+            for serial, records in data.get("devices", {}).items():
+                journal._devices[serial] = {
+                    apk_path: BundleRecord(**record)
+                    for apk_path, record in records.items()
+                }
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, TypeError, AttributeError) as err:
+            _Log.error(f"Install journal {path} could not be read. {err.__str__()}")
+            journal._devices = {}
+        return journal
+
+    def _save(self) -> None:
+        """hands the journal to the writer thread. Call with the lock held"""
+        data = {
+            "version": JOURNAL_VERSION,
+            "devices": {
+                serial: {
+                    apk_path: asdict(record) for apk_path, record in records.items()
+                }
+                for serial, records in self._devices.items()
+                if records
+            },
+        }
+        self._pending = json.dumps(data, indent=2)
+        if not self._writing:
+            self._writing = True
+            self._writer.submit(self._write_pending)
+
+    def _write_pending(self) -> None:
+        """writes the newest journal until there isnt a newer one. Runs on the writer thread"""
+        while True:
+            with self._lock:
+                text = self._pending
+                self._pending = None
+                if text is None:
+                    self._writing = False
+                    self._idle.notify_all()
+                    return
+            try:
+                lib.utils.write_file_atomic(self.path, text)
+            except OSError as err:
+                _Log.error(f"Install journal {self.path} could not be written. {err}")
+
+    def start_bundle(self, serial: str, apk_path: str) -> BundleRecord:
+        """gets the record of an earlier attempt at installing the apk or starts a new one.
+        The record of an earlier attempt is thrown away if the apk has changed since
+
+        Args:
+            serial (str): the device being installed to
+            apk_path (str): the base apk of the bundle
+
+        Returns:
+            BundleRecord: a copy of the record. Use the other methods to update it
+        """
+        with self._lock:
+            records = self._devices.setdefault(serial, {})
+            record = records.get(apk_path)
+            if record is None or not record.matches(apk_path):
+                st = os.stat(apk_path)
+                record = BundleRecord(apk_path, st.st_size, st.st_mtime)
+                records[apk_path] = record
+                self._save()
+            return BundleRecord(**asdict(record))
+
+    def apk_installed(self, serial: str, apk_path: str, packages: List[str]) -> None:
+        """records the apk was installed and the packages it added"""
+        with self._lock:
+            record = self._devices[serial][apk_path]
+            record.apk_installed = True
+            record.packages = list(packages)
+            self._save()
+
+    def flush(self) -> None:
+        """waits until the journal is on disk. Blocks so dont call it on the event loop.
+        See async_flush"""
+        with self._lock:
+            self._idle.wait_for(lambda: not self._writing)
+
+    async def async_flush(self) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, self.flush)
+
+    def finish_bundle(self, serial: str, apk_path: str) -> None:
+        """removes the record once the bundle has installed or been removed from the
+        device. There is nothing left to resume"""
+        with self._lock:
+            if self._devices.get(serial, {}).pop(apk_path, None) is not None:
+                self._save()
+
+    def get(self, serial: str, apk_path: str) -> BundleRecord | None:
+        """gets a copy of the record without checking the apk
+
+        Returns:
+            BundleRecord | None: None if there is no unfinished install of the apk
+        """
+        with self._lock:
+            record = self._devices.get(serial, {}).get(apk_path)
+            return None if record is None else BundleRecord(**asdict(record))
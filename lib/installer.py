@@ -0,0 +1,322 @@
+"""
+installer.py
+
+installs every apk bundle found in a download at the same time. The USB link sits
+idle while the package manager verifies an apk so the next bundles data files are
+pushed while that happens
+
+only one apk is streamed to the package manager at a time and only one set of data
+files is pushed at a time. Anything more just splits the same USB bandwidth
+
+with an install journal each finished step is recorded. If the install stops on an
+error or is cancelled the bundles are left as they are so the next attempt can carry on
+from them. Without one a cancel removes everything and an error removes the bundles it
+interrupted
+
+the package name and version of each apk are read from its manifest. An apk whose
+version is already on the device isnt installed again and a cancelled install only
+removes the packages its own apks added. An apk whose manifest cant be read falls back
+to comparing the package list from before and after it was installed
+"""
+
+import asyncio
+import logging
+import os
+from typing import Dict, Iterable, List
+
+import adblib.adb_interface as adb_interface
+import lib.package_cache
+import lib.quest
+import lib.utils
+from lib.install_journal import InstallJournal
+from adblib.adb_sync import TransferProgressFunction
+from adblib.apk_manifest import ApkManifest, ManifestError, read_manifest
+from adblib.fan_out import FanOutGroup
+from adblib.errors import RemoteDeviceError
+
+_Log = logging.getLogger()
+
+# the number of bundles that can be in progress at the same time
+DEFAULT_MAX_CONCURRENT_INSTALLS = 2
+
+
+class BundleInstall:
+    def __init__(self, apk_dir: lib.utils.ApkPath) -> None:
+        """keeps track of everything an install has put onto the device so it can be removed
+        if the install gets cancelled
+
+        Args:
+            apk_dir (ApkPath): the bundle being installed
+        """
+        self.apk_dir = apk_dir
+        self.name = os.path.split(apk_dir.path)[-1]
+        self.manifest: ApkManifest | None = None
+        self.packages: List[str] = []
+        self.remote_paths: List[str] = []
+        self.completed = False
+
+
+class ConcurrentInstaller:
+    def __init__(
+        self,
+        device_name: str,
+        callback: lib.quest.InstallStatusFunction,
+        progress_callback: TransferProgressFunction | None = None,
+        max_concurrent: int = DEFAULT_MAX_CONCURRENT_INSTALLS,
+        verify_hash: bool = False,
+        journal: InstallJournal | None = None,
+        fan_out_group: FanOutGroup | None = None,
+    ) -> None:
+        """installs a list of apk bundles onto a device overlapping the apk installs
+        with the data file pushes
+
+        Args:
+            device_name (str): the device to install to
+            callback (InstallStatusFunction): recieves the status lines. Each line starts with
+            the name of the apk it belongs to
+            progress_callback (TransferProgressFunction, optional): recieves the progress of the
+            data files currently being pushed. Defaults to None.
+            max_concurrent (int, optional): bundles that can be in progress at once. Defaults to DEFAULT_MAX_CONCURRENT_INSTALLS.
+            verify_hash (bool, optional): compare the md5 of data files already on the device
+            before skipping them. Defaults to False.
+            journal (InstallJournal, optional): records the finished steps so an interrupted
+            install can be resumed. Defaults to None.
+            fan_out_group (FanOutGroup, optional): shares the reads of the data files with
+            installs to other devices. Defaults to None.
+        """
+        self.device_name = device_name
+        self.callback = callback
+        self.progress_callback = progress_callback
+        self.max_concurrent = max(1, max_concurrent)
+        self.verify_hash = verify_hash
+        self.journal = journal
+        self.fan_out_group = fan_out_group
+        self.bundles: List[BundleInstall] = []
+        # package name -> version code before anything was installed
+        self._original_packages: Dict[str, int] = {}
+        self._apk_lock = asyncio.Lock()
+        self._push_lock = asyncio.Lock()
+
+    def _status(self, bundle: BundleInstall, message: str) -> None:
+        self.callback(f"[{bundle.name}] {message}")
+
+    async def install(self, apk_dirs: Iterable[lib.utils.ApkPath]) -> None:
+        """installs the bundles. If one fails the others are stopped and the bundles that
+        didnt finish are removed. If cancelled every bundle is removed. With a journal
+        nothing is removed either way so the next install carries on from here
+
+        Args:
+            apk_dirs (Iterable[ApkPath]): the bundles found with lib.utils.find_install_dirs
+
+        Raises:
+            asyncio.CancelledError: if the install was cancelled. Any cleanup has finished by the time this is raised
+            InsufficientStorageError: if the device doesnt have room for the bundles. Raised before anything is installed
+            Exception: the first error raised by a bundle install
+        """
+        self.bundles = [BundleInstall(apk_dir) for apk_dir in apk_dirs]
+        if not self.bundles:
+            return
+        # fail early before anything is put on the device
+        for bundle in self.bundles:
+            await lib.quest.check_install(self.device_name, bundle.apk_dir)
+            bundle.manifest = self._read_manifest(bundle)
+        await lib.quest.check_storage(
+            self.device_name, [bundle.apk_dir for bundle in self.bundles]
+        )
+        self._original_packages = await self._installed_versions()
+        semaphore = asyncio.Semaphore(self.max_concurrent)
+        tasks = [
+            asyncio.create_task(self._install_bundle(bundle, semaphore))
+            for bundle in self.bundles
+        ]
+        try:
+            # gather raises the first error but leaves the other tasks running
+            await asyncio.gather(*tasks)
+            # the free storage has changed
+            lib.quest.device_info_cache.invalidate(self.device_name)
+        except BaseException as err:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            cancelled = isinstance(err, asyncio.CancelledError)
+            if self.journal is None:
+                # shield the cleanup so a second cancel cant leave half a bundle on the device
+                await asyncio.shield(self.cleanup(include_completed=cancelled))
+            elif cancelled:
+                self.callback("Install cancelled. Install again to carry on from here")
+            else:
+                self.callback("Install stopped. Install again to carry on from here")
+            lib.quest.device_info_cache.invalidate(self.device_name)
+            raise
+        finally:
+            if self.journal:
+                # the steps so far are on disk before anyone reads the journal again
+                await asyncio.shield(self.journal.async_flush())
+
+    async def _install_bundle(
+        self, bundle: BundleInstall, semaphore: asyncio.Semaphore
+    ) -> None:
+        async with semaphore:
+            total_size = lib.utils.get_folder_size(bundle.apk_dir.root)
+            formatted_size = lib.utils.format_size(float(total_size))
+            self._status(bundle, f"Waiting to install. Total Size: {formatted_size}")
+            if self._resume_apk(bundle):
+                self._status(bundle, "Apk was installed by an earlier attempt")
+            elif self._same_version_installed(bundle):
+                manifest = bundle.manifest
+                version = "The same version"
+                if manifest is not None:
+                    version = (
+                        f"Version {manifest.version_name or manifest.version_code}"
+                    )
+                self._status(
+                    bundle, f"{version} is already installed. Skipping the apk"
+                )
+            else:
+                await self._install_apk(bundle)
+            if bundle.apk_dir.data_dirs or bundle.apk_dir.file_paths:
+                self._status(bundle, "Waiting to copy data files")
+                async with self._push_lock:
+                    self._status(bundle, "Copying data files. Do not disconnect device")
+                    pushed = await lib.quest.push_obb_files(
+                        self.device_name,
+                        bundle.apk_dir,
+                        self.progress_callback,
+                        on_push_started=bundle.remote_paths.append,
+                        verify_hash=self.verify_hash,
+                        fan_out_group=self.fan_out_group,
+                    )
+                self._status(bundle, lib.quest.format_push_totals(pushed))
+            bundle.completed = True
+            if self.journal:
+                self.journal.finish_bundle(self.device_name, bundle.apk_dir.path)
+            self._status(bundle, "Installed")
+
+    async def _installed_versions(self) -> Dict[str, int]:
+        """the packages on the device and their version codes from one listing"""
+        lines = await adb_interface.get_installed_packages(
+            self.device_name, ["--show-versioncode"]
+        )
+        return dict(lib.package_cache.parse_package_line(line) for line in lines)
+
+    def _read_manifest(self, bundle: BundleInstall) -> ApkManifest | None:
+        try:
+            return read_manifest(bundle.apk_dir.path)
+        except ManifestError as err:
+            _Log.warning(err.__str__())
+            return None
+
+    def _same_version_installed(self, bundle: BundleInstall) -> bool:
+        """the package of the apk is on the device with the same version code"""
+        if bundle.manifest is None:
+            return False
+        version_code = self._original_packages.get(bundle.manifest.package)
+        return version_code == bundle.manifest.version_code
+
+    def _resume_apk(self, bundle: BundleInstall) -> bool:
+        """starts the journal record for the bundle
+
+        Returns:
+            bool: True if an earlier attempt installed the apk and the package is still on
+            the device
+        """
+        if self.journal is None:
+            return False
+        record = self.journal.start_bundle(self.device_name, bundle.apk_dir.path)
+        if not record.apk_installed or not record.packages:
+            return False
+        if any(pkg not in self._original_packages for pkg in record.packages):
+            return False
+        bundle.packages = record.packages
+        return True
+
+    async def _install_apk(self, bundle: BundleInstall) -> None:
+        async with self._apk_lock:
+            self._status(bundle, "Installing apk")
+            if bundle.manifest is not None:
+                # an update to a package that was already there isnt removed on cancel
+                package = bundle.manifest.package
+                if package not in self._original_packages:
+                    bundle.packages = [package]
+                # apk progress isnt forwarded as it would fight with the data pushes over the gauge
+                await adb_interface.install_apk(
+                    self.device_name,
+                    apk_path=bundle.apk_dir.path,
+                    split_paths=bundle.apk_dir.split_paths,
+                )
+            else:
+                await self._install_apk_and_compare(bundle)
+        if self.journal:
+            self.journal.apk_installed(
+                self.device_name, bundle.apk_dir.path, bundle.packages
+            )
+        self._status(bundle, "Apk installed")
+
+    async def _install_apk_and_compare(self, bundle: BundleInstall) -> None:
+        """installs an apk without a readable manifest. Installs are one at a time so any
+        new package belongs to this bundle"""
+        before = await adb_interface.get_installed_packages(self.device_name)
+        try:
+            # apk progress isnt forwarded as it would fight with the data pushes over the gauge
+            await adb_interface.install_apk(
+                self.device_name,
+                apk_path=bundle.apk_dir.path,
+                split_paths=bundle.apk_dir.split_paths,
+            )
+        finally:
+            after = await asyncio.shield(
+                adb_interface.get_installed_packages(self.device_name)
+            )
+            bundle.packages = [pkg for pkg in after if pkg not in before]
+
+    async def cleanup(self, include_completed: bool = True) -> None:
+        """removes the packages and data files from the bundles that were started. Errors
+        are passed to the callback and skipped over
+
+        Args:
+            include_completed (bool, optional): also remove bundles that finished installing. Defaults to True.
+        """
+        handled_packages: List[str] = []
+        packages: List[str] = []
+        remote_paths: List[str] = []
+        for bundle in self.bundles:
+            handled_packages.extend(bundle.packages)
+            if bundle.completed and not include_completed:
+                continue
+            packages.extend(bundle.packages)
+            remote_paths.extend(bundle.remote_paths)
+            bundle.packages = []
+            bundle.remote_paths = []
+            # nothing is left on the device to resume
+            if self.journal:
+                self.journal.finish_bundle(self.device_name, bundle.apk_dir.path)
+        installed = await adb_interface.get_installed_packages(self.device_name)
+        # a package from a manifest may not have got as far as being installed
+        packages = [package for package in packages if package in installed]
+        if any(bundle.manifest is None for bundle in self.bundles):
+            # an apk that was fully streamed before the cancel can still finish
+            # installing after its package list was taken so look for anything else new
+            for package in installed:
+                if (
+                    package not in self._original_packages
+                    and package not in handled_packages
+                    and package not in packages
+                ):
+                    packages.append(package)
+        if packages:
+            self.callback(f"Removing {', '.join(packages)}")
+            errors = await adb_interface.uninstall_packages(self.device_name, packages)
+            for package, err in errors.items():
+                if err is not None:
+                    self.callback(f"Error uninstalling {package}: {err.__str__()}")
+        if remote_paths:
+            self.callback(f"Removing {', '.join(remote_paths)}")
+            # every path in one shell session
+            results = await adb_interface.async_shell_batch(
+                self.device_name, [["rm", "-r", path] for path in remote_paths]
+            )
+            for result in results:
+                if result.returncode != 0:
+                    err = RemoteDeviceError(result)
+                    _Log.error(err.__str__())
+                    self.callback(f"Error removing: {err.__str__()}")
@@ -0,0 +1,358 @@
+"""
+orchestrator.py
+
+installs one download onto many headsets at the same time. Each headset gets its own
+ConcurrentInstaller and is retried on its own so one bad cable doesnt hold up the rest
+
+headsets plugged into the same USB hub share its bandwidth. Only a few of them are
+installed to at once so each one gets a useful share instead of all of them crawling.
+The hub is taken from the usb: path adb devices -l reports ie. 1-4.2 is port 2 of the
+hub on port 4 of bus 1
+
+the headsets that reach the data files of a bundle around the same time push them
+together through a FanOutGroup so each file is read from disk once for all of them
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List
+
+import adblib.adb_interface as adb_interface
+import lib.installer
+import lib.quest
+import lib.utils
+from adblib import retry
+from adblib.adb_sync import TransferProgress
+from adblib.errors import RemoteDeviceError
+from adblib.fan_out import FanOutGroup
+from lib.install_journal import InstallJournal
+
+_Log = logging.getLogger()
+
+# headsets installed to at the same time
+DEFAULT_MAX_CONCURRENT_DEVICES = 4
+
+# headsets on the same hub installed to at the same time
+DEFAULT_MAX_DEVICES_PER_HUB = 2
+
+# attempts at each headset before it is given up on
+DEFAULT_MAX_ATTEMPTS = 3
+
+# seconds before the first retry. Each retry after waits this much longer again
+DEFAULT_RETRY_DELAY = 5.0
+
+# errors a headset can recover from ie. a dropped connection or a replugged cable
+RETRY_ERRORS = (RemoteDeviceError, ConnectionError, LookupError, asyncio.TimeoutError)
+
+STATUS_WAITING = "waiting"
+STATUS_INSTALLING = "installing"
+STATUS_RETRYING = "retrying"
+STATUS_INSTALLED = "installed"
+STATUS_FAILED = "failed"
+
+
+def usb_hub(usb_path: str) -> str:
+    """the hub a device is plugged into from its usb path
+
+    Args:
+        usb_path (str): the usb: field of adb devices -l ie. 1-4.2
+
+    Returns:
+        str: the path of the hub ie. 1-4. Devices on a root port give their bus ie. usb1.
+        Empty if the path is unknown such as for a wireless device
+    """
+    if "." in usb_path:
+        return usb_path.rpartition(".")[0]
+    if "-" in usb_path:
+        return f"usb{usb_path.partition('-')[0]}"
+    return ""
+
+
+@dataclass
+class DeviceInstallState:
+    """where the install to a single headset has got to"""
+
+    serial: str
+    hub: str
+    status: str = STATUS_WAITING
+    attempts: int = 0
+    # the latest progress of the data files being copied
+    progress: TransferProgress | None = None
+    error: Exception | None = None
+
+
+@dataclass
+class FleetProgress:
+    """the progress of every headset. Passed to the progress callback"""
+
+    devices: List[DeviceInstallState]
+
+    def _count(self, status: str) -> int:
+        return sum(1 for device in self.devices if device.status == status)
+
+    @property
+    def installed(self) -> int:
+        return self._count(STATUS_INSTALLED)
+
+    @property
+    def failed(self) -> int:
+        return self._count(STATUS_FAILED)
+
+    @property
+    def bytes_done(self) -> int:
+        """bytes copied or skipped across the headsets"""
+        return sum(
+            device.progress.bytes_sent + device.progress.bytes_skipped
+            for device in self.devices
+            if device.progress
+        )
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(
+            device.progress.total_bytes for device in self.devices if device.progress
+        )
+
+    @property
+    def throughput(self) -> float:
+        """bytes per second across the headsets still copying"""
+        return sum(
+            device.progress.throughput
+            for device in self.devices
+            if device.progress and device.status == STATUS_INSTALLING
+        )
+
+    def _copying(self) -> List[TransferProgress]:
+        return [
+            device.progress
+            for device in self.devices
+            if device.progress and device.status == STATUS_INSTALLING
+        ]
+
+    @property
+    def rate(self) -> float:
+        """bytes per second across the headsets still copying since their last report"""
+        return sum(progress.rate for progress in self._copying())
+
+    @property
+    def smoothed_rate(self) -> float:
+        return sum(progress.smoothed_rate for progress in self._copying())
+
+    @property
+    def eta(self) -> float | None:
+        """seconds until the slowest headset still copying finishes at its smoothed rate.
+        None until every one of them has a rate"""
+        etas = [progress.eta for progress in self._copying()]
+        if not etas or None in etas:
+            return None
+        return max(eta for eta in etas if eta is not None)
+
+    @property
+    def percent(self) -> float:
+        """headsets that have finished count as done whatever they copied"""
+        if not self.devices:
+            return 100.0
+        total = 0.0
+        for device in self.devices:
+            if device.status in (STATUS_INSTALLED, STATUS_FAILED):
+                total += 100.0
+            elif device.progress:
+                total += device.progress.percent
+        return total / len(self.devices)
+
+
+FleetProgressFunction = Callable[[FleetProgress], None]
+
+
+class InstallOrchestrator:
+    def __init__(
+        self,
+        device_names: Iterable[str],
+        callback: lib.quest.InstallStatusFunction,
+        progress_callback: FleetProgressFunction | None = None,
+        max_concurrent_devices: int = DEFAULT_MAX_CONCURRENT_DEVICES,
+        max_devices_per_hub: int = DEFAULT_MAX_DEVICES_PER_HUB,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        retry_delay: float = DEFAULT_RETRY_DELAY,
+        max_concurrent_bundles: int = lib.installer.DEFAULT_MAX_CONCURRENT_INSTALLS,
+        verify_hash: bool = False,
+        journal: InstallJournal | None = None,
+    ) -> None:
+        """installs the same apk bundles onto every headset
+
+        Args:
+            device_names (Iterable[str]): the serials of the headsets to install to
+            callback (InstallStatusFunction): recieves the status lines. Each line starts with
+            the serial of the headset it belongs to
+            progress_callback (FleetProgressFunction, optional): recieves the progress of
+            every headset. Defaults to None.
+            max_concurrent_devices (int, optional): headsets installed to at once. Defaults to DEFAULT_MAX_CONCURRENT_DEVICES.
+            max_devices_per_hub (int, optional): headsets on the same hub installed to at once. Defaults to DEFAULT_MAX_DEVICES_PER_HUB.
+            max_attempts (int, optional): attempts at each headset. Defaults to DEFAULT_MAX_ATTEMPTS.
+            retry_delay (float, optional): seconds before the first retry. Defaults to DEFAULT_RETRY_DELAY.
+            max_concurrent_bundles (int, optional): bundles in progress at once on each headset. Defaults to DEFAULT_MAX_CONCURRENT_INSTALLS.
+            verify_hash (bool, optional): compare the md5 of data files already on the
+            headsets before skipping them. Defaults to False.
+            journal (InstallJournal, optional): lets a retry carry on from where the failed
+            attempt got to. Without one a failed attempt is removed first. Defaults to None.
+        """
+        # keep the order but drop repeats
+        self.device_names = list(dict.fromkeys(device_names))
+        self.callback = callback
+        self.progress_callback = progress_callback
+        self.max_concurrent_devices = max(1, max_concurrent_devices)
+        self.max_devices_per_hub = max(1, max_devices_per_hub)
+        self.max_attempts = max(1, max_attempts)
+        self.retry_delay = retry_delay
+        self.max_concurrent_bundles = max_concurrent_bundles
+        self.verify_hash = verify_hash
+        self.journal = journal
+        self.devices: Dict[str, DeviceInstallState] = {}
+        self.fan_out_group: FanOutGroup | None = None
+        self._running = 0
+
+    def _status(self, device: DeviceInstallState, message: str) -> None:
+        self.callback(f"[{device.serial}] {message}")
+
+    def _report(self) -> None:
+        if self.progress_callback:
+            self.progress_callback(FleetProgress(list(self.devices.values())))
+
+    def _set_status(self, device: DeviceInstallState, status: str) -> None:
+        device.status = status
+        self._report()
+
+    def _device_progress(
+        self, device: DeviceInstallState, progress: TransferProgress
+    ) -> None:
+        device.progress = progress
+        self._report()
+
+    def _set_running(self, change: int) -> None:
+        """counts the headsets installing. Pushes of the same data files wait for them"""
+        self._running += change
+        if self.fan_out_group is not None:
+            self.fan_out_group.set_expected(self._running)
+
+    async def _find_hubs(self) -> Dict[str, str]:
+        """the hub of each headset. Headsets whose hub cant be found are on their own"""
+        try:
+            connected = await adb_interface.async_get_devices()
+        except Exception as err:
+            _Log.error(f"Unable to find the usb hubs. {err.__str__()}")
+            connected = []
+        usb_paths = {device.serial: device.usb for device in connected}
+        return {
+            serial: usb_hub(usb_paths.get(serial, "")) or serial
+            for serial in self.device_names
+        }
+
+    async def install(
+        self, apk_dirs: Iterable[lib.utils.ApkPath]
+    ) -> Dict[str, Exception | None]:
+        """installs the bundles onto every headset. A headset that fails is retried on its
+        own and doesnt stop the others. If cancelled every headset is cancelled and either
+        cleans up after itself or is left to resume when there is a journal
+
+        Args:
+            apk_dirs (Iterable[ApkPath]): the bundles found with lib.utils.find_install_dirs.
+            They are only scanned once for every headset
+
+        Raises:
+            asyncio.CancelledError: if the install was cancelled. Any cleanup has finished by the time this is raised
+
+        Returns:
+            Dict[str, Exception | None]: the serial of each headset and the error that made
+            it give up or None if it installed
+        """
+        bundles = list(apk_dirs)
+        hubs = await self._find_hubs()
+        self.devices = {
+            serial: DeviceInstallState(serial, hubs[serial])
+            for serial in self.device_names
+        }
+        self._report()
+        device_slots = asyncio.Semaphore(self.max_concurrent_devices)
+        hub_slots = {
+            hub: asyncio.Semaphore(self.max_devices_per_hub)
+            for hub in set(hubs.values())
+        }
+        # grows and shrinks with the headsets installing so a push doesnt wait for
+        # headsets that cant join it
+        self.fan_out_group = FanOutGroup(0) if len(self.devices) > 1 else None
+        self._running = 0
+        tasks = [
+            asyncio.create_task(
+                self._install_device(
+                    device, bundles, device_slots, hub_slots[device.hub]
+                )
+            )
+            for device in self.devices.values()
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        return {serial: device.error for serial, device in self.devices.items()}
+
+    async def _install_device(
+        self,
+        device: DeviceInstallState,
+        bundles: List[lib.utils.ApkPath],
+        device_slots: asyncio.Semaphore,
+        hub_slot: asyncio.Semaphore,
+    ) -> None:
+        while True:
+            device.attempts += 1
+            # the slots are given back while waiting to retry so another headset can go
+            async with hub_slot, device_slots:
+                self._set_running(1)
+                self._set_status(device, STATUS_INSTALLING)
+                installer = lib.installer.ConcurrentInstaller(
+                    device.serial,
+                    lambda message: self._status(device, message),
+                    lambda progress: self._device_progress(device, progress),
+                    max_concurrent=self.max_concurrent_bundles,
+                    verify_hash=self.verify_hash,
+                    journal=self.journal,
+                    fan_out_group=self.fan_out_group,
+                )
+                try:
+                    await installer.install(bundles)
+                except RETRY_ERRORS as err:
+                    device.error = err
+                    _Log.error(f"Install to {device.serial} failed. {err.__str__()}")
+                    if retry.classify(err) == retry.PERMANENT:
+                        # the same thing would happen again
+                        self._status(device, f"Install failed: {err.__str__()}")
+                        self._set_status(device, STATUS_FAILED)
+                        return
+                except Exception as err:
+                    device.error = err
+                    self._status(device, f"Install failed: {err.__str__()}")
+                    self._set_status(device, STATUS_FAILED)
+                    return
+                else:
+                    device.error = None
+                    self._set_status(device, STATUS_INSTALLED)
+                    return
+                finally:
+                    self._set_running(-1)
+            if device.attempts >= self.max_attempts:
+                self._status(
+                    device,
+                    f"Install failed after {device.attempts} attempt(s): {device.error.__str__()}",
+                )
+                self._set_status(device, STATUS_FAILED)
+                return
+            delay = self.retry_delay * device.attempts
+            self._status(
+                device,
+                f"Install failed: {device.error.__str__()}. Trying again in {delay:.0f}s",
+            )
+            self._set_status(device, STATUS_RETRYING)
+            await asyncio.sleep(delay)
@@ -0,0 +1,192 @@
+"""
+package_cache.py
+
+remembers the third party packages installed on each device and their version codes so
+the installed list can be shown straight away when a device connects. The list on the
+device is then read in the background and only the packages that changed are updated
+
+the cache is a json file keyed by device serial. It is written the same way as the
+install journal so a crash part way through a write leaves the previous cache intact
+"""
+
+import asyncio
+import json
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+import adblib.adb_interface as adb_interface
+import lib.config
+import lib.utils
+
+_Log = logging.getLogger()
+
+CACHE_VERSION = 1
+
+# the packages the installed list shows
+PACKAGE_LIST_OPTIONS = ["-3", "--show-versioncode"]
+
+
+@dataclass
+class PackageDiff:
+    """the packages that changed between two listings of a device"""
+
+    added: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    # still installed with a different version code
+    updated: List[str] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.updated)
+
+
+def parse_package_line(line: str) -> Tuple[str, int]:
+    """splits a line of pm list packages --show-versioncode
+
+    Args:
+        line (str): the line with package: taken off ie. com.fake.game versionCode:42
+
+    Returns:
+        Tuple[str, int]: the package name and its version code. The version code is 0 if
+        the line doesnt have one
+    """
+    name, _, version = line.strip().partition(" versionCode:")
+    try:
+        version_code = int(version)
+    except ValueError:
+        version_code = 0
+    return name.strip(), version_code
+
+
+def diff_packages(old: Dict[str, int], new: Dict[str, int]) -> PackageDiff:
+    """compares two listings of a device. Each list in the diff is sorted
+
+    Args:
+        old (Dict[str, int]): the package names and version codes before
+        new (Dict[str, int]): the package names and version codes after
+
+    Returns:
+        PackageDiff:
+    """
+    return PackageDiff(
+        added=sorted(name for name in new if name not in old),
+        removed=sorted(name for name in old if name not in new),
+        updated=sorted(
+            name
+            for name, version in new.items()
+            if name in old and old[name] != version
+        ),
+    )
+
+
+class PackageCache:
+    def __init__(self, path: str = lib.config.APP_PACKAGE_CACHE_PATH) -> None:
+        """the packages last seen on each device. Use PackageCache.load to read the cache
+        from disk. Safe to use from any thread
+
+        Args:
+            path (str, optional): the cache file. Defaults to lib.config.APP_PACKAGE_CACHE_PATH.
+        """
+        self.path = path
+        # device serial -> package name -> version code
+        self._devices: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def load(path: str = lib.config.APP_PACKAGE_CACHE_PATH) -> "PackageCache":
+        """reads the cache. A missing or unreadable cache gives an empty one
+
+        Args:
+            path (str, optional): the cache file. Defaults to lib.config.APP_PACKAGE_CACHE_PATH.
+
+        Returns:
+            PackageCache:
+        """
+        cache = PackageCache(path)
+        try:
+            with open(path, "r") as fp:
+                data = json.load(fp)
+            if data.get("version") != CACHE_VERSION:
+                raise ValueError(f"unknown cache version {data.get('version')}")
+            for serial, packages in data.get("devices", {}).items():
+                cache._devices[serial] = {
+                    name: int(version) for name, version in packages.items()
+                }
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, TypeError, AttributeError) as err:
+            _Log.error(f"Package cache {path} could not be read. {err.__str__()}")
+            cache._devices = {}
+        return cache
+
+    def _save(self) -> None:
+        """writes the cache. Call with the lock held"""
+        data = {"version": CACHE_VERSION, "devices": self._devices}
+        try:
+            lib.utils.write_file_atomic(self.path, json.dumps(data, indent=2))
+        except OSError as err:
+            # the cache only saves time. The list is still read from the device
+            _Log.error(
+                f"Package cache {self.path} could not be written. {err.__str__()}"
+            )
+
+    def get(self, serial: str) -> Dict[str, int] | None:
+        """gets a copy of the packages last seen on the device
+
+        Returns:
+            Dict[str, int] | None: the package names and version codes. None if the device
+            hasnt been listed before
+        """
+        with self._lock:
+            packages = self._devices.get(serial)
+            return None if packages is None else dict(packages)
+
+    def update(self, serial: str, packages: Dict[str, int]) -> PackageDiff:
+        """replaces the packages of the device. The cache is only written if they changed
+
+        Args:
+            serial (str): the device that was listed
+            packages (Dict[str, int]): the package names and version codes on the device
+
+        Returns:
+            PackageDiff: what changed since the device was last listed
+        """
+        with self._lock:
+            old = self._devices.get(serial)
+            diff = diff_packages(old or {}, packages)
+            if old is None or diff:
+                self._devices[serial] = dict(packages)
+                self._save()
+            return diff
+
+    def forget(self, serial: str) -> None:
+        """removes the device from the cache"""
+        with self._lock:
+            if self._devices.pop(serial, None) is not None:
+                self._save()
+
+    async def refresh(self, serial: str) -> PackageDiff:
+        """reads the packages from the device a line at a time and updates the cache
+
+        Args:
+            serial (str): the device to list
+
+        Raises:
+            RemoteDeviceError: if pm failed
+
+        Returns:
+            PackageDiff: what changed since the device was last listed
+        """
+        packages: Dict[str, int] = {}
+        async for line in adb_interface.get_package_generator(
+            serial, PACKAGE_LIST_OPTIONS
+        ):
+            if not line:
+                continue
+            name, version_code = parse_package_line(line)
+            packages[name] = version_code
+        # the write is flushed to disk which would hold up the event loop
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.update, serial, packages
+        )
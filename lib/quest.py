@@ -2,11 +2,23 @@ import asyncio
 import logging
 import os
 import queue
+import re
 import shutil
 import threading
-from typing import Callable, List
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Tuple
 
 import adblib.adb_interface as adb_interface
+from adblib.adb_client import AdbDevice
+from adblib.adb_sync import (
+    FileSyncedFunction,
+    RateMeter,
+    TransferProgress,
+    TransferProgressFunction,
+)
+from adblib.errors import RemoteDeviceError
+from adblib.fan_out import FanOutGroup
 import lib.config
 import lib.utils
 import lib.debug as debug
@@ -16,6 +28,266 @@ InstallStatusFunction = Callable[[str], None]
 
 _Log = logging.getLogger()
 
+# how often the device list is polled when the adb server isnt streaming device changes
+DEVICE_POLL_INTERVAL = 3.0
+
+# seconds a device info snapshot is used before the device is asked again
+DEVICE_INFO_TTL = 30.0
+
+# bytes left free on top of what an install needs. The package manager copies and
+# optimises the apk before the old copy is removed
+STORAGE_HEADROOM = 256 * 1024**2
+
+# the packages named when there isnt enough space for an install and none of them
+# would free enough on their own
+MAX_REMOVAL_SUGGESTIONS = 5
+
+# getprop prints each property as [key]: [value]
+_GETPROP_PATTERN = re.compile(r"^\[(.+?)\]: \[(.*)\]$", re.MULTILINE)
+
+
+@dataclass
+class DeviceInfo:
+    """a snapshot of a device. Sizes are in bytes"""
+
+    serial: str
+    properties: Dict[str, str] = field(default_factory=dict)
+    storage_total: int = 0
+    storage_free: int = 0
+    battery_level: int | None = None
+    obb_dir_exists: bool = False
+    updated: float = field(default_factory=time.monotonic)
+
+    @property
+    def model(self) -> str:
+        return self.properties.get("ro.product.model", "")
+
+    @property
+    def android_version(self) -> str:
+        return self.properties.get("ro.build.version.release", "")
+
+    def age(self) -> float:
+        """seconds since the snapshot was taken"""
+        return time.monotonic() - self.updated
+
+
+def parse_df_output(df_output: str) -> Tuple[int, int] | None:
+    """reads the size and free space of the last filesystem df -k listed
+
+    Args:
+        df_output (str): output of df -k <path>
+
+    Returns:
+        Tuple[int, int] | None: the total and free bytes. None if the output couldnt be read
+    """
+    # Filesystem 1K-blocks Used Available Use% Mounted on
+    df_lines = df_output.strip().splitlines()
+    if len(df_lines) < 2:
+        return None
+    columns = df_lines[-1].split()
+    try:
+        return int(columns[1]) * 1024, int(columns[3]) * 1024
+    except (IndexError, ValueError):
+        return None
+
+
+def parse_du_output(du_output: str) -> Dict[str, int]:
+    """reads the sizes du -k printed
+
+    Args:
+        du_output (str): output of du -k. Each line is the size in KiB, a tab and the path
+
+    Returns:
+        Dict[str, int]: the paths and their sizes in bytes
+    """
+    sizes: Dict[str, int] = {}
+    for line in du_output.splitlines():
+        size, _, path = line.partition("\t")
+        try:
+            sizes[path.strip()] = int(size) * 1024
+        except ValueError:
+            continue
+    return sizes
+
+
+def parse_device_info(
+    serial: str,
+    getprop_output: str,
+    df_output: str,
+    battery_output: str,
+    obb_dir_exists: bool,
+) -> DeviceInfo:
+    """builds the snapshot from the device info shell batch
+
+    Args:
+        serial (str): the device the output came from
+        getprop_output (str): output of getprop with no arguments
+        df_output (str): output of df -k /sdcard
+        battery_output (str): output of dumpsys battery
+        obb_dir_exists (bool): whether the OBB directory test passed
+
+    Returns:
+        DeviceInfo:
+    """
+    info = DeviceInfo(serial, dict(_GETPROP_PATTERN.findall(getprop_output)))
+    info.obb_dir_exists = obb_dir_exists
+    storage = parse_df_output(df_output)
+    if storage is None:
+        _Log.warning(f"Unable to parse df output from {serial}: {df_output.strip()}")
+    else:
+        info.storage_total, info.storage_free = storage
+    level = re.search(r"^\s*level: (\d+)", battery_output, re.MULTILINE)
+    if level:
+        info.battery_level = int(level.group(1))
+    return info
+
+
+class DeviceInfoCache:
+    def __init__(self, ttl: float = DEVICE_INFO_TTL) -> None:
+        """keeps a snapshot of each devices properties, storage and battery so the UI and
+        the installer dont have to keep asking the device. Safe to use from any thread
+
+        Args:
+            ttl (float, optional): seconds before a snapshot is refreshed. Defaults to DEVICE_INFO_TTL.
+        """
+        self.ttl = ttl
+        self._entries: Dict[str, DeviceInfo] = {}
+        self._lock = threading.Lock()
+
+    def peek(self, serial: str) -> DeviceInfo | None:
+        """gets the snapshot without asking the device even if it has expired
+
+        Returns:
+            DeviceInfo | None: None if the device has no snapshot
+        """
+        with self._lock:
+            return self._entries.get(serial)
+
+    async def async_get(self, serial: str, refresh: bool = False) -> DeviceInfo:
+        """gets the snapshot of the device. Asks the device if there isnt one or it has expired
+
+        Args:
+            serial (str): the device to get
+            refresh (bool, optional): ask the device even if the snapshot hasnt expired. Defaults to False.
+
+        Raises:
+            RemoteDeviceError: if the device couldnt be reached
+
+        Returns:
+            DeviceInfo:
+        """
+        info = self.peek(serial)
+        if info is not None and not refresh and info.age() < self.ttl:
+            return info
+        getprop, df, battery, obb_dir = await adb_interface.async_shell_batch(
+            serial,
+            [
+                ["getprop"],
+                ["df", "-k", lib.config.QUEST_ROOT],
+                ["dumpsys", "battery"],
+                ["test", "-d", lib.config.QUEST_OBB_DIRECTORY],
+            ],
+            idempotent=True,
+        )
+        if getprop.returncode != 0:
+            raise RemoteDeviceError(getprop)
+        info = parse_device_info(
+            serial,
+            getprop.stdout.decode("utf-8", errors="replace"),
+            df.stdout.decode("utf-8", errors="replace"),
+            battery.stdout.decode("utf-8", errors="replace"),
+            obb_dir.returncode == 0,
+        )
+        with self._lock:
+            self._entries[serial] = info
+        return info
+
+    def get(self, serial: str, refresh: bool = False) -> DeviceInfo:
+        """same as async_get but blocks until the device has replied"""
+        return adb_interface.run_sync(self.async_get(serial, refresh))
+
+    def set_obb_dir_exists(self, serial: str) -> None:
+        """records that the OBB directory has been created on the device"""
+        with self._lock:
+            info = self._entries.get(serial)
+            if info is not None:
+                info.obb_dir_exists = True
+
+    def invalidate(self, serial: str) -> None:
+        """forgets the snapshot so the next get asks the device. Call after anything that
+        changes the storage on the device"""
+        with self._lock:
+            self._entries.pop(serial, None)
+
+    def retain(self, serials: List[str]) -> None:
+        """forgets every device not in serials. Called when devices are disconnected"""
+        with self._lock:
+            for serial in list(self._entries):
+                if serial not in serials:
+                    del self._entries[serial]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+# shared by the device monitor, the installer and the UI
+device_info_cache = DeviceInfoCache()
+
+
+class DeviceTracker(threading.Thread):
+    def __init__(
+        self,
+        callback: Callable[[List[AdbDevice] | None], None],
+        retry_interval: float = DEVICE_POLL_INTERVAL,
+    ) -> None:
+        """keeps a host:track-devices-l connection open to the adb server and passes
+        every device list the server sends to the callback. If the stream drops the
+        callback gets None and the tracker keeps trying to reconnect
+
+        Args:
+            callback (Callable[[List[AdbDevice] | None], None]): gets the device list or None when the stream is lost
+            retry_interval (float, optional): seconds to wait before reconnecting. Defaults to DEVICE_POLL_INTERVAL.
+        """
+        super().__init__(name="device-tracker", daemon=True)
+        self._callback = callback
+        self._retry_interval = retry_interval
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._task: asyncio.Task | None = None
+
+    def run(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        self._task = self._loop.create_task(self._track())
+        try:
+            self._loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._loop.close()
+
+    async def _track(self) -> None:
+        tracking = False
+        while True:
+            try:
+                async for devices in adb_interface.track_devices():
+                    tracking = True
+                    self._callback(devices)
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                _Log.debug(f"device tracking unavailable: {err.__str__()}")
+            if tracking:
+                _Log.info("device tracking stream dropped. Polling until it reconnects")
+                tracking = False
+                self._callback(None)
+            await asyncio.sleep(self._retry_interval)
+
+    def stop(self) -> None:
+        """cancels the tracking task and waits for the thread to finish"""
+        if self._loop is not None and self._task is not None:
+            self._loop.call_soon_threadsafe(self._task.cancel)
+        self.join()
+
 
 class MonitorQuestDevices(threading.Thread):
     def __init__(self, callback: Callable[[dict], None], debug_mode: bool) -> None:
@@ -37,6 +309,8 @@ class MonitorQuestDevices(threading.Thread):
         self.__selected_device = ""
         # keep the device selection thread safe
         self.__device_selection_lock = threading.Lock()
+        # the quest devices from the adb server stream. None when not streaming
+        self._tracked_device_names: List[str] | None = None
 
     def __process_message_request(self, msg: dict) -> bool:
         """handles the message request from the queue
@@ -46,7 +320,8 @@ class MonitorQuestDevices(threading.Thread):
 
             request: "stop" - stops the thread,
                      "selected-device" - sets the selected device,
-                     "device-names-reset" - resets the prev_device_names
+                     "device-names-reset" - resets the prev_device_names,
+                     "tracked-devices" - device list streamed from the adb server. None if the stream dropped
 
         Returns:
             bool: True if the request was handled
@@ -66,6 +341,13 @@ class MonitorQuestDevices(threading.Thread):
         elif msg["request"] == "device-names-reset":
             self._prev_device_names.clear()
             return True
+        elif msg["request"] == "tracked-devices":
+            devices: List[AdbDevice] | None = msg["devices"]
+            if devices is None:
+                self._tracked_device_names = None
+            else:
+                self._tracked_device_names = filter_quest_devices(devices)
+            return True
         else:
             return False
 
@@ -74,9 +356,21 @@ class MonitorQuestDevices(threading.Thread):
         self._event_loop = asyncio.new_event_loop()
 
         self._prev_device_names: List[str] = []
+        tracker: DeviceTracker | None = None
+        if not self._debug_mode:
+            tracker = DeviceTracker(
+                lambda devices: self._queue.put_nowait(
+                    {"request": "tracked-devices", "devices": devices}
+                )
+            )
+            tracker.start()
         while self._stop_event.is_set() is False:
+            # while the adb server is streaming device changes there is no need to poll
+            timeout: float | None = DEVICE_POLL_INTERVAL
+            if self._tracked_device_names is not None:
+                timeout = None
             try:
-                msg: dict = self._queue.get(timeout=3, block=True)
+                msg: dict = self._queue.get(timeout=timeout, block=True)
             except queue.Empty:
                 pass
             else:
@@ -85,7 +379,10 @@ class MonitorQuestDevices(threading.Thread):
                 # if selected_device is non empty string then check device is in list
                 # retrieved from get_device_names(). Also store a prev_device_names
                 # and compare prev_device_names to current_device_names using sets
-                device_names = self.get_device_names()
+                if self._tracked_device_names is not None:
+                    device_names: List[str] | None = list(self._tracked_device_names)
+                else:
+                    device_names = self.get_device_names()
                 if device_names is not None:
                     self._handle_device_names_changed(device_names)
                 if not self.get_selected_device():
@@ -95,8 +392,11 @@ class MonitorQuestDevices(threading.Thread):
                     and self.get_selected_device() not in device_names
                 ):
                     _Log.debug(f"{self.get_selected_device()} is not connected")
+                    device_info_cache.invalidate(self.get_selected_device())
                     self.__set_selected_device("")
                     self._callback({"event": "device-disconnected"})
+        if tracker is not None:
+            tracker.stop()
         self._event_loop.close()
         del self._event_loop
 
@@ -114,6 +414,8 @@ class MonitorQuestDevices(threading.Thread):
             return False
         _Log.info("device names have changed")
         self._prev_device_names = device_names
+        # the snapshots of disconnected devices are out of date if they come back
+        device_info_cache.retain(device_names)
         self._callback({"event": "device-names-changed", "device-names": device_names})
         return True
 
@@ -125,23 +427,18 @@ class MonitorQuestDevices(threading.Thread):
         Returns:
             List[str]: list of device names if exception then None
         """
-        device_names: List[str] | None = None
         if self._debug_mode:
-            device_names = debug.get_device_names(debug.FakeQuest.devices)
-            return device_names
+            # debug mode no need to filter
+            return debug.get_device_names(debug.FakeQuest.devices)
         try:
-            device_names = adb_interface.get_device_names()
+            # a single adb devices -l has the model of every device
+            devices = adb_interface.get_devices()
         except Exception as err:
             _Log.error(err.__str__() + " - MonitorSelectedDevice.get_device_names()")
             self._callback({"event": "error", "exception": err})
-            device_names = None
-        finally:
-            if device_names is not None and not self._debug_mode:
-                # filter out the non quest devices
-                quest_device_names = filter_quest_device_names(device_names)
-                return quest_device_names
-            # debug mode no need to filter
-            return device_names
+            return None
+        # filter out the non quest devices
+        return filter_quest_devices(devices)
 
     def send_message_no_block(self, message: dict) -> None:
         """sends a message to the thread without non blocking
@@ -231,13 +528,33 @@ def create_obb_path(
     Returns:
         bool: True if new directory created or False if no directory was created
     """
+    return adb_interface.run_sync(async_create_obb_path(device_name, obb_path))
 
-    obb_path_exists = adb_interface.path_exists(device_name=device_name, path=obb_path)
-    if not obb_path_exists:
-        _Log.debug(f"{obb_path} does not exist. Creating new data directory...")
-        adb_interface.make_dir(device_name=device_name, path=obb_path)
-        _Log.debug(f"{obb_path} created successfully")
-    return not obb_path_exists
+
+async def async_create_obb_path(
+    device_name: str, obb_path: str = lib.config.QUEST_OBB_DIRECTORY
+) -> bool:
+    """same as create_obb_path but doesnt block the event loop"""
+    is_quest_obb_dir = obb_path == lib.config.QUEST_OBB_DIRECTORY
+    if (
+        is_quest_obb_dir
+        and (await device_info_cache.async_get(device_name)).obb_dir_exists
+    ):
+        return False
+    # check and create in one go. mkdir -p does nothing if it already exists
+    exists, created = await adb_interface.async_shell_batch(
+        device_name,
+        [["test", "-d", obb_path], ["mkdir", "-p", obb_path]],
+        idempotent=True,
+    )
+    if created.returncode != 0:
+        raise RemoteDeviceError(created)
+    if is_quest_obb_dir:
+        device_info_cache.set_obb_dir_exists(device_name)
+    if exists.returncode == 0:
+        return False
+    _Log.debug(f"{obb_path} created successfully")
+    return True
 
 
 def is_quest_device(device_name: str) -> bool:
@@ -250,9 +567,19 @@ def is_quest_device(device_name: str) -> bool:
         bool: True if the device is a quest device
     """
     model = adb_interface.get_device_model(device_name=device_name)
-    model = model.strip()
-    is_quest = model == "Quest 2"
-    return is_quest
+    return is_quest_model(model)
+
+
+def is_quest_model(model: str) -> bool:
+    """checks the model name is a quest. adb devices -l reports spaces as underscores
+
+    Args:
+        model (str): the model from getprop ro.product.model or adb devices -l
+
+    Returns:
+        bool: True if the model is a quest
+    """
+    return model.strip().replace("_", " ") == "Quest 2"
 
 
 def filter_quest_device_names(device_names: List[str]) -> List[str]:
@@ -267,8 +594,35 @@ def filter_quest_device_names(device_names: List[str]) -> List[str]:
     return [device for device in device_names if is_quest_device(device)]
 
 
+def filter_quest_devices(devices: List[AdbDevice]) -> List[str]:
+    """returns the names of the ready quest devices. Uses the model reported in the
+    long device list so no shell command is needed per device
+
+    Args:
+        devices (List[AdbDevice]): devices from adb devices -l or track-devices-l
+
+    Returns:
+        List[str]: list of quest device names
+    """
+    quest_device_names: List[str] = []
+    for device in devices:
+        if device.state != "device":
+            continue
+        # older adb servers leave the model out so fall back to asking the device
+        if device.model:
+            is_quest = is_quest_model(device.model)
+        else:
+            is_quest = is_quest_device(device.serial)
+        if is_quest:
+            quest_device_names.append(device.serial)
+    return quest_device_names
+
+
 async def install_game(
-    callback: InstallStatusFunction, device_name: str, apk_dir: lib.utils.ApkPath
+    callback: InstallStatusFunction,
+    device_name: str,
+    apk_dir: lib.utils.ApkPath,
+    progress_callback: TransferProgressFunction | None = None,
 ) -> None:
     """installs the APK file and copies any subdirectories onto the Quest devices OBB path
 
@@ -276,6 +630,50 @@ async def install_game(
         callback (InstallStatusFunction): the callback to recieve updates to
         device_name (str): the name of the selected to device to install to
         apk_dir (ApkPath): contains the apk file path, subpaths and subfiles to be pushed onto the remote device
+        progress_callback (TransferProgressFunction, optional): recieves the progress of the
+        apk being streamed and then the data files being copied across all of the OBB paths. Defaults to None.
+
+    Raises:
+        FileNotFoundError: if no apk file can be found
+        ValueError: if device_name is empty string
+        LookupError: could not find the device in the device list. Possible disconnected Quest device
+        InsufficientStorageError: if the device doesnt have room for the bundle
+    """
+    await check_install(device_name, apk_dir)
+    # fail before anything is copied rather than gigabytes into the data files
+    await check_storage(device_name, [apk_dir])
+
+    # get file stats from apk package
+    total_size = lib.utils.get_folder_size(apk_dir.root)
+    formatted_size = lib.utils.format_size(float(total_size))
+    apk_name = os.path.split(apk_dir.path)[-1]
+    message = f"Installing {apk_name}. Total Size: {formatted_size}"
+
+    callback(message)
+
+    await adb_interface.install_apk(
+        device_name,
+        apk_path=apk_dir.path,
+        split_paths=apk_dir.split_paths,
+        progress_callback=progress_callback,
+    )
+    callback(
+        f"Copying data files onto {device_name}. Do not disconnect device. This may take several minutes depending on the size"
+    )
+    pushed = await push_obb_files(device_name, apk_dir, progress_callback)
+    if pushed.files_skipped:
+        callback(format_push_totals(pushed))
+    # the free storage has changed
+    device_info_cache.invalidate(device_name)
+    callback(f"{apk_name} has been installed.\n")
+
+
+async def check_install(device_name: str, apk_dir: lib.utils.ApkPath) -> None:
+    """checks the apk exists and the device is still connected before installing
+
+    Args:
+        device_name (str): the name of the selected to device to install to
+        apk_dir (ApkPath): the apk bundle to be installed
 
     Raises:
         FileNotFoundError: if no apk file can be found
@@ -293,50 +691,323 @@ async def install_game(
     if not device_name in device_names:
         raise LookupError("Device disconnected. Please reconnect device and re-install")
 
-    # get file stats from apk package
-    total_size = lib.utils.get_folder_size(apk_dir.root)
-    formatted_size = lib.utils.format_size(float(total_size))
-    apk_name = os.path.split(apk_dir.path)[-1]
-    message = f"Installing {apk_name}. Total Size: {formatted_size}"
 
-    callback(message)
+async def uninstall_games(
+    device_name: str, package_names: List[str]
+) -> Dict[str, Exception | None]:
+    """removes the packages along with their OBB and data folders in one shell session
 
-    await adb_interface.install_apk(device_name, apk_path=apk_dir.path)
-    callback(
-        f"Copying data files onto {device_name}. Do not disconnect device. This may take several minutes depending on the size"
+    Args:
+        device_name (str): the device to remove the games from
+        package_names (List[str]): the packages to remove
+
+    Raises:
+        RemoteDeviceError: if the shell session itself failed
+
+    Returns:
+        Dict[str, Exception | None]: each package mapped to None if it was removed or the
+        error that stopped it
+    """
+    try:
+        return await adb_interface.uninstall_packages(
+            device_name,
+            package_names,
+            data_dirs=[lib.config.QUEST_OBB_DIRECTORY, lib.config.QUEST_DATA_DIRECTORY],
+        )
+    finally:
+        # the free storage has changed
+        device_info_cache.invalidate(device_name)
+
+
+def get_remote_obb_path(local_path: str) -> str:
+    """the path a data folder or file ends up at once it is copied into the OBB directory
+
+    Args:
+        local_path (str): the local data folder or file
+
+    Returns:
+        str: the remote path on the Quest device
+    """
+    name = os.path.basename(os.path.normpath(local_path))
+    return f"{lib.config.QUEST_OBB_DIRECTORY.rstrip('/')}/{name}"
+
+
+class InsufficientStorageError(Exception):
+    def __init__(
+        self,
+        device_name: str,
+        required: int,
+        free: int,
+        removable: List[Tuple[str, int]],
+        *args: object,
+    ) -> None:
+        super().__init__(*args)
+        self.device_name = device_name
+        self.required = required
+        self.free = free
+        # installed packages and the size of their data files largest first
+        self.removable = removable
+
+    def __str__(self) -> str:
+        message = (
+            f"Not enough storage on {self.device_name}. The install needs "
+            f"{lib.utils.format_size(float(self.required))} but only "
+            f"{lib.utils.format_size(float(self.free))} is free."
+        )
+        if self.removable:
+            packages = ", ".join(
+                f"{package} ({lib.utils.format_size(float(size))})"
+                for package, size in self.removable
+            )
+            message += f" Uninstall {packages} to make room"
+        return message
+
+
+@dataclass
+class StorageCheck:
+    """the space an install needs on the device. Sizes are in bytes"""
+
+    # the apks and the data files that arent on the device yet plus STORAGE_HEADROOM
+    required: int
+    free: int
+    # data files already on the device that will be skipped or written over
+    skippable: int
+
+
+def _local_size(local_path: str) -> int:
+    if os.path.isdir(local_path):
+        return lib.utils.get_folder_size(local_path)
+    return os.path.getsize(local_path)
+
+
+def _choose_removable(
+    folder_sizes: Dict[str, int], packages: List[str], shortfall: int
+) -> List[Tuple[str, int]]:
+    """picks the installed packages with the most data files on the device that
+    together free at least the shortfall"""
+    removable = sorted(
+        (
+            (package, folder_sizes[get_remote_obb_path(package)])
+            for package in packages
+            if folder_sizes.get(get_remote_obb_path(package), 0) > 0
+        ),
+        key=lambda item: item[1],
+        reverse=True,
     )
-    if not adb_interface.path_exists(device_name, lib.config.QUEST_OBB_DIRECTORY):
-        adb_interface.make_dir(device_name, lib.config.QUEST_OBB_DIRECTORY)
-    # copy the sub data folders into the remote OBB path
-    for subpath in apk_dir.data_dirs:
-        await adb_interface.copy_path(
-            device_name, subpath, lib.config.QUEST_OBB_DIRECTORY
+    # the smallest single package that is enough on its own
+    for package, size in reversed(removable):
+        if size >= shortfall:
+            return [(package, size)]
+    chosen: List[Tuple[str, int]] = []
+    for package, size in removable:
+        chosen.append((package, size))
+        shortfall -= size
+        if shortfall <= 0 or len(chosen) >= MAX_REMOVAL_SUGGESTIONS:
+            break
+    return chosen
+
+
+async def check_storage(
+    device_name: str,
+    apk_dirs: Iterable[lib.utils.ApkPath],
+    headroom: int = STORAGE_HEADROOM,
+) -> StorageCheck:
+    """checks the device has room for the bundles before anything is copied. The free
+    space, the data files already on the device and the installed packages are read in
+    one shell session
+
+    Args:
+        device_name (str): the device to install to
+        apk_dirs (Iterable[ApkPath]): the bundles that are going to be installed
+        headroom (int, optional): bytes to leave free. Defaults to STORAGE_HEADROOM.
+
+    Raises:
+        InsufficientStorageError: if the bundles wont fit. It names packages that could be
+        uninstalled to make room
+        RemoteDeviceError: if df failed on the device
+
+    Returns:
+        StorageCheck: the space needed and the space free
+    """
+    obb_directory = lib.config.QUEST_OBB_DIRECTORY.rstrip("/")
+    df, du, pm = await adb_interface.async_shell_batch(
+        device_name,
+        [
+            ["df", "-k", lib.config.QUEST_ROOT],
+            ["du", "-k", "-d", "1", obb_directory],
+            ["pm", "list", "packages", "-3"],
+        ],
+        idempotent=True,
+    )
+    if df.returncode != 0:
+        raise RemoteDeviceError(df)
+    storage = parse_df_output(df.stdout.decode("utf-8", errors="replace"))
+    if storage is None:
+        # dont stop an install that may well fit
+        _Log.warning(f"Unable to read the free storage of {device_name}")
+        return StorageCheck(0, 0, 0)
+    free = storage[1]
+    # du fails if the OBB directory doesnt exist yet. Nothing is on the device then
+    folder_sizes = parse_du_output(du.stdout.decode("utf-8", errors="replace"))
+    required = headroom
+    skippable = 0
+    destinations: List[str] = []
+    for apk_dir in apk_dirs:
+        required += sum(
+            _local_size(path) for path in [apk_dir.path] + apk_dir.split_paths
         )
-    # copy the sub files into the remote OBB directory
-    for subfile in apk_dir.file_paths:
+        for local_path in apk_dir.data_dirs + apk_dir.file_paths:
+            remote_path = get_remote_obb_path(local_path)
+            destinations.append(remote_path)
+            size = _local_size(local_path)
+            on_device = folder_sizes.get(remote_path, 0)
+            required += max(size - on_device, 0)
+            skippable += min(size, on_device)
+    if required > free:
+        packages = [
+            line.strip().removeprefix("package:")
+            for line in pm.stdout.decode("utf-8", errors="replace").splitlines()
+            if line.strip()
+        ]
+        packages = [
+            package
+            for package in packages
+            if get_remote_obb_path(package) not in destinations
+        ]
+        raise InsufficientStorageError(
+            device_name,
+            required,
+            free,
+            _choose_removable(folder_sizes, packages, required - free),
+        )
+    return StorageCheck(required, free, skippable)
+
+
+async def push_obb_files(
+    device_name: str,
+    apk_dir: lib.utils.ApkPath,
+    progress_callback: TransferProgressFunction | None = None,
+    on_push_started: Callable[[str], None] | None = None,
+    verify_hash: bool = False,
+    on_file_synced: FileSyncedFunction | None = None,
+    fan_out_group: FanOutGroup | None = None,
+) -> TransferProgress:
+    """copies the data folders and files of the apk bundle into the OBB directory. Files
+    already on the device with the same size and modified time are skipped so a reinstall
+    only copies what changed. Data folders of bundles find_install_dirs picked the tar
+    transfer mode for are streamed as a tar archive
+
+    Args:
+        device_name (str): the name of the device to copy to
+        apk_dir (ApkPath): the apk bundle the data paths belong to
+        progress_callback (TransferProgressFunction, optional): recieves the progress across
+        all of the OBB paths. Defaults to None.
+        on_push_started (Callable[[str], None], optional): called with the remote path before
+        each path is copied so partial copies can be cleaned up. Defaults to None.
+        verify_hash (bool, optional): compare the md5 of files before skipping them. Defaults to False.
+        on_file_synced (FileSyncedFunction, optional): called with the remote path and size of
+        each data file once it is on the device. Defaults to None.
+        fan_out_group (FanOutGroup, optional): shares the reads of the data files with the
+        other devices the bundle is being installed to. Defaults to None.
+
+    Returns:
+        TransferProgress: the bytes and files copied and skipped across all of the OBB paths
+    """
+    await async_create_obb_path(device_name)
+    obb_paths = apk_dir.data_dirs + apk_dir.file_paths
+    overall = _ObbProgress(obb_paths, progress_callback)
+    use_tar = apk_dir.transfer_mode == lib.utils.TRANSFER_MODE_TAR
+    # copy the sub data folders and files into the remote OBB path
+    for obb_path in obb_paths:
+        if on_push_started:
+            on_push_started(get_remote_obb_path(obb_path))
         await adb_interface.copy_path(
             device_name=device_name,
-            local_path=subfile,
+            local_path=obb_path,
             destination_path=lib.config.QUEST_OBB_DIRECTORY,
+            progress_callback=overall.update,
+            skip_unchanged=True,
+            verify_hash=verify_hash,
+            on_file_synced=on_file_synced,
+            compress=True,
+            tar=use_tar,
+            fan_out_group=fan_out_group,
         )
-    callback(f"{apk_name} has been installed.\n")
+        overall.next_path()
+    return overall.totals()
 
 
-async def async_get_newly_installed_packages(
-    device_name: str, original_packages: List[str]
-) -> List[str]:
-    """compares original list of packages with most recent and returns the difference
-    hackish way of finding recently installed package names
+def format_push_totals(progress: TransferProgress) -> str:
+    """a status line with how much was copied and how much was already on the device
 
     Args:
-        device_name (str): the name of the Quest device
-        original_packages (List[str]): the list of packages before the new packages were installed
+        progress (TransferProgress): the totals returned by push_obb_files
 
     Returns:
-        Set[str]: returns a set of newly installed packages
+        str:
     """
-    new_packages = await adb_interface.get_installed_packages(device_name)
-    original_set = set(original_packages)
-    new_set = set(new_packages)
-    packages = new_set - original_set
-    return list(packages)
+    sent = lib.utils.format_size(float(progress.bytes_sent))
+    skipped = lib.utils.format_size(float(progress.bytes_skipped))
+    return (
+        f"Copied {sent} in {progress.files_sent} file(s). "
+        f"Skipped {skipped} in {progress.files_skipped} file(s) already on the device"
+    )
+
+
+class _ObbProgress:
+    def __init__(
+        self, obb_paths: List[str], callback: TransferProgressFunction | None
+    ) -> None:
+        """adds up the progress of each copy_path call so the callback sees a single transfer
+
+        Args:
+            obb_paths (List[str]): the folders and files that are going to be pushed
+            callback (TransferProgressFunction | None): recieves the combined progress
+        """
+        self.callback = callback
+        self.completed = TransferProgress(0, 0, 0.0, "", 0, 0)
+        self.last: TransferProgress | None = None
+        total_bytes = 0
+        total_files = 0
+        for path in obb_paths:
+            if os.path.isdir(path):
+                total_bytes += lib.utils.get_folder_size(path)
+                total_files += sum(len(files) for _, _, files in os.walk(path))
+            elif os.path.exists(path):
+                total_bytes += os.path.getsize(path)
+                total_files += 1
+        self.total_bytes = total_bytes
+        self.total_files = total_files
+        # the rates carry on across the paths instead of starting again with each one
+        self.meter = RateMeter()
+
+    def _combined(self, progress: TransferProgress) -> TransferProgress:
+        return TransferProgress(
+            bytes_sent=self.completed.bytes_sent + progress.bytes_sent,
+            total_bytes=self.total_bytes,
+            elapsed=self.completed.elapsed + progress.elapsed,
+            current_file=progress.current_file,
+            files_sent=self.completed.files_sent + progress.files_sent,
+            total_files=self.total_files,
+            bytes_skipped=self.completed.bytes_skipped + progress.bytes_skipped,
+            files_skipped=self.completed.files_skipped + progress.files_skipped,
+        )
+
+    def update(self, progress: TransferProgress) -> None:
+        self.last = progress
+        if self.callback:
+            combined = self._combined(progress)
+            self.meter.update(combined.bytes_sent)
+            self.meter.apply(combined)
+            self.callback(combined)
+
+    def next_path(self) -> None:
+        """call once each path has been pushed"""
+        if self.last is None:
+            return
+        self.completed = self._combined(self.last)
+        self.last = None
+
+    def totals(self) -> TransferProgress:
+        """the combined progress of the paths pushed so far"""
+        return self._combined(TransferProgress(0, 0, 0.0, "", 0, 0))
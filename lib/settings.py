@@ -29,6 +29,11 @@ class Settings(BaseModel):
     remove_files_after_install: bool = False
     close_dialog_after_install: bool = False
     download_only: bool = False
+    max_concurrent_installs: int = 2
+    verify_data_file_hashes: bool = False
+    install_to_all_devices: bool = False
+    max_concurrent_devices: int = 4
+    max_devices_per_hub: int = 2
     uuid: UUID = Field(default_factory=uuid4)
     auth: Auth | None = None
 
@@ -0,0 +1,25 @@
+from lib.install_journal import InstallJournal
+
+
+def test_journal_survives_a_reload(tmp_path):
+    apk_path = tmp_path / "game.apk"
+    apk_path.write_bytes(b"apk")
+    path = str(tmp_path / "journal.json")
+    journal = InstallJournal(path)
+    journal.start_bundle("QUEST-1", str(apk_path))
+    journal.apk_installed("QUEST-1", str(apk_path), ["com.fake.game"])
+    journal.flush()
+
+    record = InstallJournal.load(path).start_bundle("QUEST-1", str(apk_path))
+    assert record.packages == ["com.fake.game"]
+
+    # a new download of the apk starts over
+    apk_path.write_bytes(b"new apk")
+    record = InstallJournal.load(path).start_bundle("QUEST-1", str(apk_path))
+    assert not record.apk_installed
+
+
+def test_unreadable_journal_is_empty(tmp_path):
+    path = tmp_path / "journal.json"
+    path.write_text('{"version": 1, "devices": {"QUEST-1": ')
+    assert InstallJournal.load(str(path)).get("QUEST-1", "game.apk") is None
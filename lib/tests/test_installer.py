@@ -0,0 +1,183 @@
+import asyncio
+import os
+
+import pytest
+
+import adblib.adb_interface as adb_interface
+import lib.debug  # lib.quest has to be imported through lib.debug
+import lib.installer
+import lib.utils
+from adblib.fake_server import FakeAdbServer, FakeDevice, make_apk
+from lib.install_journal import InstallJournal
+
+
+def make_bundle(root, name: str) -> lib.utils.ApkPath:
+    bundle_dir = root / name
+    obb_dir = bundle_dir / f"com.fake.{name}"
+    obb_dir.mkdir(parents=True)
+    (obb_dir / "main.obb").write_bytes(os.urandom(100000))
+    apk_path = bundle_dir / f"{name}.apk"
+    apk_path.write_bytes(make_apk(f"com.fake.{name}"))
+    return lib.utils.ApkPath(
+        root=str(bundle_dir),
+        path=str(apk_path),
+        data_dirs=[str(obb_dir)],
+        file_paths=[],
+    )
+
+
+@pytest.fixture
+def quest():
+    device = FakeDevice("QUEST-1")
+    yield device
+    device.remove()
+
+
+@pytest.mark.asyncio
+async def test_installs_every_bundle_and_cleans_up(quest, tmp_path, monkeypatch):
+    bundles = [make_bundle(tmp_path, name) for name in ("alpha", "beta", "gamma")]
+    messages = []
+    async with FakeAdbServer([quest]) as server:
+        monkeypatch.setattr(adb_interface, "ADB_DEFAULT_PORT", server.port)
+        installer = lib.installer.ConcurrentInstaller(
+            "QUEST-1", messages.append, max_concurrent=2
+        )
+        await installer.install(bundles)
+        packages = await adb_interface.get_installed_packages("QUEST-1")
+        assert len(packages) == 3
+        for name in ("alpha", "beta", "gamma"):
+            assert os.path.isfile(
+                quest.local_path(f"/sdcard/Android/obb/com.fake.{name}/main.obb")
+            )
+            assert f"[{name}.apk] Installed" in messages
+        await installer.cleanup()
+        assert await adb_interface.get_installed_packages("QUEST-1") == []
+    assert os.listdir(quest.local_path("/sdcard/Android/obb")) == []
+
+
+@pytest.mark.asyncio
+async def test_resumes_from_the_journal_after_an_error(quest, tmp_path, monkeypatch):
+    bundle = make_bundle(tmp_path, "alpha")
+    journal = InstallJournal(str(tmp_path / "journal.json"))
+    copy_path = adb_interface.copy_path
+
+    async def pulled_cable(*args, **kwargs):
+        raise ConnectionResetError("device went away")
+
+    messages = []
+    async with FakeAdbServer([quest]) as server:
+        monkeypatch.setattr(adb_interface, "ADB_DEFAULT_PORT", server.port)
+        monkeypatch.setattr(adb_interface, "copy_path", pulled_cable)
+        installer = lib.installer.ConcurrentInstaller(
+            "QUEST-1", messages.append, journal=journal
+        )
+        with pytest.raises(ConnectionResetError):
+            await installer.install([bundle])
+        # the apk is left on the device for the next attempt
+        assert await adb_interface.get_installed_packages("QUEST-1") != []
+        record = InstallJournal.load(journal.path).get("QUEST-1", bundle.path)
+        assert record.apk_installed
+
+        monkeypatch.setattr(adb_interface, "copy_path", copy_path)
+        installer = lib.installer.ConcurrentInstaller(
+            "QUEST-1", messages.append, journal=InstallJournal.load(journal.path)
+        )
+        await installer.install([bundle])
+    assert "[alpha.apk] Apk was installed by an earlier attempt" in messages
+    assert os.path.isfile(
+        quest.local_path("/sdcard/Android/obb/com.fake.alpha/main.obb")
+    )
+    assert InstallJournal.load(journal.path).get("QUEST-1", bundle.path) is None
+
+
+@pytest.mark.asyncio
+async def test_resumes_from_the_journal_after_a_cancel(quest, tmp_path, monkeypatch):
+    bundle = make_bundle(tmp_path, "alpha")
+    journal = InstallJournal(str(tmp_path / "journal.json"))
+    copy_path = adb_interface.copy_path
+    copying = asyncio.Event()
+
+    async def stuck(*args, **kwargs):
+        copying.set()
+        await asyncio.Event().wait()
+
+    messages = []
+    async with FakeAdbServer([quest]) as server:
+        monkeypatch.setattr(adb_interface, "ADB_DEFAULT_PORT", server.port)
+        monkeypatch.setattr(adb_interface, "copy_path", stuck)
+        installer = lib.installer.ConcurrentInstaller(
+            "QUEST-1", messages.append, journal=journal
+        )
+        task = asyncio.create_task(installer.install([bundle]))
+        await copying.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # the apk is kept for the next attempt
+        assert "com.fake.alpha" in await adb_interface.get_installed_packages("QUEST-1")
+
+        monkeypatch.setattr(adb_interface, "copy_path", copy_path)
+        installer = lib.installer.ConcurrentInstaller(
+            "QUEST-1", messages.append, journal=InstallJournal.load(journal.path)
+        )
+        await installer.install([bundle])
+    assert "Install cancelled. Install again to carry on from here" in messages
+    assert "[alpha.apk] Apk was installed by an earlier attempt" in messages
+    assert os.path.isfile(
+        quest.local_path("/sdcard/Android/obb/com.fake.alpha/main.obb")
+    )
+
+
+@pytest.mark.asyncio
+async def test_skips_an_apk_already_installed(quest, tmp_path, monkeypatch):
+    alpha, beta = make_bundle(tmp_path, "alpha"), make_bundle(tmp_path, "beta")
+    # an older beta is updated but not removed on cancel
+    quest.packages += ["com.fake.alpha", "com.fake.beta", "com.other.game"]
+    quest.version_codes["com.fake.beta"] = 0
+    messages = []
+    async with FakeAdbServer([quest]) as server:
+        monkeypatch.setattr(adb_interface, "ADB_DEFAULT_PORT", server.port)
+        installer = lib.installer.ConcurrentInstaller("QUEST-1", messages.append)
+        await installer.install([alpha, beta])
+        assert quest.version_codes["com.fake.beta"] == 1
+        await installer.cleanup()
+    assert "[alpha.apk] Version 1.0 is already installed. Skipping the apk" in messages
+    assert "[beta.apk] Apk installed" in messages
+    assert quest.packages == ["com.fake.alpha", "com.fake.beta", "com.other.game"]
+
+
+@pytest.mark.asyncio
+async def test_stops_before_copying_when_storage_is_full(tmp_path, monkeypatch):
+    bundle = make_bundle(tmp_path, "alpha")
+    quest = FakeDevice("QUEST-1", packages=["com.big.game", "com.small.game"])
+    for package, size in (("com.big.game", 400000), ("com.small.game", 10000)):
+        obb_dir = quest.local_path(f"/sdcard/Android/obb/{package}")
+        os.makedirs(obb_dir)
+        with open(os.path.join(obb_dir, "main.obb"), "wb") as fp:
+            fp.write(bytes(size))
+    # the alpha data files already on the device dont count
+    os.makedirs(quest.local_path("/sdcard/Android/obb/com.fake.alpha"))
+    with open(
+        quest.local_path("/sdcard/Android/obb/com.fake.alpha/main.obb"), "wb"
+    ) as fp:
+        fp.write(bytes(60000))
+    quest.storage_total = 700000
+    try:
+        async with FakeAdbServer([quest]) as server:
+            monkeypatch.setattr(adb_interface, "ADB_DEFAULT_PORT", server.port)
+            check = await lib.quest.check_storage("QUEST-1", [bundle], headroom=0)
+            assert 60000 <= check.skippable < 100000
+            with pytest.raises(lib.quest.InsufficientStorageError) as err:
+                await lib.quest.check_storage(
+                    "QUEST-1", [bundle], headroom=check.free - check.required + 1
+                )
+            assert err.value.removable == [("com.small.game", 10 * 1024)]
+            quest.storage_total = 500000
+            with pytest.raises(lib.quest.InsufficientStorageError) as err:
+                await lib.installer.ConcurrentInstaller("QUEST-1", print).install(
+                    [bundle]
+                )
+            assert "Uninstall com.big.game" in err.value.__str__()
+            assert "com.fake.alpha" not in quest.packages
+    finally:
+        quest.remove()
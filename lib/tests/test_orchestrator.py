@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+import adblib.adb_interface as adb_interface
+import lib.debug  # lib.quest has to be imported through lib.debug
+import lib.orchestrator
+from adblib.fake_server import FakeAdbServer, FakeDevice
+from lib.install_journal import InstallJournal
+from lib.tests.test_installer import make_bundle
+
+
+@pytest.fixture
+def quests():
+    devices = [
+        FakeDevice("QUEST-1", usb="1-4.1"),
+        FakeDevice("QUEST-2", usb="1-4.2"),
+        FakeDevice("QUEST-3", usb="2-1"),
+    ]
+    yield devices
+    for device in devices:
+        device.remove()
+
+
+def test_usb_hub():
+    assert lib.orchestrator.usb_hub("1-4.2") == "1-4"
+    assert lib.orchestrator.usb_hub("1-4.3.1") == "1-4.3"
+    assert lib.orchestrator.usb_hub("2-1") == "usb2"
+    assert lib.orchestrator.usb_hub("") == ""
+
+
+@pytest.mark.asyncio
+async def test_installs_to_every_headset_and_retries_each_one(
+    quests, tmp_path, monkeypatch
+):
+    bundle = make_bundle(tmp_path, "alpha")
+    copy_path = adb_interface.copy_path
+    failures = {"QUEST-2": 1, "QUEST-3": 5}
+
+    async def flaky_cable(device_name, *args, **kwargs):
+        if failures.get(device_name):
+            failures[device_name] -= 1
+            raise ConnectionResetError("device went away")
+        return await copy_path(device_name, *args, **kwargs)
+
+    messages = []
+    updates = []
+    async with FakeAdbServer(quests) as server:
+        monkeypatch.setattr(adb_interface, "ADB_DEFAULT_PORT", server.port)
+        monkeypatch.setattr(adb_interface, "copy_path", flaky_cable)
+        orchestrator = lib.orchestrator.InstallOrchestrator(
+            ["QUEST-1", "QUEST-2", "QUEST-3"],
+            messages.append,
+            updates.append,
+            max_devices_per_hub=1,
+            retry_delay=0,
+            journal=InstallJournal(str(tmp_path / "journal.json")),
+        )
+        errors = await orchestrator.install([bundle])
+    assert errors["QUEST-1"] is None and errors["QUEST-2"] is None
+    assert isinstance(errors["QUEST-3"], ConnectionResetError)
+    assert orchestrator.devices["QUEST-1"].hub == orchestrator.devices["QUEST-2"].hub
+    assert orchestrator.devices["QUEST-2"].attempts == 2
+    assert orchestrator.devices["QUEST-3"].attempts == 3
+    assert "[QUEST-2] [alpha.apk] Apk was installed by an earlier attempt" in messages
+    for device in quests[:2]:
+        assert os.path.isfile(
+            device.local_path("/sdcard/Android/obb/com.fake.alpha/main.obb")
+        )
+    final = updates[-1]
+    assert (final.installed, final.failed, final.percent) == (2, 1, 100.0)
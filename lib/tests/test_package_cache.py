@@ -0,0 +1,45 @@
+import pytest
+
+import adblib.adb_interface as adb_interface
+from adblib.fake_server import FakeAdbServer, FakeDevice
+from lib.package_cache import PackageCache, parse_package_line
+
+
+@pytest.fixture
+def quest():
+    device = FakeDevice("QUEST-1", packages=["com.fake.beta", "com.fake.alpha"])
+    device.version_codes["com.fake.alpha"] = 7
+    yield device
+    device.remove()
+
+
+def test_parse_package_line():
+    assert parse_package_line("com.fake.game versionCode:42") == ("com.fake.game", 42)
+    assert parse_package_line("com.fake.game") == ("com.fake.game", 0)
+
+
+@pytest.mark.asyncio
+async def test_refresh_reports_what_changed(quest, tmp_path, monkeypatch):
+    path = str(tmp_path / "package_cache.json")
+    cache = PackageCache(path)
+    assert cache.get("QUEST-1") is None
+    async with FakeAdbServer([quest]) as server:
+        monkeypatch.setattr(adb_interface, "ADB_DEFAULT_PORT", server.port)
+        diff = await cache.refresh("QUEST-1")
+        assert diff.added == ["com.fake.alpha", "com.fake.beta"]
+        assert not await cache.refresh("QUEST-1")
+
+        quest.packages.remove("com.fake.beta")
+        quest.packages.append("com.fake.gamma")
+        quest.version_codes["com.fake.alpha"] = 8
+        diff = await cache.refresh("QUEST-1")
+    assert (diff.added, diff.removed, diff.updated) == (
+        ["com.fake.gamma"],
+        ["com.fake.beta"],
+        ["com.fake.alpha"],
+    )
+    # shown straight away on the next run
+    assert PackageCache.load(path).get("QUEST-1") == {
+        "com.fake.alpha": 8,
+        "com.fake.gamma": 1,
+    }
@@ -0,0 +1,32 @@
+import pytest
+
+import adblib.adb_interface as adb_interface
+import lib.debug  # lib.quest has to be imported through lib.debug
+import lib.quest
+from adblib.fake_server import FakeAdbServer, FakeDevice
+
+
+@pytest.fixture
+def quest():
+    device = FakeDevice("QUEST-1", storage_total=64 * 1024**3, battery_level=55)
+    yield device
+    device.remove()
+
+
+@pytest.mark.asyncio
+async def test_device_info_cache(quest, monkeypatch):
+    cache = lib.quest.DeviceInfoCache(ttl=60.0)
+    async with FakeAdbServer([quest]) as server:
+        monkeypatch.setattr(adb_interface, "ADB_DEFAULT_PORT", server.port)
+        info = await cache.async_get("QUEST-1")
+        assert info.model == "Quest 2"
+        assert info.battery_level == 55
+        assert info.storage_total == 64 * 1024**3
+        assert 0 < info.storage_free <= info.storage_total
+        assert info.obb_dir_exists == True
+        # served from the cache until it expires or is refreshed
+        quest.battery_level = 20
+        assert (await cache.async_get("QUEST-1")).battery_level == 55
+        assert (await cache.async_get("QUEST-1", refresh=True)).battery_level == 20
+    cache.retain(["QUEST-2"])
+    assert cache.peek("QUEST-1") is None
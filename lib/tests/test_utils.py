@@ -35,3 +35,33 @@ def test_is_connected_to_internet_unix_fail(
     # mock_create_connection.return_value = mock_socket
     assert lib.utils.is_connected_to_internet() == False
     assert mock_sock.close.called == True
+
+
+def test_find_install_dirs_groups_split_apks(tmp_path):
+    game_dir = tmp_path / "game"
+    (game_dir / "com.fake.game").mkdir(parents=True)
+    for name in ("base.apk", "split_config.arm64_v8a.apk", "config.en.apk"):
+        (game_dir / name).write_bytes(b"apk")
+    (apk_path,) = list(lib.utils.find_install_dirs(str(tmp_path)))
+    assert apk_path.path == str(game_dir / "base.apk")
+    assert apk_path.data_dirs == [str(game_dir / "com.fake.game")]
+    assert apk_path.split_paths == [
+        str(game_dir / "config.en.apk"),
+        str(game_dir / "split_config.arm64_v8a.apk"),
+    ]
+
+
+def test_find_install_dirs_picks_tar_for_many_small_files(tmp_path):
+    game_dir = tmp_path / "game"
+    obb_dir = game_dir / "com.fake.game"
+    obb_dir.mkdir(parents=True)
+    (game_dir / "base.apk").write_bytes(b"apk")
+    (obb_dir / "main.obb").write_bytes(b"x" * 4096)
+    (apk_path,) = list(lib.utils.find_install_dirs(str(tmp_path)))
+    assert apk_path.transfer_mode == lib.utils.TRANSFER_MODE_SYNC
+    for index in range(lib.utils.TAR_MIN_FILE_COUNT):
+        (obb_dir / f"asset{index}.bin").write_bytes(b"x" * 100)
+    (apk_path,) = list(lib.utils.find_install_dirs(str(tmp_path)))
+    assert apk_path.data_file_count == lib.utils.TAR_MIN_FILE_COUNT + 1
+    assert apk_path.data_size == 4096 + 100 * lib.utils.TAR_MIN_FILE_COUNT
+    assert apk_path.transfer_mode == lib.utils.TRANSFER_MODE_TAR
@@ -5,14 +5,24 @@ import logging
 import platform
 import datetime
 import base64
-from typing import List, Generator
-from dataclasses import dataclass
+from typing import List, Generator, Tuple
+from dataclasses import dataclass, field
 
 from deluge.handler import MagnetData
 
 
 _Log = logging.getLogger(__name__)
 
+# how the data folders of a bundle are copied onto the device
+TRANSFER_MODE_SYNC = "sync"
+TRANSFER_MODE_TAR = "tar"
+
+# data folders with at least this many files averaging no more than this size are
+# streamed as a tar archive. Files that size spend more time waiting on the device
+# to confirm each one than being sent
+TAR_MIN_FILE_COUNT = 100
+TAR_MAX_AVERAGE_FILE_SIZE = 1024 * 1024
+
 
 @dataclass
 class ApkPath:
@@ -20,6 +30,61 @@ class ApkPath:
     path: str
     data_dirs: List[str]
     file_paths: List[str]
+    # split apks that have to be installed in the same session as the base apk
+    split_paths: List[str] = field(default_factory=list)
+    # totals of the files in the data folders
+    data_file_count: int = 0
+    data_size: int = 0
+    transfer_mode: str = TRANSFER_MODE_SYNC
+
+
+def choose_transfer_mode(file_count: int, total_size: int) -> str:
+    """picks how data folders are copied from the number of files in them and their
+    average size
+
+    Args:
+        file_count (int): the files in the data folders
+        total_size (int): their size in bytes
+
+    Returns:
+        str: TRANSFER_MODE_TAR for lots of small files otherwise TRANSFER_MODE_SYNC
+    """
+    if file_count < TAR_MIN_FILE_COUNT:
+        return TRANSFER_MODE_SYNC
+    if total_size / file_count > TAR_MAX_AVERAGE_FILE_SIZE:
+        return TRANSFER_MODE_SYNC
+    return TRANSFER_MODE_TAR
+
+
+def count_files(folder_path: str) -> Tuple[int, int]:
+    """counts the files under a folder
+
+    Args:
+        folder_path (str): The path to the folder.
+
+    Returns:
+        Tuple[int, int]: the number of files and their size in bytes
+    """
+    file_count = 0
+    size = 0
+    for root, _dirs, files in os.walk(folder_path):
+        for name in files:
+            file_count += 1
+            size += os.path.getsize(os.path.join(root, name))
+    return file_count, size
+
+
+def is_split_apk(filename: str) -> bool:
+    """checks the filename for the prefixes bundletool gives split apks
+    ie. split_config.arm64_v8a.apk or config.en.apk
+
+    Args:
+        filename (str): the name of the apk file
+
+    Returns:
+        bool: True if the apk is a split of a base apk
+    """
+    return filename.lower().startswith(("split_", "config."))
 
 
 def is_connected_to_internet() -> bool:
@@ -106,6 +171,31 @@ def get_folder_size(folder_path: str) -> int:
     return size
 
 
+def write_file_atomic(path: str, text: str) -> None:
+    """writes the text to a temp file next to path, flushes it to disk and then swaps it
+    in place of path. A crash leaves either the old file or the new one, never half of one
+
+    Args:
+        path (str): the file to write
+        text (str): the contents of the file
+    """
+    folder = os.path.dirname(path) or os.curdir
+    os.makedirs(folder, exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as fp:
+        fp.write(text)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(temp_path, path)
+    if os.name != "nt":
+        # windows cant open a folder to flush the rename
+        dir_fd = os.open(folder, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
 def format_size(size: float) -> str:
     """formats the size of bytes into a formatted string representation
 
@@ -122,6 +212,25 @@ def format_size(size: float) -> str:
     return f"{size:.1f} TBytes"
 
 
+def format_duration(seconds: float) -> str:
+    """formats a number of seconds as hours and minutes or minutes and seconds
+
+    Args:
+        seconds (float): the duration
+
+    Returns:
+        str: ie. 1h 05m, 3m 20s or 42s
+    """
+    seconds = max(int(round(seconds)), 0)
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    if hours:
+        return f"{hours}h {minutes:02d}m"
+    if minutes:
+        return f"{minutes}m {seconds:02d}s"
+    return f"{seconds}s"
+
+
 def find_install_dirs(root_dir: str) -> Generator[ApkPath, None, None]:
     """
     Generator function that scans the root_dir looking for APK files and data subfolders.
@@ -138,29 +247,49 @@ def find_install_dirs(root_dir: str) -> Generator[ApkPath, None, None]:
 
     # Walk through the directory tree.
     for root, dirs, files in os.walk(root_dir):
-        # Check each file in the current directory.
-        for file in files:
-            # If the file ends in .apk, it's an APK file.
-            if file.endswith(".apk"):
-                apk_path = os.path.join(root, file)
-                # If we haven't seen this APK file before, process it.
-                if apk_path not in apk_files:
-                    # Create lists to store paths to data directories and files.
-                    data_dirs: List[str] = []
-                    file_paths: List[str] = []
-                    apk_dir = os.path.dirname(apk_path)
-                    # Loop through all subdirectories of the APK directory.
-                    for sub_dir in os.listdir(apk_dir):
-                        sub_path = os.path.join(apk_dir, sub_dir)
-                        # If the subdirectory is a data directory (not the APK file itself), store its path.
-                        if os.path.isdir(sub_path) and sub_path != apk_path:
-                            data_dirs.append(sub_path)
-                    # Add the APK file to the set of seen files.
-                    apk_files.add(apk_path)
-                    # Create an ApkPath object with the APK file path and list of data directory paths.
-                    apk_file = ApkPath(root, apk_path, data_dirs, file_paths)
-                    # Yield the ApkPath object to the caller.
-                    yield apk_file
+        # split apks are installed alongside the base apk in the same folder
+        apk_names = sorted(file for file in files if file.endswith(".apk"))
+        split_names = [file for file in apk_names if is_split_apk(file)]
+        base_names = [file for file in apk_names if not is_split_apk(file)]
+        split_paths = [os.path.join(root, file) for file in split_names]
+        # Check each base apk in the current directory.
+        for file in base_names:
+            apk_path = os.path.join(root, file)
+            # If we have seen this APK file before, skip it.
+            if apk_path in apk_files:
+                continue
+            # Create lists to store paths to data directories and files.
+            data_dirs: List[str] = []
+            file_paths: List[str] = []
+            data_file_count = 0
+            data_size = 0
+            apk_dir = os.path.dirname(apk_path)
+            # Loop through all subdirectories of the APK directory.
+            for sub_dir in os.listdir(apk_dir):
+                sub_path = os.path.join(apk_dir, sub_dir)
+                # If the subdirectory is a data directory (not the APK file itself), store its path.
+                if os.path.isdir(sub_path) and sub_path != apk_path:
+                    data_dirs.append(sub_path)
+                    file_count, size = count_files(sub_path)
+                    data_file_count += file_count
+                    data_size += size
+            # Add the APK file to the set of seen files.
+            apk_files.add(apk_path)
+            # the splits can only be matched to the base apk if it is the only one in the folder
+            splits = split_paths if len(base_names) == 1 else []
+            # Create an ApkPath object with the APK file path and list of data directory paths.
+            apk_file = ApkPath(
+                root,
+                apk_path,
+                data_dirs,
+                file_paths,
+                splits,
+                data_file_count,
+                data_size,
+                choose_transfer_mode(data_file_count, data_size),
+            )
+            # Yield the ApkPath object to the caller.
+            yield apk_file
 
 
 def format_timestamp_to_str(timestamp: float, include_hms: bool = False) -> str:
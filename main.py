@@ -31,7 +31,14 @@ async def _main():
         sys.exit("Unable to locate the Deluge Daemon. Please reinstall Deluge Torrent")
     multiprocessing.freeze_support()
     # initialize the apps global options before the App is created
-    QuestCaveApp.init_global_options(args.debug, args.skip, args.localhost)
+    QuestCaveApp.init_global_options(
+        args.debug,
+        args.skip,
+        args.localhost,
+        record_adb=args.record_adb,
+        replay_adb=args.replay_adb,
+        replay_speed=args.replay_speed,
+    )
     app = QuestCaveApp()
     # catch any unhandled exceptions in the event loop
     asyncio.get_event_loop().set_exception_handler(config.async_log_handler)
@@ -53,6 +60,8 @@ async def _main():
         adb_interface.close_adb()
         app.monitoring_device_thread.stop()
         progress.Destroy()
+    if adb_interface.RECORDER is not None:
+        adb_interface.RECORDER.close()
     # import atexit
 
     # def run_setup():
@@ -12,14 +12,17 @@ import lib.config as config
 import lib.tasks
 import lib.debug as debug
 import lib.quest
+import lib.orchestrator
 import ui.utils
 import api.client
 import api.schemas
 import api.urls
 import deluge.handler
 import adblib.adb_interface as adb_interface
+from adblib import flight_recorder
 from lib.settings import Settings
-from adblib.errors import RemoteDeviceError, UnInstallError
+from lib.install_journal import InstallJournal
+from adblib.errors import RemoteDeviceError
 from api.schemas import LogErrorRequest
 
 import ui.dialogs.device_list as dld
@@ -80,7 +83,7 @@ class QuestCaveApp(wxasync.WxAsyncApp):
                 )
                 # clear the package list
                 if self.install_listpanel is not None:
-                    wx.CallAfter(self.install_listpanel.listctrl.DeleteAllItems)
+                    wx.CallAfter(self.install_listpanel.clear)
             elif event["event"] == "error":
                 wx.CallAfter(self.exception_handler, err=event["exception"])
             elif event["event"] == "device-names-changed":
@@ -160,11 +163,29 @@ class QuestCaveApp(wxasync.WxAsyncApp):
         self.statusbar.SetStatusText(text=text)
 
     @staticmethod
-    def init_global_options(debug: bool, skip: bool, localhost: bool) -> None:
-        """sets the global debug and skip flags"""
+    def init_global_options(
+        debug: bool,
+        skip: bool,
+        localhost: bool,
+        record_adb: bool = False,
+        replay_adb: str = "",
+        replay_speed: float = 1.0,
+    ) -> None:
+        """sets the global debug and skip flags and starts recording or replaying the
+        adb commands"""
         QuestCaveApp.debug_mode = debug
+        # log any adb call that holds up the event loop
+        adb_interface.WARN_BLOCKING_CALLS = debug
         QuestCaveApp.skip = skip
         QuestCaveApp.local_host = localhost
+        if replay_adb:
+            adb_interface.REPLAYER = flight_recorder.Replayer.load(
+                replay_adb, replay_speed
+            )
+        elif record_adb:
+            adb_interface.RECORDER = flight_recorder.FlightRecorder(
+                config.APP_ADB_TRACE_PATH
+            )
 
     def OnInit(self) -> bool:
         """app has loaded create the main frame
@@ -239,7 +260,8 @@ class QuestCaveApp(wxasync.WxAsyncApp):
 
         # check that a device is selected
         selected_device = self.monitoring_device_thread.get_selected_device()
-        if not self.debug_mode and not selected_device:
+        install_to_all = Settings.load().install_to_all_devices
+        if not self.debug_mode and not selected_device and not install_to_all:
             wx.MessageBox(
                 "No device selected. Please connect your Quest Headset into the PC and select it from the Devices List",
                 "No Device selected",
@@ -272,16 +294,6 @@ class QuestCaveApp(wxasync.WxAsyncApp):
         # check if user wants to continue to install step and make sure that download went ok
 
         if not settings.download_only and ok_to_install:
-            # take a snap shot of the packages before the install
-            if not self.debug_mode:
-                quest_packages = await adb_interface.get_installed_packages(
-                    selected_device
-                )
-            else:
-                quest_packages = debug.get_device(
-                    debug.FakeQuest.devices, selected_device
-                ).package_names
-
             # run the install step and keep the screen awake
             with keepawake(keep_screen_awake=True):
                 install_task = lib.tasks.check_task_and_create(
@@ -290,44 +302,9 @@ class QuestCaveApp(wxasync.WxAsyncApp):
                 try:
                     await asyncio.wait_for(install_task, timeout=None)
                 except asyncio.CancelledError:
-                    # User pressed the cancel button
+                    # User pressed the cancel button. Each headset has stopped by the
+                    # time the task is cancelled and the next install carries on from it
                     self.on_install_update("Installation Cancelled")
-                    self.on_install_update("Removing Packages...")
-                    try:
-                        await self.cleanup_from_cancel_installation(
-                            selected_device, magnet_data.download_path, quest_packages
-                        )
-                    except Exception as err:
-                        self.exception_handler(err=err)
-
-    async def cleanup_from_cancel_installation(
-        self, device_name: str, download_path: str, quest_packages: List[str]
-    ) -> None:
-        """finds any new installed packages and removes them, then removes the data files
-        from the device_name
-
-        Args:
-            device_name (str): the selected device
-            download_path (str): the path where the files were downloaded to
-            quest_packages (List[str]): the original list of package names before the install
-
-        """
-        if self.debug_mode:
-            self.on_install_update("Skipping cleanup as running Debug Mode")
-            return
-        # get the Device name to remove the files and packages from
-        # remove the packages first
-        packages_to_remove = await lib.quest.async_get_newly_installed_packages(
-            device_name, quest_packages
-        )
-        for package_to_remove in packages_to_remove:
-            self.on_install_update(f"Removing {package_to_remove}")
-            try:
-                await adb_interface.uninstall(device_name, package_to_remove)
-            except (RemoteDeviceError, UnInstallError) as err:
-                self.on_install_update(f"Error uninstalling: {err.__str__()}")
-            else:
-                self.on_install_update(f"Removed {package_to_remove}")
 
     async def start_install_process(self, path: str) -> bool:
         """starts the install process communicates with ADB and pushes any data paths onto
@@ -348,7 +325,10 @@ class QuestCaveApp(wxasync.WxAsyncApp):
         self.install_dialog = InstallProgressDlg(self.frame)
         self.install_dialog.Show()
 
-        if not self.monitoring_device_thread.get_selected_device():
+        install_to_all = Settings.load().install_to_all_devices
+        if not self.monitoring_device_thread.get_selected_device() and (
+            self.debug_mode or not install_to_all
+        ):
             ui.utils.show_error_message("No Device selected. Cannot install")
             return False
         try:
@@ -364,15 +344,33 @@ class QuestCaveApp(wxasync.WxAsyncApp):
                     total_time_range=(62.0, 65.0),
                 )
             else:
-                # loop through all the sub directories searching for apk files
-                # for every apk file found copy the sub folders to the OBB directory
-                # on the Quest device
-                for apk_dir in lib.utils.find_install_dirs(path):
-                    await lib.quest.install_game(
-                        callback=self.on_install_update,
-                        device_name=self.monitoring_device_thread.get_selected_device(),
-                        apk_dir=apk_dir,
+                # search all the sub directories for apk files and install them
+                # alongside their data folders. Bundles are installed side by side
+                # and so are the headsets
+                settings = Settings.load()
+                device_names = await self.get_install_device_names(settings)
+                if not device_names:
+                    ui.utils.show_error_message("No Headsets connected. Cannot install")
+                    return False
+                orchestrator = lib.orchestrator.InstallOrchestrator(
+                    device_names,
+                    callback=self.on_install_update,
+                    progress_callback=self.on_fleet_update,
+                    max_concurrent_devices=settings.max_concurrent_devices,
+                    max_devices_per_hub=settings.max_devices_per_hub,
+                    max_concurrent_bundles=settings.max_concurrent_installs,
+                    verify_hash=settings.verify_data_file_hashes,
+                    journal=InstallJournal.load(),
+                )
+                errors = await orchestrator.install(lib.utils.find_install_dirs(path))
+                failed = {name: err for name, err in errors.items() if err is not None}
+                if failed:
+                    installed = len(errors) - len(failed)
+                    self.on_install_update(
+                        f"Installed to {installed} of {len(errors)} headset(s). "
+                        f"Failed on {', '.join(failed)}"
                     )
+                    raise next(iter(failed.values()))
         except Exception as err:
             self.on_install_update(f"Error: {err.__str__()}. Installation has quit")
             self.exception_handler(err)
@@ -390,7 +388,10 @@ class QuestCaveApp(wxasync.WxAsyncApp):
                     self.on_install_update("Files removed")
 
             # check listpanel exists and reload the package listctrl
-            if self.install_listpanel is not None:
+            if (
+                self.install_listpanel is not None
+                and self.monitoring_device_thread.get_selected_device()
+            ):
                 await self.install_listpanel.load(
                     self.monitoring_device_thread.get_selected_device()
                 )
@@ -403,6 +404,22 @@ class QuestCaveApp(wxasync.WxAsyncApp):
                 self.on_install_update("Installation has completed. Enjoy!!")
         return True
 
+    async def get_install_device_names(self, settings: Settings) -> List[str]:
+        """the headsets to install to. Every connected headset if the setting is on
+        otherwise only the selected one
+
+        Args:
+            settings (Settings): the loaded settings
+
+        Returns:
+            List[str]: the serials of the headsets
+        """
+        selected_device = self.monitoring_device_thread.get_selected_device()
+        if not settings.install_to_all_devices:
+            return [selected_device] if selected_device else []
+        devices = await adb_interface.async_get_devices()
+        return lib.quest.filter_quest_devices(devices)
+
     async def cleanup_files(self, path: str) -> None:
         """removes the torrent files from the path
 
@@ -448,14 +465,25 @@ class QuestCaveApp(wxasync.WxAsyncApp):
             return
         self.install_dialog.writeline(message)
 
-    async def remove_package(self, package_name: str) -> None:
-        """communicates with the ADB daemon and uninstalls the package from package name
+    def on_fleet_update(self, progress: lib.orchestrator.FleetProgress) -> None:
+        """update the Progress Dialog gauge with the combined progress of the headsets
 
         Args:
-            package_name (str): the name of the package to uninstall
+            progress (FleetProgress): the progress of every headset being installed to
         """
+        if not self.install_dialog:
+            return
+        self.install_dialog.update_fleet(progress)
+
+    async def remove_packages(self, package_names: List[str]) -> None:
+        """uninstalls the packages from the selected device and removes their OBB and
+        data folders. Every package is removed in one go
 
-        if not self.monitoring_device_thread.get_selected_device():
+        Args:
+            package_names (List[str]): the names of the packages to uninstall
+        """
+        device_name = self.monitoring_device_thread.get_selected_device()
+        if not device_name or not package_names:
             return
 
         # dont want to upset mypy. check the listpanel exists
@@ -464,33 +492,39 @@ class QuestCaveApp(wxasync.WxAsyncApp):
         if self.install_listpanel is not None:
             self.install_listpanel.disable_list()
 
-        # notify the user removing the package
+        # notify the user removing the packages
 
         progress = ui.utils.load_progress_dialog(
             self.frame,
-            "Removing Package",
-            f"Removing {package_name} from Device {self.monitoring_device_thread.get_selected_device()}",
+            "Removing Packages",
+            f"Removing {', '.join(package_names)} from Device {device_name}",
         )
         progress.Pulse()
         try:
-            await adb_interface.uninstall(
-                self.monitoring_device_thread.get_selected_device(), package_name
-            )
-        except (RemoteDeviceError, UnInstallError) as err:
+            errors = await lib.quest.uninstall_games(device_name, package_names)
+        except RemoteDeviceError as err:
             self.exception_handler(err)
         except Exception as err:
             asyncio.get_event_loop().call_exception_handler(
                 {"message": err.__str__(), "exception": err}
             )
         else:
-            self.frame.SetStatusText("Uninstall was successful")
+            failed = {name: err for name, err in errors.items() if err is not None}
+            removed = len(package_names) - len(failed)
+            self.frame.SetStatusText(
+                f"Uninstalled {removed} of {len(package_names)} package(s)"
+            )
+            if failed:
+                ui.utils.show_error_message(
+                    "\n".join(
+                        f"{name}: {err.__str__()}" for name, err in failed.items()
+                    )
+                )
 
             # reload the new package list into package listctrl
 
             if self.install_listpanel is not None:
-                await self.install_listpanel.load(
-                    self.monitoring_device_thread.get_selected_device()
-                )
+                await self.install_listpanel.load(device_name)
         finally:
             progress.Destroy()
 
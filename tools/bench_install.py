@@ -0,0 +1,130 @@
+"""benchmarks lib.quest.install_game to many headsets at once using the fake adb server
+
+usage:
+    python tools/bench_install.py [--headsets 1 4 16] [--size-mb 64] [--files 4]
+        [--bandwidth-mb 40] [--latency-ms 1] [--failure-rate 0] [--seed 1]
+
+each headset gets its own link with the bandwidth and latency given so the numbers
+show how well the installs overlap rather than how fast the disk is. With a failure
+rate some requests are dropped and the retries they cost are printed as well. A headset
+is only reported as failed once a step has run out of retries
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import adblib.adb_interface as adb_interface
+import lib.debug  # lib.quest has to be imported through lib.debug
+import lib.quest
+import lib.utils
+from adblib import retry
+from adblib.fake_server import FakeAdbServer, LinkModel, make_apk, make_devices
+
+PACKAGE_NAME = "com.bench.game"
+
+
+def make_bundle(folder: str, total_mb: int, count: int) -> lib.utils.ApkPath:
+    """writes an apk and count obb files adding up to total_mb and finds them the same
+    way a download is"""
+    bundle_dir = os.path.join(folder, "bench")
+    obb_dir = os.path.join(bundle_dir, PACKAGE_NAME)
+    os.makedirs(obb_dir)
+    with open(os.path.join(bundle_dir, "bench.apk"), "wb") as fp:
+        fp.write(make_apk(PACKAGE_NAME, size=1024 * 1024))
+    file_size = total_mb * 1024 * 1024 // count
+    block = os.urandom(1024 * 1024)
+    for index in range(count):
+        with open(os.path.join(obb_dir, f"main.{index}.obb"), "wb") as fp:
+            written = 0
+            while written < file_size:
+                size = min(len(block), file_size - written)
+                fp.write(block[:size])
+                written += size
+    return next(lib.utils.find_install_dirs(folder))
+
+
+async def install_all(serials: List[str], apk_dir: lib.utils.ApkPath) -> List[str]:
+    """installs to every headset at once. Returns the errors"""
+    results = await asyncio.gather(
+        *(
+            lib.quest.install_game(lambda message: None, serial, apk_dir)
+            for serial in serials
+        ),
+        return_exceptions=True,
+    )
+    # the pooled shells belong to this event loop
+    await adb_interface.get_shell_pool().close()
+    return [
+        f"{serial}: {result.__str__()}"
+        for serial, result in zip(serials, results)
+        if isinstance(result, BaseException)
+    ]
+
+
+def bench(headsets: int, apk_dir: lib.utils.ApkPath, link: LinkModel) -> None:
+    devices = make_devices(headsets, link)
+    server = FakeAdbServer(devices)
+    server.start_in_thread()
+    adb_interface.ADB_DEFAULT_PORT = server.port
+    lib.quest.device_info_cache.clear()
+    retry.retry_stats.clear()
+    try:
+        start = time.perf_counter()
+        errors = asyncio.run(
+            install_all([device.serial for device in devices], apk_dir)
+        )
+        elapsed = time.perf_counter() - start
+    finally:
+        server.stop_thread()
+        for device in devices:
+            device.remove()
+    bundle_mb = lib.utils.get_folder_size(apk_dir.root) / 1024 / 1024
+    installed = headsets - len(errors)
+    total_mb = bundle_mb * installed
+    print(
+        f"{headsets:>3} headset(s) {elapsed:7.2f}s  {total_mb / elapsed:8.1f} MB/s total  "
+        f"{total_mb / elapsed / max(installed, 1):7.1f} MB/s each  {installed}/{headsets} installed"
+    )
+    totals = retry.retry_stats.totals()
+    if totals:
+        retries = sum(count for count, _ in totals.values())
+        lost = sum(seconds for _, seconds in totals.values())
+        print(f"{'':>16}{retries} retries costing {lost:.2f}s")
+    for error in errors:
+        print(f"{'':>16}{error}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--headsets", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument(
+        "--bandwidth-mb", type=float, default=40.0, help="MB/s to each headset"
+    )
+    parser.add_argument("--latency-ms", type=float, default=1.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    link = LinkModel(
+        bandwidth=args.bandwidth_mb * 1024 * 1024,
+        latency=args.latency_ms / 1000,
+        failure_rate=args.failure_rate,
+        seed=args.seed,
+    )
+    with tempfile.TemporaryDirectory() as folder:
+        apk_dir = make_bundle(folder, args.size_mb, args.files)
+        for headsets in args.headsets:
+            bench(headsets, apk_dir, link)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""benchmarks the native sync push against adb push using the fake adb server
+
+usage:
+    python tools/bench_push.py [--size-mb 256] [--files 4] [--adb path/to/adb.exe]
+
+adb push is only benchmarked if the path to adb is given. It is pointed at the
+fake server with -P so no headset is needed for either run
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from adblib import adb_sync
+from adblib.fake_server import FakeAdbServer, FakeDevice
+
+SERIAL = "BENCH-1"
+REMOTE_PATH = "/sdcard/Android/obb"
+
+
+def make_files(folder: str, total_mb: int, count: int) -> str:
+    """writes count files of random data adding up to total_mb into a new obb folder"""
+    obb_dir = os.path.join(folder, "com.bench.game")
+    os.makedirs(obb_dir)
+    file_size = total_mb * 1024 * 1024 // count
+    block = os.urandom(1024 * 1024)
+    for index in range(count):
+        with open(os.path.join(obb_dir, f"main.{index}.obb"), "wb") as fp:
+            written = 0
+            while written < file_size:
+                size = min(len(block), file_size - written)
+                fp.write(block[:size])
+                written += size
+    return obb_dir
+
+
+def print_result(name: str, total_bytes: int, elapsed: float) -> None:
+    megabytes = total_bytes / 1024 / 1024
+    print(
+        f"{name:<12} {megabytes:8.1f} MB in {elapsed:6.2f}s  {megabytes / elapsed:8.1f} MB/s"
+    )
+
+
+async def bench_native(server: FakeAdbServer, local_path: str) -> None:
+    updates = 0
+
+    def on_progress(progress: adb_sync.TransferProgress) -> None:
+        nonlocal updates
+        updates += 1
+
+    start = time.perf_counter()
+    progress = await adb_sync.push(
+        server.client(), SERIAL, local_path, REMOTE_PATH, on_progress
+    )
+    print_result("native", progress.bytes_sent, time.perf_counter() - start)
+    print(f"{'':<12} {updates} progress updates")
+
+
+def bench_adb(adb_path: str, port: int, local_path: str, total_bytes: int) -> None:
+    start = time.perf_counter()
+    subprocess.run(
+        [adb_path, "-P", str(port), "-s", SERIAL, "push", local_path, REMOTE_PATH],
+        check=True,
+        capture_output=True,
+    )
+    print_result("adb push", total_bytes, time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--adb", default="", help="path to adb to compare against")
+    args = parser.parse_args()
+
+    device = FakeDevice(SERIAL)
+    server = FakeAdbServer([device])
+    server.start_in_thread()
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            local_path = make_files(folder, args.size_mb, args.files)
+            total_bytes = args.size_mb * 1024 * 1024
+            asyncio.run(bench_native(server, local_path))
+            if args.adb:
+                bench_adb(args.adb, server.port, local_path, total_bytes)
+    finally:
+        server.stop_thread()
+        device.remove()
+
+
+if __name__ == "__main__":
+    main()
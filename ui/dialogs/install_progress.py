@@ -1,8 +1,13 @@
+import os
 import time
+from typing import Tuple
 
 import wx
 
 import lib.tasks
+import lib.utils
+from adblib.adb_sync import TransferProgress
+from lib.orchestrator import FleetProgress
 
 
 class InstallProgressDlg(wx.Dialog):
@@ -50,7 +55,12 @@ class InstallProgressDlg(wx.Dialog):
         )
 
     def _create_controls(self) -> None:
+        # the latest transfer progress waiting to be shown by the main thread
+        self._pending_transfer: Tuple[int, str] = (0, "")
+        self._transfer_posted = False
         self.text_ctrl = wx.TextCtrl(self, style=wx.TE_MULTILINE | wx.TE_READONLY)
+        self.transfer_gauge = wx.Gauge(self, range=100, style=wx.GA_HORIZONTAL)
+        self.transfer_label = wx.StaticText(self, label="")
         self.cancel_button = wx.Button(self, id=wx.ID_CANCEL, label="Cancel")
         self.close_button = wx.Button(self, id=wx.ID_CLOSE, label="Close")
 
@@ -59,10 +69,16 @@ class InstallProgressDlg(wx.Dialog):
         dlg_vbox = wx.BoxSizer(wx.VERTICAL)
         txtctrl_hbox = wx.BoxSizer(wx.HORIZONTAL)
         txtctrl_hbox.Add(self.text_ctrl, 1, wx.EXPAND | wx.ALL, BORDER)
+        transfer_vbox = wx.BoxSizer(wx.VERTICAL)
+        transfer_vbox.Add(
+            self.transfer_gauge, 0, wx.EXPAND | wx.LEFT | wx.RIGHT, BORDER
+        )
+        transfer_vbox.Add(self.transfer_label, 0, wx.EXPAND | wx.ALL, BORDER)
         button_hbox = wx.BoxSizer(wx.HORIZONTAL)
         button_hbox.Add(self.cancel_button, 0, wx.ALL, BORDER)
         button_hbox.Add(self.close_button, 0, wx.ALL, BORDER)
         dlg_vbox.Add(txtctrl_hbox, 1, wx.EXPAND | wx.ALL, BORDER)
+        dlg_vbox.Add(transfer_vbox, 0, wx.EXPAND | wx.ALL, BORDER)
         dlg_vbox.Add(button_hbox, 0, wx.ALIGN_CENTER_HORIZONTAL, BORDER)
         self.SetSizerAndFit(dlg_vbox)
         # resize the dialog after the sizer is set
@@ -87,6 +103,85 @@ class InstallProgressDlg(wx.Dialog):
         text += "\n"
         wx.CallAfter(self.text_ctrl.AppendText, text=text)
 
+    @staticmethod
+    def _format_rates(rate: float, smoothed_rate: float, eta: float | None) -> str:
+        """the rate since the last update next to the smoothed rate. A cable that keeps
+        dropping out shows as a now rate that jumps about while a slow device writes at a
+        steady low rate"""
+        now = lib.utils.format_size(rate)
+        smoothed = lib.utils.format_size(smoothed_rate)
+        text = f"{now}/s now, {smoothed}/s over the last few seconds"
+        if eta is not None:
+            text += f". About {lib.utils.format_duration(eta)} left"
+        return text
+
+    def update_transfer(self, progress: TransferProgress) -> None:
+        """shows how much of the data files have been copied and how fast. Safe to call
+        from outside the main thread
+
+        Args:
+            progress (TransferProgress): the progress of the current push
+        """
+        sent = lib.utils.format_size(float(progress.bytes_sent))
+        total = lib.utils.format_size(float(progress.total_bytes))
+        speed = lib.utils.format_size(progress.throughput)
+        files_done = progress.files_sent + progress.files_skipped
+        label = f"Copied {sent} of {total} ({speed}/s average)"
+        if files_done < progress.total_files and progress.current_file:
+            current_file = os.path.basename(progress.current_file)
+            label += (
+                f". File {files_done + 1} of {progress.total_files}: {current_file}"
+            )
+        if progress.bytes_skipped:
+            skipped = lib.utils.format_size(float(progress.bytes_skipped))
+            label += f". Skipped {skipped} already on the headset"
+        rates = self._format_rates(progress.rate, progress.smoothed_rate, progress.eta)
+        self._post_transfer(int(progress.percent), f"{label}\n{rates}")
+
+    def update_fleet(self, progress: FleetProgress) -> None:
+        """shows the combined progress of every headset being installed to. Safe to call
+        from outside the main thread
+
+        Args:
+            progress (FleetProgress): the progress of each headset
+        """
+        if len(progress.devices) == 1:
+            if progress.devices[0].progress is not None:
+                self.update_transfer(progress.devices[0].progress)
+            return
+        done = lib.utils.format_size(float(progress.bytes_done))
+        total = lib.utils.format_size(float(progress.total_bytes))
+        speed = lib.utils.format_size(progress.throughput)
+        label = (
+            f"{progress.installed} of {len(progress.devices)} headsets installed. "
+            f"Copied {done} of {total} ({speed}/s average)"
+        )
+        if progress.failed:
+            label += f". {progress.failed} failed"
+        rates = self._format_rates(progress.rate, progress.smoothed_rate, progress.eta)
+        self._post_transfer(int(progress.percent), f"{label}\n{rates}")
+
+    def _post_transfer(self, percent: int, label: str) -> None:
+        """keeps the latest progress and asks the main thread to show it. Progress that
+        comes in before the main thread gets to it replaces what was waiting so a burst
+        of updates from many headsets is a single redraw"""
+        self._pending_transfer = (percent, label)
+        if self._transfer_posted:
+            return
+        self._transfer_posted = True
+        wx.CallAfter(self._set_transfer)
+
+    def _set_transfer(self) -> None:
+        # the dialog may have been destroyed before the CallAfter ran
+        if not self:
+            return
+        self._transfer_posted = False
+        percent, label = self._pending_transfer
+        self.transfer_gauge.SetValue(min(percent, 100))
+        if label != self.transfer_label.GetLabel():
+            self.transfer_label.SetLabel(label)
+            self.Layout()
+
     def _on_cancel_button(self, evt: wx.CommandEvent) -> None:
         """cancel the install is an install task is running
 
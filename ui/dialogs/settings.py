@@ -71,7 +71,17 @@ class SettingsDlg(wx.Dialog):
         )
         installation_sizer.Add(self.download_only_checkbox, 0, wx.ALL, 10)
         installation_sizer.Add(self.delete_files_checkbox, 0, wx.ALL, 10)
+        self.verify_hashes_checkbox = wx.CheckBox(
+            installation_box,
+            label="Compare checksums of data files already on the device (slower)",
+        )
+        self.all_devices_checkbox = wx.CheckBox(
+            installation_box,
+            label="Install to every connected headset at the same time",
+        )
         installation_sizer.Add(self.close_dialog_checkbox, 0, wx.ALL, 10)
+        installation_sizer.Add(self.verify_hashes_checkbox, 0, wx.ALL, 10)
+        installation_sizer.Add(self.all_devices_checkbox, 0, wx.ALL, 10)
 
         # Add the static box sizer to the scrolled window's sizer
         sizer = wx.BoxSizer(wx.VERTICAL)
@@ -109,6 +119,8 @@ class SettingsDlg(wx.Dialog):
         self.download_only_checkbox.SetValue(settings.download_only)
         self.delete_files_checkbox.SetValue(settings.remove_files_after_install)
         self.close_dialog_checkbox.SetValue(settings.close_dialog_after_install)
+        self.verify_hashes_checkbox.SetValue(settings.verify_data_file_hashes)
+        self.all_devices_checkbox.SetValue(settings.install_to_all_devices)
         self.download_path_panel.set_path(settings.download_path)
 
     def save_from_controls(self) -> None:
@@ -117,5 +129,7 @@ class SettingsDlg(wx.Dialog):
         settings.remove_files_after_install = self.delete_files_checkbox.GetValue()
         settings.close_dialog_after_install = self.close_dialog_checkbox.GetValue()
         settings.download_only = self.download_only_checkbox.GetValue()
+        settings.verify_data_file_hashes = self.verify_hashes_checkbox.GetValue()
+        settings.install_to_all_devices = self.all_devices_checkbox.GetValue()
         settings.download_path = self.download_path_panel.get_path()
         settings.save()
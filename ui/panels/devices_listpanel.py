@@ -8,6 +8,8 @@ import ui.utils
 import ui.consts
 import lib.tasks
 import lib.debug as debug
+import lib.quest
+import lib.utils
 from adblib import adb_interface
 from ui.panels.listctrl_panel import ListCtrlPanel, ColumnListType
 from ui.dialogs.fake_device import FakeDeviceDlg
@@ -68,7 +70,12 @@ class DevicesListPanel(ListCtrlPanel):
 
         self.app: QuestCaveApp = wx.GetApp()
         # the device that is currently selected in the listctrl
-        columns: ColumnListType = [{"col": 0, "heading": "Name", "width": 200}]
+        columns: ColumnListType = [
+            {"col": 0, "heading": "Name", "width": 200},
+            {"col": 1, "heading": "Model", "width": 100},
+            {"col": 2, "heading": "Battery", "width": 70},
+            {"col": 3, "heading": "Free Space", "width": 100},
+        ]
         super().__init__(
             parent=parent,
             title="Devices",
@@ -197,9 +204,28 @@ class DevicesListPanel(ListCtrlPanel):
             # everything went ok insert the device names into the device listctrl
             for index, device in enumerate(device_names):
                 wx.CallAfter(self.listctrl.InsertItem, index=index, label=device)
+            if not self.app.debug_mode:
+                await self._load_device_info(device_names)
         finally:
             pass
 
+    async def _load_device_info(self, device_names: List[str]) -> None:
+        """fills in the model, battery and free space from the device info cache
+
+        Args:
+            device_names (List[str]): the devices in the order they were inserted
+        """
+        for index, device_name in enumerate(device_names):
+            try:
+                info = await lib.quest.device_info_cache.async_get(device_name)
+            except adblib.errors.RemoteDeviceError as err:
+                _Log.error(err.__str__())
+                continue
+            battery = "" if info.battery_level is None else f"{info.battery_level}%"
+            free_space = lib.utils.format_size(float(info.storage_free))
+            for column, text in enumerate((info.model, battery, free_space), start=1):
+                wx.CallAfter(self.listctrl.SetItem, index, column, text)
+
     def on_item_double_click(self, evt: wx.ListEvent) -> None:
         """get the selected device name, create an obb path on the remote device
         and load the installed apps
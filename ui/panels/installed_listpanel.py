@@ -1,14 +1,19 @@
+import bisect
 import logging
+from typing import List
 
 import wx
 
 import lib.config
+import lib.package_cache
 import lib.tasks
+import lib.quest
+import lib.utils
 import ui.utils
 import ui.consts
 import lib.debug as debug
 from ui.panels.listctrl_panel import ListCtrlPanel, ColumnListType
-from adblib import adb_interface
+from adblib.errors import RemoteDeviceError
 
 
 _Log = logging.getLogger(__name__)
@@ -29,6 +34,10 @@ class InstalledListPanel(ListCtrlPanel):
         )
 
         self.app.install_listpanel = self
+        self.package_cache = lib.package_cache.PackageCache.load()
+        # the device being shown and its package names in the order they are listed
+        self._device_name = ""
+        self._rows: List[str] = []
 
         btn_panel = self._create_button_panel()
         self.insert_button_panel(btn_panel, 0, flag=wx.ALIGN_RIGHT)
@@ -42,7 +51,7 @@ class InstalledListPanel(ListCtrlPanel):
             "refresh.png", "Refresh Apps on the device", button_panel
         )
         self.bitmap_buttons["uninstall"] = ui.utils.create_bitmap_button(
-            "uninstall.png", "Uninstall App", button_panel
+            "uninstall.png", "Uninstall Selected Apps", button_panel
         )
         self.Bind(
             wx.EVT_BUTTON, self.on_uninstall_click, self.bitmap_buttons["uninstall"]
@@ -53,50 +62,119 @@ class InstalledListPanel(ListCtrlPanel):
         return button_panel
 
     async def load(self, device_name: str) -> None:
-        """get the installed packages from the device_name string using the ADB interface.
-        device_name cannot be empty string
+        """shows the installed packages of the device. The packages last seen on the device
+        are shown straight away then the device is listed in the background and only the
+        rows that changed are updated
 
         Args:
-            device_name (str): the name of the device to get the installed packages from
+            device_name (str): the name of the device to get the installed packages from.
+            An empty string clears the list
 
         Raises:
-            ValueError: device_name is an empty string then exception is raised
-            LookupError: (Debug mode only) if device_name cant be found then this will be raised
+            RemoteDeviceError: if the packages couldnt be listed
         """
-        self.listctrl.DeleteAllItems()
         if not device_name:
+            self.clear()
             return
         if self.app.debug_mode:
             try:
                 fake_quest = debug.get_device(debug.FakeQuest.devices, device_name)
             except LookupError:
                 _Log.error(f"No device found with name {device_name}")
+                self.clear()
                 return
-            else:
-                package_names = fake_quest.package_names
-        else:
-            package_names = await adb_interface.get_installed_packages(
-                device_name, ["-3"]
+            self._device_name = device_name
+            wx.CallAfter(self._show_packages, fake_quest.package_names)
+            return
+        if device_name != self._device_name:
+            self._device_name = device_name
+            cached = self.package_cache.get(device_name)
+            wx.CallAfter(self._show_packages, list(cached or []))
+        diff = await self.package_cache.refresh(device_name)
+        if diff:
+            _Log.info(
+                f"{device_name} packages added: {diff.added} removed: {diff.removed} "
+                f"updated: {diff.updated}"
             )
-        package_names.sort()
-        for index, package_name in enumerate(package_names):
-            wx.CallAfter(self.listctrl.InsertItem, index=index, label=package_name)
+        # the device may have changed while it was being listed
+        if device_name == self._device_name:
+            packages = self.package_cache.get(device_name) or {}
+            wx.CallAfter(self._show_packages, list(packages))
+        await self._show_free_space(device_name)
+
+    def _show_packages(self, package_names: List[str]) -> None:
+        """inserts and removes rows until the list matches the package names. The rows
+        that havent changed are left alone so the selection stays where it was
+
+        Args:
+            package_names (List[str]): the packages that should be listed
+        """
+        diff = lib.package_cache.diff_packages(
+            dict.fromkeys(self._rows, 0), dict.fromkeys(package_names, 0)
+        )
+        if not diff:
+            return
+        self.listctrl.Freeze()
+        try:
+            for package_name in diff.removed:
+                index = bisect.bisect_left(self._rows, package_name)
+                self.listctrl.DeleteItem(index)
+                del self._rows[index]
+            for package_name in diff.added:
+                index = bisect.bisect_left(self._rows, package_name)
+                self.listctrl.InsertItem(index=index, label=package_name)
+                self._rows.insert(index, package_name)
+        finally:
+            self.listctrl.Thaw()
+
+    def clear(self) -> None:
+        """removes every row. The next load shows the cached packages first"""
+        self._device_name = ""
+        self._rows.clear()
+        self.listctrl.DeleteAllItems()
+
+    async def _show_free_space(self, device_name: str) -> None:
+        """shows the free storage on the device next to the title
+
+        Args:
+            device_name (str): the device the packages were loaded from
+        """
+        try:
+            info = await lib.quest.device_info_cache.async_get(device_name)
+        except RemoteDeviceError as err:
+            _Log.error(err.__str__())
+            return
+        free_space = lib.utils.format_size(float(info.storage_free))
+        total = lib.utils.format_size(float(info.storage_total))
+        wx.CallAfter(self.set_label, f"Installed Games ({free_space} free of {total})")
 
     def on_right_click(self, evt: wx.ListEvent):
         menu = wx.Menu()
-        uninstall_item = menu.Append(wx.ID_ANY, "Uninstall")
+        uninstall_item = menu.Append(wx.ID_ANY, "Uninstall Selected")
         self.Bind(wx.EVT_MENU, self.on_uninstall, uninstall_item)
         self.listctrl.PopupMenu(menu)
 
     def uninstall(self) -> None:
         # handle the uninstall event here
         try:
-            package_name = self.get_package_name()
+            package_names = self.get_package_names()
         except IndexError:
             return
+        dlg = wx.MessageDialog(
+            self,
+            f"Uninstall {len(package_names)} package(s) and remove their data files?\n\n"
+            + "\n".join(package_names),
+            "Uninstall",
+            wx.OK | wx.CANCEL | wx.ICON_WARNING,
+        )
+        dlg.CenterOnParent()
+        result = dlg.ShowModal()
+        dlg.Destroy()
+        if result == wx.ID_CANCEL:
+            return
         try:
             lib.tasks.check_task_and_create(
-                self.app.remove_package, package_name=package_name
+                self.app.remove_packages, package_names=package_names
             )
         except lib.tasks.TaskIsRunning as err:
             wx.MessageBox(err.__str__(), "Uninstall issue")
@@ -107,21 +185,24 @@ class InstalledListPanel(ListCtrlPanel):
     def on_uninstall_click(self, evt: wx.CommandEvent) -> None:
         self.uninstall()
 
-    def get_package_name(self) -> str:
-        """gets the package name from the selected item in the listctrl
+    def get_package_names(self) -> List[str]:
+        """gets the package names of every selected item in the listctrl
 
         Raises:
             IndexError: raises if no package item is selected
 
         Returns:
-            str: package name
+            List[str]: package names in the order they are listed
         """
+        package_names: List[str] = []
         index: int = self.listctrl.GetFirstSelected()
-        if index < 0:
+        while index >= 0:
+            listitem: wx.ListItem = self.listctrl.GetItem(index, 0)
+            package_names.append(listitem.GetText())
+            index = self.listctrl.GetNextSelected(index)
+        if not package_names:
             raise IndexError("No Package selected")
-        listitem: wx.ListItem = self.listctrl.GetItem(index, 0)
-        package_name: str = listitem.GetText()
-        return package_name
+        return package_names
 
     def search_installed_games(self, text: str) -> None:
         """search the installed games for the text string